@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark serial vs multi-process extraction on a synthetic Moodle tree.
+
+    py benchmarks\\bench_extract.py --plugins 2000 --strings 60
+
+Builds <plugins> fake plugin language files in a temporary directory, runs
+scan_files() with 1, 2, 4, ... workers up to the CPU count and prints the
+wall time and speed-up of each run. Every parallel run is checked against the
+serial result, so the benchmark also guards the "identical output" contract.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from src.extract_to_csv import scan_files
+
+
+def make_tree(root: Path, plugins: int, strings: int):
+    tasks = []
+    for i in range(plugins):
+        name = f"plugin{i:05d}"
+        rel = f"local/{name}/lang/en/local_{name}.php"
+        path = root / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        lines = ["<?php", "defined('MOODLE_INTERNAL') || die();"]
+        for j in range(strings):
+            if j % 4 == 3:
+                lines.append(f'$string["k{j}"] = "Value {j} for \\"{name}\\" {{$a->n}}";')
+            else:
+                lines.append(f"$string['k{j}'] = 'Value {j} isn\\'t <b>%s</b> in {name}';")
+        path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+        tasks.append((str(path), rel, f"local_{name}"))
+    return tasks
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--plugins", type=int, default=2000)
+    ap.add_argument("--strings", type=int, default=60)
+    ap.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tasks = make_tree(Path(tmp), args.plugins, args.strings)
+        total = args.plugins * args.strings
+
+        counts = []
+        w = 1
+        while w <= args.max_workers:
+            counts.append(w)
+            w *= 2
+        if counts[-1] != args.max_workers:
+            counts.append(args.max_workers)
+
+        baseline = None
+        serial_time = None
+        print(f"{len(tasks)} files, {total} strings")
+        print(f"{'workers':>8} {'seconds':>9} {'strings/s':>11} {'speed-up':>9}")
+        for workers in counts:
+            t0 = time.perf_counter()
+            result = list(scan_files(tasks, workers=workers))
+            elapsed = time.perf_counter() - t0
+            if baseline is None:
+                baseline, serial_time = result, elapsed
+            elif result != baseline:
+                raise SystemExit(f"Output with {workers} workers differs from serial run")
+            print(f"{workers:>8} {elapsed:>9.3f} {total / elapsed:>11.0f} "
+                  f"{serial_time / elapsed:>8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
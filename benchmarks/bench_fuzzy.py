@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Lookup latency and recall of the fuzzy translation memory (src/fuzzy.py).
+
+    py benchmarks\\bench_fuzzy.py --entries 10000,100000 [--queries 2000] [--brute 100]
+
+For each size an index of synthetic Moodle-like strings (synth_moodle's
+StringMaker) is built, then queried with near-duplicates of random entries
+(one word swapped, dropped or added, a placeholder renamed, punctuation
+added) and with unrelated strings. Reported: build time and traced memory
+of the index, lookup latency (mean, p50, p95, p99) and how often a match at
+or above --threshold is found. For --brute of the queries the best match is
+also found by a linear scan over every entry; recall is the share of those
+that the index finds too, and the scan's latency shows what the LSH buckets
+save.
+"""
+
+import argparse
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+ROOT = HERE.parent
+for p in (str(ROOT), str(HERE)):
+    if p not in sys.path:
+        sys.path.insert(0, p)
+
+from synth_moodle import StringMaker, WORDS, parse_mix, DEFAULT_QUOTE_MIX
+from src.fuzzy import FuzzyIndex, shingles, jaccard
+
+PLACEHOLDERS = ["{$a}", "{$a->name}", "{$a->count}", "{$a->user}", "%s", "%d"]
+
+
+def make_entries(n: int, seed: int = 1):
+    maker = StringMaker(random.Random(seed), 8, 0.3, 0.15, parse_mix(DEFAULT_QUOTE_MIX))
+    sources = list({maker.text() for _ in range(int(n * 1.2))})[:n]
+    return [(s, s.upper()) for s in sources]
+
+
+def mutate(text: str, rng: random.Random) -> str:
+    words = text.split(" ")
+    kind = rng.randrange(5)
+    if kind == 0:
+        words[rng.randrange(len(words))] = rng.choice(WORDS)
+    elif kind == 1 and len(words) > 1:
+        del words[rng.randrange(len(words))]
+    elif kind == 2:
+        words.insert(rng.randrange(len(words) + 1), rng.choice(WORDS))
+    elif kind == 3:
+        for i, w in enumerate(words):
+            if w in PLACEHOLDERS:
+                words[i] = rng.choice(PLACEHOLDERS)
+                break
+        else:
+            words.append(rng.choice(PLACEHOLDERS))
+    else:
+        return text.rstrip(".") + rng.choice([".", "!", ":", "?"])
+    return " ".join(words)
+
+
+def make_queries(entries, n: int, seed: int = 2):
+    rng = random.Random(seed)
+    unrelated = StringMaker(random.Random(seed + 1), 8, 0.3, 0.15, parse_mix(DEFAULT_QUOTE_MIX))
+    # Four near-duplicates for every unrelated string.
+    return [mutate(rng.choice(entries)[0], rng) if i % 5 else unrelated.text()
+            for i in range(n)]
+
+
+def brute_best(grams, query: str, threshold: float):
+    q = shingles(query)
+    best = 0.0
+    for g in grams:
+        sim = jaccard(q, g)
+        if sim > best:
+            best = sim
+    return best if best >= threshold else None
+
+
+def percentile(values, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--entries", default="10000,100000", help="comma-separated index sizes")
+    ap.add_argument("--queries", type=int, default=2000)
+    ap.add_argument("--brute", type=int, default=100, help="queries also checked by a linear scan")
+    ap.add_argument("--threshold", type=float, default=0.6)
+    args = ap.parse_args()
+
+    print(f"{'entries':>8} {'build s':>8} {'index MB':>9} {'mean us':>8} {'p50 us':>8} "
+          f"{'p95 us':>8} {'p99 us':>8} {'found':>6} {'scan us':>9} {'recall':>7}")
+    for n in (int(s) for s in args.entries.split(",")):
+        entries = make_entries(n)
+        queries = make_queries(entries, args.queries)
+
+        t0 = time.perf_counter()
+        index = FuzzyIndex(entries)
+        build = time.perf_counter() - t0
+        tracemalloc.start()
+        traced = FuzzyIndex(entries)
+        index_mb = tracemalloc.get_traced_memory()[0] / 2**20
+        tracemalloc.stop()
+        del traced
+
+        latencies, found = [], {}
+        for q in queries:
+            t = time.perf_counter()
+            match = index.best(q, args.threshold)
+            latencies.append((time.perf_counter() - t) * 1e6)
+            found[q] = match.similarity if match else None
+
+        sample = queries[:args.brute]
+        grams = [shingles(s) for s, _ in entries]
+        t0 = time.perf_counter()
+        truth = [brute_best(grams, q, args.threshold) for q in sample]
+        scan_us = (time.perf_counter() - t0) / max(1, len(sample)) * 1e6
+        expected = [(q, sim) for q, sim in zip(sample, truth) if sim is not None]
+        hits = sum(1 for q, sim in expected if found[q] is not None and found[q] >= sim - 1e-9)
+        recall = hits / len(expected) if expected else 1.0
+
+        print(f"{n:>8} {build:>8.2f} {index_mb:>9.1f} {statistics.mean(latencies):>8.0f} "
+              f"{percentile(latencies, 0.5):>8.0f} {percentile(latencies, 0.95):>8.0f} "
+              f"{percentile(latencies, 0.99):>8.0f} "
+              f"{sum(v is not None for v in found.values()) / len(found):>6.0%} "
+              f"{scan_us:>9.0f} {recall:>7.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+Time the offline pipeline stages on synthetic Moodle trees of several sizes.
+
+    py benchmarks\\bench_pipeline.py --scales 10000,100000,1000000 --json run.json
+    py benchmarks\\bench_pipeline.py --scales 10000 --compare run.json
+
+For each scale a tree is generated with synth_moodle.py in a temporary
+directory and these stages run one after another, each in a fresh Python
+process so its peak RSS is its own:
+
+  discover  discover_lang_files()
+  extract   extract_to_csv.main() on an empty store
+  apply     apply_batch_output.main() on a generated output file with one
+            result per string
+  validate  token signatures of every translated row (src.validate)
+  build     build_pack.main() from scratch
+
+Each stage reports wall time, strings/s (files/s for discover) and peak RSS (and that of worker
+processes, if any). Results are written as JSON; --compare prints the time
+change against an earlier JSON file. config.py is left alone: every path
+under WORKDIR and MOODLE_CODE_ROOT is redirected inside the child process.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+ROOT = HERE.parent
+for p in (str(ROOT), str(HERE)):
+    if p not in sys.path:
+        sys.path.insert(0, p)
+
+STAGES = ["discover", "extract", "apply", "validate", "build"]
+
+
+def peak_rss_mb(who: str = "self"):
+    """Peak resident set size of this process (or its children) in MB."""
+    try:
+        import resource
+    except ImportError:
+        if who != "self":
+            return None
+        try:
+            import psutil
+            return round(psutil.Process().memory_info().peak_wset / 2**20, 1)
+        except (ImportError, AttributeError):
+            return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == "self" else resource.RUSAGE_CHILDREN)
+    # ru_maxrss is in KB on Linux and in bytes on macOS.
+    scale = 2**20 if sys.platform == "darwin" else 2**10
+    return round(usage.ru_maxrss / scale, 1)
+
+
+def configure(tree: Path, workdir: Path, store: str, workers: int) -> None:
+    """Point config at the synthetic tree and a scratch work directory.
+    Must run before any src module is imported."""
+    import config
+    old_work, old_root = config.WORKDIR, config.MOODLE_CODE_ROOT
+    for name, value in list(vars(config).items()):
+        if not isinstance(value, Path):
+            continue
+        for old, new in ((old_work, workdir), (old_root, tree)):
+            try:
+                setattr(config, name, new / value.relative_to(old))
+                break
+            except ValueError:
+                continue
+    config.STORE_BACKEND = store
+    config.INCLUDE_ONLY_REL_PATHS = []
+    config.EXTRACT_WORKERS = workers
+    for d in (config.DATA_DIR, config.OUTPUT_DIR, config.LOG_DIR):
+        d.mkdir(parents=True, exist_ok=True)
+
+
+def write_fake_output(path: Path) -> None:
+    """One successful batch result per stored string."""
+    from mock_openai_server import fake_translate
+    from src.store import open_store
+    store = open_store()
+    with path.open("w", encoding="utf-8") as fh:
+        for r in store.all_rows():
+            text = json.dumps({"translated_text": fake_translate(r["source_text"])})
+            fh.write(json.dumps({"custom_id": r["hash"], "error": None, "response": {
+                "status_code": 200, "body": {"output_text": text}}}) + "\n")
+    store.close()
+
+
+def run_stage(stage: str, workdir: Path) -> int:
+    """Run one stage; returns the number of strings (files for discover) it handled."""
+    if stage == "discover":
+        from src.common import discover_lang_files
+        return len(discover_lang_files())
+    if stage == "extract":
+        from src import extract_to_csv
+        from src.store import open_store
+        extract_to_csv.main()
+        store = open_store()
+        n = len(store.all_rows())
+        store.close()
+        return n
+    if stage == "apply":
+        from src import apply_batch_output
+        apply_batch_output.main([str(workdir / "fake_output.jsonl")])
+        return sum(1 for _ in (workdir / "fake_output.jsonl").open(encoding="utf-8"))
+    if stage == "validate":
+        from src.store import open_store
+        from src.validate import find_mismatches
+        store = open_store()
+        items = [(r["hash"], r["source_text"], r["translated_text"]) for r in store.translated()]
+        store.close()
+        find_mismatches(items, workers=1)
+        return len(items)
+    if stage == "build":
+        from src import build_pack
+        from src.store import open_store
+        store = open_store()
+        n = len(store.translated())
+        store.close()
+        build_pack.main()
+        return n
+    raise SystemExit(f"Unknown stage {stage}")
+
+
+def child(args) -> None:
+    configure(args.tree, args.workdir, args.store, args.workers)
+    if args.child == "apply" and not (args.workdir / "fake_output.jsonl").exists():
+        write_fake_output(args.workdir / "fake_output.jsonl")
+    rss_before = peak_rss_mb()
+    with contextlib.redirect_stdout(io.StringIO()):
+        t0 = time.perf_counter()
+        n = run_stage(args.child, args.workdir)
+        elapsed = time.perf_counter() - t0
+    print("RESULT " + json.dumps({
+        "seconds": round(elapsed, 4), "count": n,
+        "peak_rss_mb": peak_rss_mb(), "rss_before_mb": rss_before,
+        "children_peak_rss_mb": peak_rss_mb("children"),
+    }))
+
+
+def spawn(stage: str, tree: Path, workdir: Path, args) -> dict:
+    cmd = [sys.executable, str(Path(__file__).resolve()), "--child", stage,
+           "--tree", str(tree), "--workdir", str(workdir),
+           "--store", args.store, "--workers", str(args.workers)]
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    if proc.returncode:
+        raise SystemExit(f"Stage {stage} failed:\n{proc.stderr}")
+    line = [l for l in proc.stdout.splitlines() if l.startswith("RESULT ")][-1]
+    return json.loads(line[len("RESULT "):])
+
+
+def compare(old_path: Path, results) -> None:
+    old = {(r["scale"], r["stage"]): r for r in json.loads(old_path.read_text())["results"]}
+    print(f"\nCompared with {old_path}:")
+    for r in results:
+        prev = old.get((r["scale"], r["stage"]))
+        if prev and prev["seconds"]:
+            change = 100 * (r["seconds"] - prev["seconds"]) / prev["seconds"]
+            print(f"{r['scale']:>9} {r['stage']:<9} {prev['seconds']:>9.3f}s -> "
+                  f"{r['seconds']:>9.3f}s ({change:+.1f}%)")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--scales", default="10000,100000",
+                    help="comma-separated total string counts (e.g. 10000,100000,1000000)")
+    ap.add_argument("--strings-per-file", type=int, default=50)
+    ap.add_argument("--plugin-types", type=int, default=12)
+    ap.add_argument("--stages", default=",".join(STAGES))
+    ap.add_argument("--store", choices=["csv", "sqlite"], default="csv")
+    ap.add_argument("--workers", type=int, default=1, help="EXTRACT_WORKERS for the extract stage")
+    ap.add_argument("--json", type=Path, default=Path("bench_pipeline.json"))
+    ap.add_argument("--compare", type=Path, help="earlier JSON result to compare with")
+    # Internal: run a single stage in this process.
+    ap.add_argument("--child", help=argparse.SUPPRESS)
+    ap.add_argument("--tree", type=Path, help=argparse.SUPPRESS)
+    ap.add_argument("--workdir", type=Path, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        return child(args)
+
+    from synth_moodle import make_tree
+
+    stages = [s for s in args.stages.split(",") if s]
+    for s in stages:
+        if s not in STAGES:
+            raise SystemExit(f"Unknown stage {s}; choose from {', '.join(STAGES)}")
+    results = []
+    print(f"{'scale':>9} {'stage':<9} {'seconds':>9} {'throughput':>17} {'peak RSS MB':>12}")
+    for scale in (int(s) for s in args.scales.split(",")):
+        with tempfile.TemporaryDirectory() as tmp:
+            tree, workdir = Path(tmp, "moodle"), Path(tmp, "work")
+            plugins = max(1, scale // args.strings_per_file - 1)
+            t0 = time.perf_counter()
+            written = make_tree(tree, args.plugin_types, plugins, args.strings_per_file,
+                                core_files=1)
+            print(f"{scale:>9} {'generate':<9} {time.perf_counter() - t0:>9.3f} "
+                  f"({written} strings)")
+            for stage in stages:
+                r = spawn(stage, tree, workdir, args)
+                r.update(scale=scale, strings=written, stage=stage,
+                         unit="files" if stage == "discover" else "strings",
+                         per_second=round(r["count"] / r["seconds"]) if r["seconds"] else None)
+                results.append(r)
+                rate = f"{r['per_second'] or 0} {r['unit']}/s"
+                print(f"{scale:>9} {stage:<9} {r['seconds']:>9.3f} {rate:>17} "
+                      f"{r['peak_rss_mb'] if r['peak_rss_mb'] is not None else '-':>12}")
+
+    meta = {
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "store": args.store,
+        "workers": args.workers,
+        "strings_per_file": args.strings_per_file,
+    }
+    args.json.write_text(json.dumps({"meta": meta, "results": results}, indent=1))
+    print(f"Results written to {args.json}")
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
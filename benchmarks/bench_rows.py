@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the memory of the string table held as dicts and as Row records.
+
+    py benchmarks\\bench_rows.py --rows 100000,1000000 [--variants 2] [--repeat 3]
+
+For each size a strings.csv is generated in a temporary directory (files of
+--strings-per-file strings, half of them translated, --variants extra
+variant column pairs) and loaded in a fresh Python process per model:
+
+  dict  list(csv.DictReader(...)) plus _row_index, the representation the
+        stages used before src/row.py
+  row   src.common.read_csv_rows(), slotted Row records with interned
+        component/path/status columns
+
+Each child loads the table, walks it once the way build_pack does (grouping
+translated rows by component) and writes it back. Reported: load, walk and
+write time (median of --repeat runs), peak RSS, and the peak RSS growth per
+row over the interpreter's baseline.
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+ROOT = HERE.parent
+for p in (str(ROOT), str(HERE)):
+    if p not in sys.path:
+        sys.path.insert(0, p)
+
+from bench_pipeline import peak_rss_mb
+
+MODELS = ("dict", "row")
+
+WORDS = ("course activity student teacher grade forum quiz assignment submission "
+         "settings user group role report file folder page section question").split()
+
+
+def make_csv(path: Path, rows: int, per_file: int, variants: int, seed: int = 1) -> None:
+    rng = random.Random(seed)
+    extras = sorted(f"{prefix}en_v{i}" for i in range(variants)
+                    for prefix in ("status__", "translated_text__"))
+    with path.open("w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["component", "relpath", "sourcefile", "key", "source_text",
+                    "translated_text", "status", "hash"] + extras)
+        for i in range(rows):
+            plugin = f"plugin{i // per_file}"
+            source = " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 9))).capitalize()
+            done = i % 2 == 0
+            record = [f"mod_{plugin}", f"mod/{plugin}/lang/en/{plugin}.php", f"{plugin}.php",
+                      f"string{i % per_file}", source, source.upper() if done else "",
+                      "ok" if done else "pending",
+                      hashlib.sha256(f"{plugin}|{i}|{source}".encode()).hexdigest()]
+            for name in extras:
+                record.append(("ok" if done else "pending") if name.startswith("status__")
+                              else (source.lower() if done else ""))
+            w.writerow(record)
+
+
+def load(model: str, path: Path):
+    if model == "dict":
+        with path.open(newline="", encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+    else:
+        from src.common import read_csv_rows
+        rows = read_csv_rows(path)
+    for idx, row in enumerate(rows):
+        row["_row_index"] = idx
+    return rows
+
+
+def walk(rows) -> int:
+    by_component = {}
+    for r in rows:
+        text = r.get("translated_text")
+        if text and text != r["source_text"]:
+            by_component.setdefault(r["component"], []).append((r["key"], text))
+    return len(by_component)
+
+
+def write(model: str, rows, path: Path) -> None:
+    if model == "dict":
+        fields = list(rows[0].keys())
+        with path.open("w", newline="", encoding="utf-8") as f:
+            w = csv.DictWriter(f, fieldnames=[k for k in fields if not k.startswith("_")])
+            w.writeheader()
+            w.writerows({k: v for k, v in r.items() if not k.startswith("_")} for r in rows)
+    else:
+        from src.common import write_csv_rows
+        write_csv_rows(rows, path)
+
+
+def child(model: str, path: Path) -> None:
+    import src.common  # noqa: F401 -- import cost stays out of the baseline
+    before = peak_rss_mb()
+    t0 = time.perf_counter()
+    rows = load(model, path)
+    t1 = time.perf_counter()
+    walk(rows)
+    t2 = time.perf_counter()
+    write(model, rows, path.with_suffix(f".{model}.out"))
+    t3 = time.perf_counter()
+    print("RESULT " + json.dumps({"load": t1 - t0, "walk": t2 - t1, "write": t3 - t2,
+                                  "rows": len(rows), "rss_before_mb": before,
+                                  "peak_rss_mb": peak_rss_mb()}))
+
+
+def spawn(model: str, path: Path) -> dict:
+    proc = subprocess.run([sys.executable, str(Path(__file__).resolve()), "--child", model,
+                           "--csv", str(path)], cwd=ROOT, capture_output=True, text=True)
+    if proc.returncode:
+        raise SystemExit(f"{model} run failed:\n{proc.stderr}")
+    line = [l for l in proc.stdout.splitlines() if l.startswith("RESULT ")][-1]
+    return json.loads(line[len("RESULT "):])
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--rows", default="100000,1000000", help="comma-separated table sizes")
+    ap.add_argument("--strings-per-file", type=int, default=50)
+    ap.add_argument("--variants", type=int, default=0, help="extra variant column pairs")
+    ap.add_argument("--repeat", type=int, default=3)
+    # Internal: load one table in this process.
+    ap.add_argument("--child", choices=MODELS, help=argparse.SUPPRESS)
+    ap.add_argument("--csv", type=Path, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        return child(args.child, args.csv)
+
+    print(f"{'rows':>9} {'model':<5} {'load s':>8} {'walk s':>8} {'write s':>8} "
+          f"{'peak RSS MB':>12} {'bytes/row':>10}")
+    for n in (int(s) for s in args.rows.split(",")):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp, "strings.csv")
+            make_csv(path, n, args.strings_per_file, args.variants)
+            peaks = {}
+            for model in MODELS:
+                runs = [spawn(model, path) for _ in range(args.repeat)]
+                peak = max(r["peak_rss_mb"] for r in runs)
+                growth = statistics.median(r["peak_rss_mb"] - r["rss_before_mb"] for r in runs)
+                peaks[model] = peak
+                print(f"{n:>9} {model:<5} "
+                      + " ".join(f"{statistics.median(r[k] for r in runs):>8.3f}"
+                                 for k in ("load", "walk", "write"))
+                      + f" {peak:>12.1f} {growth * 2**20 / n:>10.0f}")
+            print(f"{n:>9} row/dict peak RSS: {peaks['row'] / peaks['dict']:.0%}")
+
+
+if __name__ == "__main__":
+    main()
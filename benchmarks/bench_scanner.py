@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Throughput of scan_php_strings() against the former twin-regex extractor.
+
+    py benchmarks\\bench_scanner.py --strings 200000
+
+Generates one large synthetic language file (mixed quote styles, escapes,
+placeholders and HTML) and reports MB/s and strings/s for both approaches.
+"""
+
+import argparse
+import re
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from src.common import scan_php_strings
+
+# The patterns extract_to_csv used before the single-pass scanner.
+LEGACY_RE_SQ = re.compile(r"\$string\[['\"](?P<k>[^'\"]+)['\"]\]\s*=\s*'(?P<t>(?:\\'|[^'])*?)';", re.S)
+LEGACY_RE_DQ = re.compile(r'\$string\[\s*["\'](?P<k>[^"\']+)["\']\s*\]\s*=\s*"(?P<t>(?:\\"|[^"])*?)";', re.S)
+
+
+def legacy_scan(data: str):
+    out = [(m.group("k"), m.group("t").replace("\\'", "'")) for m in LEGACY_RE_SQ.finditer(data)]
+    out += [(m.group("k"), m.group("t").replace('\\"', '"')) for m in LEGACY_RE_DQ.finditer(data)]
+    return out
+
+
+def make_file(strings: int) -> str:
+    lines = ["<?php", "// Synthetic language file", "defined('MOODLE_INTERNAL') || die();"]
+    for i in range(strings):
+        kind = i % 5
+        if kind == 0:
+            lines.append(f"$string['key{i}'] = 'Plain value number {i}';")
+        elif kind == 1:
+            lines.append(f"$string['key{i}'] = 'Don\\'t forget {{$a->name}} <strong>%s</strong> item {i}';")
+        elif kind == 2:
+            lines.append(f'$string["key{i}"] = "Double \\"quoted\\" {{$a}} value {i}";')
+        elif kind == 3:
+            lines.append(f"$string['key{i}'] = '<p>Paragraph {i} with a longer help text that spans "
+                         f"a couple of sentences, so files look like real help strings.</p>';")
+        else:
+            lines.append(f"$string['key{i}_help'] = 'Help {i}\n\nSecond line %1$s and %2$d';")
+    return "\n".join(lines) + "\n"
+
+
+def bench(fn, data: str, repeat: int):
+    best = None
+    count = 0
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        count = len(list(fn(data)))
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, count
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--strings", type=int, default=200000)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    data = make_file(args.strings)
+    mb = len(data.encode("utf-8")) / 1e6
+    print(f"Synthetic file: {mb:.1f} MB, {args.strings} definitions (best of {args.repeat})")
+    print(f"{'scanner':<22} {'seconds':>8} {'MB/s':>8} {'strings/s':>11} {'found':>8}")
+    for name, fn in (("legacy RE_SQ + RE_DQ", legacy_scan),
+                     ("scan_php_strings", scan_php_strings)):
+        elapsed, count = bench(fn, data, args.repeat)
+        print(f"{name:<22} {elapsed:>8.3f} {mb / elapsed:>8.1f} "
+              f"{count / elapsed:>11.0f} {count:>8}")
+
+
+if __name__ == "__main__":
+    main()
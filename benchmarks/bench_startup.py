@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Measure cold-start time of the CLI subcommands.
+
+    py benchmarks\\bench_startup.py [--repeat 7] [--max-ms 150]
+
+Each subcommand's module is imported through src.cli.load() in a fresh
+Python process, repeat times; the median time to import it is reported,
+together with the whole-process time (interpreter start included) and
+whether the OpenAI SDK got loaded along the way. Bare interpreter start and
+`import openai` are measured the same way for reference.
+
+With --max-ms the script exits non-zero if an offline subcommand takes
+longer than that to import or loads the OpenAI SDK, so it can guard
+against a heavy import creeping back in. Nothing is executed beyond the
+imports, so no API key or Moodle checkout is needed.
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from src.cli import COMMANDS, OFFLINE_COMMANDS
+
+PROBE = """
+import sys, time, json
+t0 = time.perf_counter()
+{body}
+print(json.dumps({{"import_ms": (time.perf_counter() - t0) * 1000,
+                  "openai": "openai" in sys.modules}}))
+"""
+
+
+def measure(body: str, repeat: int):
+    imports, totals, openai = [], [], False
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = subprocess.run([sys.executable, "-c", PROBE.format(body=body)], cwd=ROOT,
+                             capture_output=True, text=True)
+        totals.append((time.perf_counter() - t0) * 1000)
+        if out.returncode:
+            raise SystemExit(f"Probe failed:\n{out.stderr}")
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        imports.append(result["import_ms"])
+        openai = result["openai"]
+    return statistics.median(imports), statistics.median(totals), openai
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--repeat", type=int, default=7)
+    ap.add_argument("--max-ms", type=float, help="fail if an offline command imports slower")
+    args = ap.parse_args()
+
+    probes = [("(interpreter)", "pass"), ("(import openai)", "import openai")]
+    probes += [(cmd, f"import src.cli; src.cli.load({cmd!r})") for cmd in COMMANDS]
+
+    print(f"{'command':<16} {'import ms':>10} {'process ms':>11}  openai loaded")
+    too_slow = []
+    for name, body in probes:
+        try:
+            import_ms, total_ms, openai = measure(body, args.repeat)
+        except SystemExit as exc:
+            print(f"{name:<16} skipped: {str(exc).splitlines()[-1]}")
+            continue
+        print(f"{name:<16} {import_ms:>10.1f} {total_ms:>11.1f}  {'yes' if openai else 'no'}")
+        if args.max_ms and name in OFFLINE_COMMANDS and (import_ms > args.max_ms or openai):
+            too_slow.append(name)
+
+    if too_slow:
+        raise SystemExit(f"Over budget ({args.max_ms} ms or loads openai): {', '.join(too_slow)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Speed of the placeholder/tag check against the former four-findall version.
+
+    py benchmarks\\bench_tokens.py --rows 200000
+
+Builds synthetic (source, translation) pairs shaped like Moodle strings and
+times one accept/reject decision per pair, the way the apply paths make it:
+the former tokens_for() on both sides, token_signature() on both sides, and
+token_signature() on the translation with the cached source_signature().
+Also reports how many decisions differ from the former implementation.
+"""
+
+import argparse
+import re
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from src import common
+from src.common import PLACEHOLDER_PATTERNS, TAG_RE, token_signature, source_signature
+
+
+def legacy_tokens_for(s: str):
+    toks = []
+    for p in PLACEHOLDER_PATTERNS:
+        toks += re.findall(p, s)
+    toks += TAG_RE.findall(s)
+    return sorted(toks)
+
+
+SOURCES = [
+    "Settings",
+    "Delete {$a}",
+    "Posted by {$a->name} on {$a->date}",
+    "<strong>Warning:</strong> %s items will be removed",
+    "Page %1$s of %2$d",
+    "Help text that explains what this setting does in a full sentence or two.",
+    "<p>Paragraph with a <a href=\"{$a}\">link</a>.</p>",
+    "100%% complete",
+]
+
+
+def make_rows(n: int):
+    rows = []
+    for i in range(n):
+        src = SOURCES[i % len(SOURCES)] + f" {i}"
+        tgt = "Ü " + src if i % 10 else src.replace("{$a", "{$b")
+        rows.append({"hash": f"h{i}", "source_text": src, "translated_text": tgt})
+    return rows
+
+
+def bench(fn, rows, repeat: int):
+    best = None
+    for _ in range(repeat):
+        common._SOURCE_SIGNATURES.clear()
+        t0 = time.perf_counter()
+        ok = sum(1 for r in rows if fn(r))
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, ok
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--rows", type=int, default=200000)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    rows = make_rows(args.rows)
+    variants = (
+        ("legacy tokens_for x2",
+         lambda r: legacy_tokens_for(r["source_text"]) == legacy_tokens_for(r["translated_text"])),
+        ("token_signature x2",
+         lambda r: token_signature(r["source_text"]) == token_signature(r["translated_text"])),
+        ("cached source",
+         lambda r: source_signature(r) == token_signature(r["translated_text"])),
+    )
+    print(f"{args.rows} rows (best of {args.repeat})")
+    print(f"{'check':<22} {'seconds':>8} {'rows/s':>11} {'accepted':>9}")
+    for name, fn in variants:
+        elapsed, ok = bench(fn, rows, args.repeat)
+        print(f"{name:<22} {elapsed:>8.3f} {args.rows / elapsed:>11.0f} {ok:>9}")
+
+    # Source signatures are cached per hash, so a second pass over the same
+    # rows (e.g. the translation memory check after applying) only scans
+    # the translations.
+    fn = variants[2][1]
+    t0 = time.perf_counter()
+    sum(1 for r in rows if fn(r))
+    print(f"{'cached source (warm)':<22} {time.perf_counter() - t0:>8.3f}")
+
+    differ = sum(1 for r in rows if variants[0][1](r) != variants[1][1](r))
+    print(f"Decisions that differ from the legacy check: {differ}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for POST /v1/responses, for exercising realtime mode end to end.
+
+    py benchmarks\\mock_openai_server.py --port 8089 --fail-rate 0.2 --latency-ms 50
+
+Then, in another shell:
+
+    set OPENAI_BASE_URL=http://127.0.0.1:8089/v1
+    set OPENAI_API_KEY=mock
+    py src\\translate_csv.py
+
+Every string is "translated" by upper-casing the text outside placeholders
+and tags, so replies pass the token check. --fail-rate answers that share
+of requests with 429 (with Retry-After) or 500 to exercise the retry path.
+The server prints request, failure and concurrency counts on Ctrl+C.
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TOKEN_RE = re.compile(r"(\{\$a[^}]*\}|%\d*\$?[sdfox%]|</?[A-Za-z][^>]*>)")
+
+STATS = {"requests": 0, "failed": 0, "in_flight": 0, "max_in_flight": 0}
+LOCK = threading.Lock()
+
+
+def fake_translate(text: str) -> str:
+    parts = TOKEN_RE.split(text)
+    return "".join(p if i % 2 else p.upper() for i, p in enumerate(parts))
+
+
+def reply_text(body: dict) -> str:
+    user = body["input"][-1]["content"]
+    payload = json.loads(user.split("\n", 1)[1])
+    if "items" in payload:
+        return json.dumps({"translations": [
+            {"key": it["key"], "translated_text": fake_translate(it["text"])}
+            for it in payload["items"]]})
+    return json.dumps({"translated_text": fake_translate(payload["text"])})
+
+
+def response_body(body: dict, text: str) -> dict:
+    return {
+        "id": f"resp_{random.getrandbits(48):x}",
+        "object": "response",
+        "created_at": int(time.time()),
+        "model": body.get("model", "mock"),
+        "status": "completed",
+        "output": [{
+            "id": "msg_mock", "type": "message", "role": "assistant", "status": "completed",
+            "content": [{"type": "output_text", "text": text, "annotations": []}],
+        }],
+        "parallel_tool_calls": False, "tool_choice": "auto", "tools": [],
+        "usage": {"input_tokens": len(json.dumps(body)) // 4,
+                  "output_tokens": len(text) // 4,
+                  "total_tokens": (len(json.dumps(body)) + len(text)) // 4},
+    }
+
+
+class Handler(BaseHTTPRequestHandler):
+    fail_rate = 0.0
+    latency = 0.0
+
+    def _send(self, status: int, payload: dict, headers=None) -> None:
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        with LOCK:
+            STATS["requests"] += 1
+            STATS["in_flight"] += 1
+            STATS["max_in_flight"] = max(STATS["max_in_flight"], STATS["in_flight"])
+        try:
+            time.sleep(self.latency)
+            if not self.path.rstrip("/").endswith("/responses"):
+                self._send(404, {"error": {"message": f"no route {self.path}"}})
+            elif random.random() < self.fail_rate:
+                with LOCK:
+                    STATS["failed"] += 1
+                if random.random() < 0.5:
+                    self._send(429, {"error": {"message": "rate limited", "type": "rate_limit"}},
+                               {"Retry-After": "0.1"})
+                else:
+                    self._send(500, {"error": {"message": "mock server error"}})
+            else:
+                self._send(200, response_body(body, reply_text(body)))
+        finally:
+            with LOCK:
+                STATS["in_flight"] -= 1
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8089)
+    ap.add_argument("--fail-rate", type=float, default=0.0)
+    ap.add_argument("--latency-ms", type=float, default=0.0)
+    args = ap.parse_args()
+
+    Handler.fail_rate = args.fail_rate
+    Handler.latency = args.latency_ms / 1000
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    print(f"Mock /v1/responses on http://{args.host}:{args.port}/v1 "
+          f"(fail rate {args.fail_rate:.0%}, latency {args.latency_ms:.0f} ms)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"{STATS['requests']} requests, {STATS['failed']} failed on purpose, "
+              f"at most {STATS['max_in_flight']} in flight")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Generate a synthetic Moodle checkout for benchmarks.
+
+    py benchmarks\\synth_moodle.py C:\\tmp\\moodle --plugin-types 12 --plugins 2000 --strings 50
+
+The tree has a lib/components.json, core language files in lang/en and
+<plugins> plugins spread over <plugin-types> plugin types (real Moodle type
+names and directories first), each with lang/en/<type>_<name>.php, plus a
+db/ and a node_modules/ folder that discovery has to ignore. Strings mix
+quote styles (single, double, nowdoc, concatenated) in the proportions of
+--quote-mix, and --placeholder-rate / --html-rate / --words control how much
+placeholder and HTML content they carry. Output depends only on the
+arguments (and --seed), so runs are comparable.
+
+Used by bench_pipeline.py; also handy on its own for profiling by hand.
+"""
+
+import argparse
+import json
+import random
+from pathlib import Path
+from typing import Dict
+
+# (type, directory) pairs in the order they are used.
+PLUGIN_TYPES = [
+    ("mod", "mod"), ("block", "blocks"), ("local", "local"), ("qtype", "question/type"),
+    ("auth", "auth"), ("enrol", "enrol"), ("filter", "filter"), ("report", "report"),
+    ("tool", "admin/tool"), ("theme", "theme"), ("format", "course/format"),
+    ("atto", "lib/editor/atto/plugins"), ("qbehaviour", "question/behaviour"),
+    ("gradeexport", "grade/export"), ("repository", "repository"), ("message", "message/output"),
+]
+
+WORDS = ("course activity student teacher grade forum quiz assignment submission "
+         "settings user group role report file folder page section question answer "
+         "enable disable show hide default allow select the of to for and in with "
+         "new existing this that each all any when if not be is are will can").split()
+
+DEFAULT_QUOTE_MIX = "sq=75,dq=15,nowdoc=5,concat=5"
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in ("sq", "dq", "nowdoc", "concat"):
+            raise SystemExit(f"Unknown quote style {name!r} in --quote-mix")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+class StringMaker:
+
+    def __init__(self, rng: random.Random, words: int, placeholder_rate: float,
+                 html_rate: float, quote_mix: Dict[str, float]):
+        self.rng = rng
+        self.words = words
+        self.placeholder_rate = placeholder_rate
+        self.html_rate = html_rate
+        self.styles = list(quote_mix)
+        self.weights = list(quote_mix.values())
+
+    def text(self) -> str:
+        rng = self.rng
+        n = max(1, int(rng.expovariate(1 / self.words)))
+        parts = [rng.choice(WORDS) for _ in range(n)]
+        parts[0] = parts[0].capitalize()
+        if rng.random() < self.placeholder_rate:
+            parts.insert(rng.randrange(len(parts) + 1),
+                         rng.choice(["{$a}", "{$a->name}", "{$a->count}", "%s", "%1$s", "%d"]))
+        if rng.random() < self.html_rate:
+            i = rng.randrange(len(parts))
+            parts[i] = rng.choice([f"<strong>{parts[i]}</strong>", f"<em>{parts[i]}</em>",
+                                   f'<a href="https://docs.moodle.org/">{parts[i]}</a>'])
+        if rng.random() < 0.1:
+            parts.append("isn't it")
+        return " ".join(parts)
+
+    def line(self, key: str) -> str:
+        text = self.text()
+        style = self.rng.choices(self.styles, self.weights)[0]
+        if style == "dq":
+            body = text.replace("\\", "\\\\").replace('"', '\\"').replace("$", "\\$")
+            return f'$string["{key}"] = "{body}";'
+        if style == "nowdoc":
+            return f"$string['{key}'] = <<<'EOT'\n{text}\nEOT;"
+        sq = text.replace("\\", "\\\\").replace("'", "\\'")
+        if style == "concat" and " " in sq:
+            head, tail = sq.split(" ", 1)
+            return f"$string['{key}'] = '{head} ' .\n    '{tail}';"
+        return f"$string['{key}'] = '{sq}';"
+
+
+def write_lang_file(path: Path, maker: StringMaker, strings: int) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    lines = ["<?php", "// This file is part of Moodle - https://moodle.org/",
+             "defined('MOODLE_INTERNAL') || die();", ""]
+    lines += [maker.line(f"string{i:05d}") for i in range(strings)]
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+def make_tree(root: Path, plugin_types: int = 12, plugins: int = 2000, strings: int = 50,
+              core_files: int = 0, quote_mix: str = DEFAULT_QUOTE_MIX,
+              placeholder_rate: float = 0.3, html_rate: float = 0.15, words: int = 8,
+              seed: int = 1) -> int:
+    """Write the tree under root; returns the number of strings written."""
+    rng = random.Random(seed)
+    maker = StringMaker(rng, words, placeholder_rate, html_rate, parse_mix(quote_mix))
+    types = PLUGIN_TYPES[:plugin_types] + [
+        (f"ptype{i}", f"ptype{i}") for i in range(max(0, plugin_types - len(PLUGIN_TYPES)))]
+    core_files = core_files or max(1, plugins // 50)
+
+    (root / "lib").mkdir(parents=True, exist_ok=True)
+    (root / "lib" / "components.json").write_text(json.dumps({
+        "plugintypes": {ptype: rel for ptype, rel in types},
+        "subsystems": {"admin": "admin", "course": "course"},
+    }), encoding="utf-8")
+    # Noise that discovery must skip.
+    (root / "node_modules" / "pkg" / "lang" / "en").mkdir(parents=True, exist_ok=True)
+    (root / "node_modules" / "pkg" / "lang" / "en" / "pkg.php").write_text(
+        "<?php\n$string['x'] = 'not Moodle';\n", encoding="utf-8")
+
+    total = 0
+    for i in range(core_files):
+        name = "moodle" if i == 0 else f"core{i:04d}"
+        write_lang_file(root / "lang" / "en" / f"{name}.php", maker, strings)
+        total += strings
+    for i in range(plugins):
+        ptype, rel = types[i % len(types)]
+        name = f"p{i:06d}"
+        plugindir = root / rel / name
+        write_lang_file(plugindir / "lang" / "en" / f"{ptype}_{name}.php", maker, strings)
+        (plugindir / "db").mkdir(exist_ok=True)
+        (plugindir / "version.php").write_text(
+            f"<?php\n$plugin->component = '{ptype}_{name}';\n", encoding="utf-8")
+        total += strings
+    return total
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("root", type=Path)
+    ap.add_argument("--plugin-types", type=int, default=12)
+    ap.add_argument("--plugins", type=int, default=2000)
+    ap.add_argument("--strings", type=int, default=50, help="strings per language file")
+    ap.add_argument("--core-files", type=int, default=0,
+                    help="files in lang/en (default: one per 50 plugins)")
+    ap.add_argument("--quote-mix", default=DEFAULT_QUOTE_MIX)
+    ap.add_argument("--placeholder-rate", type=float, default=0.3)
+    ap.add_argument("--html-rate", type=float, default=0.15)
+    ap.add_argument("--words", type=int, default=8, help="mean words per string")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    total = make_tree(args.root, args.plugin_types, args.plugins, args.strings,
+                      args.core_files, args.quote_mix, args.placeholder_rate,
+                      args.html_rate, args.words, args.seed)
+    print(f"Wrote {total} strings under {args.root}")
+
+
+if __name__ == "__main__":
+    main()
@@ -33,6 +33,12 @@ DATA_DIR = WORKDIR / "data"
 OUTPUT_DIR = WORKDIR / "output"
 LOG_DIR = WORKDIR / "logs"
 
+# Where the string table lives: "csv" keeps everything in DATA_DIR/strings.csv
+# (rewritten on every save), "sqlite" uses an indexed SQLite database that is
+# updated in place. Move data between the two with `py -m src.store`.
+STORE_BACKEND = "csv"
+SQLITE_PATH = DATA_DIR / "strings.sqlite"
+
 
 # --- Variant metadata --------------------------------------------------------
 
@@ -45,19 +51,143 @@ PARENT_LANGUAGE = "en"
 # Free-form description that is fed to the translation model to steer output.
 TARGET_STYLE = "Custom English"
 
+# Local rules applied before anything is sent to the model. FIXED_PHRASES maps
+# whole source strings to their translation. GLOSSARY swaps words and phrases
+# (whole words, case-insensitive, keeping the capitalisation of the match);
+# REGEX_RULES are (pattern, replacement) pairs applied afterwards. Placeholders
+# and HTML tags are never rewritten.
+#   RULES_MODE = "covered": FIXED_PHRASES resolve rows, and so do GLOSSARY and
+#                           REGEX_RULES where they cover every word of a row
+#                           (a term mapped to itself counts). The rest go to the
+#                           model, with the glossary terms they contain.
+#   RULES_MODE = "full":    the rules are the whole translation (purely
+#                           mechanical variants such as spelling swaps); every
+#                           row is resolved locally, unchanged text included.
+#   RULES_MODE = "off":     no local pass.
+RULES_MODE = "covered"
+FIXED_PHRASES = {
+    # "Save changes": "Stow yer changes",
+}
+GLOSSARY = {
+    # "course": "module",
+    # "teacher": "tutor",
+}
+REGEX_RULES = [
+    # (r"\b(\w+)ize\b", r"\1ise"),
+]
+
+# More variants built from the same extraction. Each keeps its translations in
+# its own columns of the string table (translated_text__<code>, status__<code>),
+# is translated in the same batches as the variant above and gets its own pack
+# under OUTPUT_DIR/<code>. "name", "parent" (default PARENT_LANGUAGE) and the
+# rule settings "rules_mode" (default "covered"), "fixed_phrases", "glossary"
+# and "regex_rules" (default: none) are optional.
+EXTRA_VARIANTS = [
+    # {"code": "en_kids", "name": "English for kids",
+    #  "style": "Plain English a ten-year-old understands"},
+    # {"code": "en_corp", "name": "Corporate English", "style": "Corporate English",
+    #  "rules_mode": "full", "glossary": {"course": "programme", "teacher": "facilitator"}},
+]
+
 
 # --- OpenAI Batch API configuration -----------------------------------------
 
-# Tune the batch size to control how many strings are submitted in one job. The
-# default works well for moderate workloads, but feel free to adjust.
-BATCH_SIZE = 150
+# Pending work is split into shards, each submitted as its own batch job.
+# BATCH_SIZE caps the requests per shard (the API allows at most 50,000) and
+# BATCH_MAX_BYTES the size of its JSONL input (the API allows 200 MB).
+# Smaller shards finish sooner, so translations start landing earlier.
+BATCH_SIZE = 2000
+BATCH_MAX_BYTES = 150 * 1024 * 1024
+
+# How many shards are submitted and polled at the same time.
+BATCH_MAX_CONCURRENT = 4
+
+# How pending strings are sent: "batch" uses the Batch API (half price, may
+# take hours), "realtime" sends requests directly (results in seconds), and
+# "auto" uses realtime when at most REALTIME_MAX_PENDING strings are to be
+# sent. The realtime client honours OPENAI_BASE_URL (e.g. a local mock).
+TRANSLATE_MODE = "auto"
+REALTIME_MAX_PENDING = 200
+REALTIME_CONCURRENCY = 8             # Requests in flight at once.
+REALTIME_REQUESTS_PER_MINUTE = 300   # Token-bucket rate limit.
+REALTIME_MAX_RETRIES = 5             # Retries with jittered backoff on 429/5xx/network errors.
+
+# Every submitted batch is recorded here. If translate_csv is stopped, the
+# next run re-attaches to unfinished batches instead of paying for them twice.
+LEDGER_PATH = DATA_DIR / "batch_ledger.json"
+
+# Strings sent per request. 1 sends one request per string; larger values pack
+# up to that many strings from the same component into one request, sharing
+# the system prompt and cutting per-request token overhead. Strings missing
+# from a packed reply are retried one per request (see MAX_ATTEMPTS).
+PACK_STRINGS_PER_REQUEST = 1
+
+# Strings that come back with an error, are missing from the results or
+# whose reply fails the placeholder/tag check are sent again in a follow-up
+# round, one per request, with a stricter prompt that names the problem.
+# After MAX_ATTEMPTS attempts a string is given up on: a rejected reply
+# keeps the source text (status "fallback"), a string that never got a
+# usable reply gets status "failed". 1 disables retries.
+MAX_ATTEMPTS = 3
 
 # Model name used for the OpenAI Responses API.
 OPENAI_MODEL = "gpt-4o-mini"
 
+# Cost estimate: USD per million (input, output) tokens at standard prices.
+# Batch jobs are billed at BATCH_PRICE_FACTOR of that. Check the current
+# prices on openai.com/api/pricing; a model missing here is estimated in
+# tokens only.
+TOKEN_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4.1-nano": (0.10, 0.40),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1": (2.00, 8.00),
+}
+BATCH_PRICE_FACTOR = 0.5
+
+# Token budget of one translate run: estimated input plus expected output
+# tokens, counted locally before anything is uploaded (with tiktoken when it
+# is installed, otherwise about four characters per token). When a run
+# would exceed it, OVER_BUDGET = "refuse" stops before submitting anything,
+# "split" sends the requests that fit and leaves the rest pending for the
+# next run. None = no budget.
+TOKEN_BUDGET = None
+OVER_BUDGET = "refuse"
+
+# Input tokens your organisation may have enqueued in batches for
+# OPENAI_MODEL at once (the "Batch queue limit" on the project's limits
+# page). Shards are sized and held back so the batches in flight stay below
+# it. None = no limit.
+BATCH_ENQUEUED_TOKEN_LIMIT = None
+
 # Batch API timing controls.
 BATCH_COMPLETION_WINDOW = "24h"   # Maximum processing window granted to OpenAI.
-BATCH_POLL_SECONDS = 600           # Polling interval (seconds) when waiting.
+BATCH_POLL_SECONDS = 600           # Longest wait (seconds) between status checks.
+BATCH_POLL_MIN_SECONDS = 15        # Shortest wait, used as a batch nears completion.
+# The wait between checks adapts to each batch's progress and ETA. Live
+# counts, throughput and ETA of every running batch are written here.
+PROGRESS_PATH = LOG_DIR / "batch_progress.json"
+
+# Reuse earlier translations of identical source strings (same TARGET_STYLE and
+# model) instead of sending them again, and send each distinct pending string
+# only once per run.
+TRANSLATION_MEMORY = True
+TM_PATH = DATA_DIR / "translation_memory.sqlite"
+
+# Fuzzy matches from the translation memory for pending strings it has no
+# exact match for ("Delete {$a}" vs "Delete {$a->name}", "Enable X" in many
+# plugins). Similarity runs from 0 to 1: the overlap of character 3-grams,
+# with every placeholder and tag counted as one symbol. The best match at or
+# above FUZZY_HINT_SIMILARITY goes into the request as an example of a
+# similar, already translated string. With FUZZY_APPLY, a remembered string
+# that is the same text apart from placeholder names and spacing has its
+# translation used directly, with placeholders renamed to the new string's,
+# and no request is sent. (A similarity of 1.0 alone does not mean that:
+# "banana" and "bananana" have the same 3-grams.) Needs TRANSLATION_MEMORY.
+FUZZY_MATCH = True
+FUZZY_HINT_SIMILARITY = 0.6
+FUZZY_APPLY = True
 
 
 # --- Extraction filters ------------------------------------------------------
@@ -69,3 +199,28 @@ INCLUDE_ONLY_REL_PATHS = []  # e.g. ["mod/forum/lang/en/forum.php"]
 # Filenames to skip outright during extraction.
 SKIP_BASENAMES = {"langconfig.php"}
 
+# Re-parse only language files whose size, mtime or content hash changed since
+# the last extraction, and keep the translation/status of unchanged strings.
+# Set to False to rebuild strings.csv from scratch with every row pending.
+INCREMENTAL_EXTRACT = True
+
+# Number of worker processes used to read and parse language files. 1 keeps
+# the single-process path; 0 uses one worker per CPU core. Output is identical
+# and identically ordered whatever the worker count.
+EXTRACT_WORKERS = 1
+
+# Files handed to a worker at a time. 0 picks a chunk size from the file and
+# worker counts; raise it if per-file overhead dominates on small files.
+EXTRACT_CHUNK_SIZE = 0
+
+
+# --- Run metrics -------------------------------------------------------------
+
+# run_all writes per-stage timings and counters (files scanned, strings
+# extracted, requests submitted, rows applied, files written, ...) here.
+METRICS_PATH = LOG_DIR / "metrics.json"
+
+# Also write them in the Prometheus text format, e.g. into node_exporter's
+# textfile collector directory. None disables it.
+PROMETHEUS_TEXTFILE = None  # e.g. Path("/var/lib/node_exporter/textfile_collector/moodle_lang.prom")
+
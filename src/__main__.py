@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+"""`py -m src <command>`; see src/cli.py."""
+
+import sys
+
+from src.cli import main
+
+sys.exit(main())
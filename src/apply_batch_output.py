@@ -1,132 +1,108 @@
-# -*- coding: utf-8 -*-
-"""
-Apply an existing Batch API output JSONL to strings.csv.
-
-Assumes custom_id was built as: f"{row['hash']}__{row_index}"
-where row_index is the zero-based index of the row at the time
-the batch was created.
-"""
-
-import csv
-import json
-
-from src.common import CSV_PATH, tokens_for
-from config import DATA_DIR
-
-BATCH_OUTPUT = DATA_DIR / "batch_output.jsonl"
-
-
-def extract_output_text(body: dict) -> str:
-    """Pull assistant text out of a /v1/responses response body."""
-    if isinstance(body.get("output_text"), str):
-        return body["output_text"]
-
-    for item in body.get("output", []):
-        if item.get("type") == "message":
-            for c in item.get("content", []):
-                if c.get("type") == "output_text":
-                    return c.get("text", "")
-    return ""
-
-
-def main():
-    # ----- Load CSV -----
-    with CSV_PATH.open(newline="", encoding="utf-8") as f:
-        rows = list(csv.DictReader(f))
-    print(f"Loaded {len(rows)} rows from {CSV_PATH}")
-
-    if not BATCH_OUTPUT.exists():
-        raise SystemExit(f"Batch output file not found at {BATCH_OUTPUT}")
-
-    # ----- Build custom_id -> row mapping using hash__row_index -----
-    cid_to_row = {}
-    for idx, row in enumerate(rows):
-        h = row.get("hash")
-        if not h:
-            continue
-        cid = f"{h}__{idx}"
-        cid_to_row[cid] = row
-
-    print(f"Prepared {len(cid_to_row)} custom_id mappings from CSV")
-
-    # ----- Load batch_output.jsonl -----
-    output_lines = BATCH_OUTPUT.read_text(encoding="utf-8").splitlines()
-
-    total_items = 0
-    matched = 0
-    changed = 0
-
-    for line in output_lines:
-        line = line.strip()
-        if not line:
-            continue
-
-        try:
-            obj = json.loads(line)
-        except json.JSONDecodeError:
-            print("Skipping invalid JSON line in batch_output")
-            continue
-
-        total_items += 1
-        cid = obj.get("custom_id")
-        if not cid:
-            continue
-
-        row = cid_to_row.get(cid)
-        if row is None:
-            # custom_id that does not exist in this CSV: maybe Moodle changed
-            continue
-
-        if obj.get("error"):
-            print(f"Batch item error for {cid}: {obj['error']}")
-            continue
-
-        body = obj.get("response", {}).get("body", {})
-        raw_text = extract_output_text(body).strip()
-        if not raw_text:
-            continue
-
-        # We asked for JSON only: {"translated_text": "..."}
-        try:
-            decoded = json.loads(raw_text)
-            if isinstance(decoded, dict) and "translated_text" in decoded:
-                translated = decoded["translated_text"]
-            else:
-                translated = decoded if isinstance(decoded, str) else raw_text
-        except json.JSONDecodeError:
-            translated = raw_text
-
-        src = row["source_text"]
-        tgt = (translated or "").strip()
-        if not tgt:
-            continue
-
-        matched += 1
-
-        # Placeholder / tag safety
-        safe_tgt = tgt if tokens_for(src) == tokens_for(tgt) else src
-
-        if safe_tgt != row.get("translated_text"):
-            changed += 1
-
-        row["translated_text"] = safe_tgt
-        row["status"] = "ok" if safe_tgt != src else "fallback"
-
-    print(f"Processed {total_items} batch items.")
-    print(f"Matched {matched} rows in CSV, changed {changed} rows.")
-
-    # ----- Rewrite CSV keeping all columns -----
-    fieldnames = sorted({k for r in rows for k in r.keys()})
-
-    with CSV_PATH.open("w", newline="", encoding="utf-8") as f:
-        w = csv.DictWriter(f, fieldnames=fieldnames)
-        w.writeheader()
-        w.writerows(rows)
-
-    print("Updated strings.csv from batch_output.jsonl")
-
-
-if __name__ == "__main__":
-    main()
-
-
+# -*- coding: utf-8 -*-
+"""
+Apply existing Batch API output JSONL files to the string store.
+
+    py src\\apply_batch_output.py [file.jsonl ...]
+
+With no arguments data/batch_output.jsonl is used. Any number of output (and
+error) files can be given, e.g. the results of several shards or re-runs;
+they are streamed in order, so for a string that appears more than once the
+last file wins.
+
+custom_id is the row hash, or "pack__" + a digest for packed requests whose
+member rows are looked up in the batch ledger. Older "{hash}__{row_index}"
+ids are still accepted; ids ending in "@<code>" belong to that extra variant.
+Rows are matched on hash, so the batch still applies after the table has been
+re-extracted or reordered.
+"""
+
+import sys
+from pathlib import Path
+
+from src.common import ensure_dirs
+from src.results import ResultApplier
+from src.store import open_store
+from src.memory import open_memories, fan_out
+from src.variants import VARIANTS, split_custom_id
+from src.ledger import BatchLedger
+from src.metrics import metrics
+from config import DATA_DIR, TRANSLATION_MEMORY
+
+BATCH_OUTPUT = DATA_DIR / "batch_output.jsonl"
+
+
+def main(argv=None):
+    ensure_dirs()
+    paths = [Path(p) for p in (sys.argv[1:] if argv is None else argv)] or [BATCH_OUTPUT]
+    for path in paths:
+        if not path.exists():
+            raise SystemExit(f"Batch output file not found at {path}")
+
+    requests = BatchLedger().request_map()
+
+    def member_hashes(cid):
+        if cid in requests:
+            return requests[cid]
+        base = split_custom_id(cid)[0]
+        if base.startswith("pack__"):
+            return []
+        return [base.split("__", 1)[0]]
+
+    store = open_store()
+
+    def resolve(cids):
+        # Fetch only the rows named by this chunk's custom_ids, as seen by
+        # the variant each id belongs to.
+        by_variant = {}
+        for cid in cids:
+            variant = split_custom_id(cid)[1]
+            if variant is not None:
+                by_variant.setdefault(variant.code, (variant, []))[1].append(cid)
+        units = {}
+        for variant, variant_cids in by_variant.values():
+            rows_by_hash = store.get({h for c in variant_cids for h in member_hashes(c)}, variant)
+            for cid in variant_cids:
+                unit = [rows_by_hash[h] for h in member_hashes(cid) if h in rows_by_hash]
+                if unit:
+                    units[cid] = unit
+        return units
+
+    tm = open_memories() if TRANSLATION_MEMORY else None
+
+    touched = []
+
+    def save_chunk(rows):
+        # Save as we go so memory stays flat however large the files are.
+        # strings.csv is rewritten on every save, so it is saved once at the end.
+        if store.rewrites_on_save:
+            touched.extend(rows)
+        else:
+            store.save(rows)
+        if tm is not None:
+            fan_out(tm, rows, ())
+
+    applier = ResultApplier(resolve, on_chunk=save_chunk)
+    for path in paths:
+        print(f"Applying {path}")
+        applier.feed_file(path)
+    applier.report()
+    metrics.add("apply", rows_applied=applier.matched, rows_fallback=applier.fallback,
+                item_errors=applier.errors)
+    if touched:
+        store.save(touched)
+
+    # ----- Fan results out to identical pending strings -----
+    if tm is not None:
+        fanned = fan_out(tm, (), [r for v in VARIANTS for r in store.pending(v)])
+        for memory in tm.values():
+            memory.close()
+        if fanned:
+            store.save(fanned)
+        print(f"Translation memory: copied results to {len(fanned)} duplicate rows.")
+
+    store.close()
+    print(f"Updated {store.path} from {len(paths)} file(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,61 +1,189 @@
 # -*- coding: utf-8 -*-
-import csv
+"""
+Build Moodle language packs from the translated rows of the store.
+
+Builds are incremental: every output file is rendered in memory and only
+written (atomically, temp file plus rename) when its content hash differs
+from the file on disk. PHP files that the build no longer produces, e.g. for
+a component that disappeared, are removed. output/build_manifest.json lists
+the hash and components of every file, plus what this build wrote and
+removed, so a deploy step can sync just those files and purge only the
+affected components.
+
+Every variant (src/variants.py) is built in the same pass over the rows. The
+primary variant's packs go to output/ as before; an extra variant's packs
+and build manifest go to output/<code>/.
+"""
+
+import hashlib
+import json
+import time
 from pathlib import Path
 from collections import defaultdict
-from src.common import CSV_PATH, php_quote
-from config import OUTPUT_DIR, VARIANT_CODE, VARIANT_NAME, PARENT_LANGUAGE
+from typing import Dict, List, Tuple
 
-def write_langconfig(outdir: Path):
-    outdir.mkdir(parents=True, exist_ok=True)
-    (outdir / "langconfig.php").write_text(
-        "<?php\n"
-        "defined('MOODLE_INTERNAL') || die();\n"
-        f"$string['thislanguage'] = '{php_quote(VARIANT_NAME)}';\n"
-        f"$string['thislanguageint'] = '{php_quote(VARIANT_NAME)}';\n"
-        f"$string['parentlanguage'] = '{php_quote(PARENT_LANGUAGE)}';\n",
-        encoding="utf-8"
+from src.common import php_quote, atomic_write_text, ensure_dirs
+from src.store import open_store
+from src.row import Row
+from src.metrics import metrics
+from src.variants import VARIANTS, PRIMARY, Variant
+from config import OUTPUT_DIR
+
+BUILD_MANIFEST_PATH = OUTPUT_DIR / "build_manifest.json"
+
+PHP_HEADER = "<?php\ndefined('MOODLE_INTERNAL') || die();\n"
+
+
+def variant_output_dir(variant: Variant) -> Path:
+    return OUTPUT_DIR if variant.primary else OUTPUT_DIR / variant.code
+
+
+def manifest_path(variant: Variant) -> Path:
+    if variant.primary:
+        return BUILD_MANIFEST_PATH
+    return variant_output_dir(variant) / BUILD_MANIFEST_PATH.name
+
+
+def langconfig_php(variant: Variant = PRIMARY) -> str:
+    return (
+        PHP_HEADER
+        + f"$string['thislanguage'] = '{php_quote(variant.name)}';\n"
+        + f"$string['thislanguageint'] = '{php_quote(variant.name)}';\n"
+        + f"$string['parentlanguage'] = '{php_quote(variant.parent)}';\n"
     )
 
-def main():
-    with CSV_PATH.open(newline="", encoding="utf-8") as f:
-        rows = list(csv.DictReader(f))
 
-    changed = [r for r in rows if r["translated_text"] and r["translated_text"] != r["source_text"]]
+def render_php(items: List[Tuple[str, str]]) -> str:
+    return PHP_HEADER + "".join(f"$string['{k}'] = '{php_quote(v)}';\n" for k, v in items)
 
-    # Output 1: grouped by component name
-    out_component = OUTPUT_DIR / "en_variant_by_component"
-    out_component.mkdir(parents=True, exist_ok=True)
-    write_langconfig(out_component)
 
-    by_component = defaultdict(list)
-    for r in changed:
-        by_component[f"{r['component']}.php"].append((r["key"], r["translated_text"]))
+def sha256_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def load_build_manifest(variant: Variant = PRIMARY) -> Dict[str, dict]:
+    path = manifest_path(variant)
+    if not path.exists():
+        return {}
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))["packs"]
+    except (json.JSONDecodeError, KeyError):
+        print(f"Ignoring unreadable build manifest {path}")
+        return {}
+
 
-    for phpfile, items in by_component.items():
-        with (out_component / phpfile).open("w", encoding="utf-8") as fh:
-            fh.write("<?php\ndefined('MOODLE_INTERNAL') || die();\n")
-            for k, v in items:
-                fh.write(f"$string['{k}'] = '{php_quote(v)}';\n")
+def sync_pack(outdir: Path, files: Dict[str, Tuple[str, List[str]]],
+              previous: Dict[str, dict]) -> Dict:
+    """
+    Bring outdir in line with files ({name: (content, components)}).
 
+    A file is written only when its hash differs from the previous build's
+    (or, without a manifest entry, from the file on disk). PHP files in
+    outdir that are not part of this build are removed.
+    Returns {"files", "written", "unchanged", "removed", "components"}.
+    """
+    outdir.mkdir(parents=True, exist_ok=True)
+    entries, written, unchanged, removed = {}, [], 0, []
+    affected = set()
+
+    for name, (content, components) in sorted(files.items()):
+        digest = sha256_text(content)
+        entries[name] = {"sha256": digest, "components": components}
+        path = outdir / name
+        old = previous.get(name)
+        if path.exists():
+            if old is None:
+                # No manifest entry yet: compare with what is on disk.
+                old = {"sha256": hashlib.sha256(path.read_bytes()).hexdigest()}
+            if old["sha256"] == digest:
+                unchanged += 1
+                continue
+        atomic_write_text(path, content)
+        written.append(name)
+        affected.update(components)
+
+    for path in sorted(outdir.glob("*.php")):
+        if path.name not in files:
+            path.unlink()
+            removed.append(path.name)
+            affected.update((previous.get(path.name) or {}).get("components", []))
+
+    return {"files": entries, "written": written, "unchanged": unchanged,
+            "removed": removed, "components": sorted(affected)}
+
+
+def render_packs(rows: List[Row]) -> Dict[str, Dict[str, Dict[str, Tuple[str, List[str]]]]]:
+    """Render every variant's packs from rows (the whole table) in one pass.
+    Returns {variant code: {pack name: {file name: (content, components)}}};
+    langconfig.php is not included."""
+    # Output 1: grouped by component name
     # Output 2: grouped by original source filename
-    out_source = OUTPUT_DIR / "en_variant_by_sourcefile"
-    out_source.mkdir(parents=True, exist_ok=True)
-    write_langconfig(out_source)
-
-    by_srcfile = defaultdict(list)
-    for r in changed:
-        by_srcfile[r["sourcefile"]].append((r["key"], r["translated_text"]))
-
-    for phpfile, items in by_srcfile.items():
-        with (out_source / phpfile).open("w", encoding="utf-8") as fh:
-            fh.write("<?php\ndefined('MOODLE_INTERNAL') || die();\n")
-            for k, v in items:
-                fh.write(f"$string['{k}'] = '{php_quote(v)}';\n")
-
-    print(f"Wrote {len(by_component)} files into {out_component}")
-    print(f"Wrote {len(by_srcfile)} files into {out_source}")
+    by_component = {v.code: defaultdict(list) for v in VARIANTS}
+    by_srcfile = {v.code: defaultdict(list) for v in VARIANTS}
+    srcfile_components = defaultdict(set)
+    for r in rows:
+        srcfile_components[r["sourcefile"]].add(r["component"])
+        for v in VARIANTS:
+            # Only rows whose translation is set and differs from the source.
+            text = r.get(v.text_col)
+            if text and text != r["source_text"]:
+                by_component[v.code][f"{r['component']}.php"].append((r["key"], text))
+                by_srcfile[v.code][r["sourcefile"]].append((r["key"], text))
+
+    return {v.code: {
+        "en_variant_by_component": {
+            phpfile: (render_php(items), [phpfile[:-len(".php")]])
+            for phpfile, items in by_component[v.code].items()
+        },
+        "en_variant_by_sourcefile": {
+            phpfile: (render_php(items), sorted(srcfile_components[phpfile]))
+            for phpfile, items in by_srcfile[v.code].items()
+        },
+    } for v in VARIANTS}
+
+
+def build(rows: List[Row]) -> Dict[str, Dict]:
+    """Sync both pack layouts of every variant with its translated rows and
+    write the build manifests, in one pass over rows (the whole table).
+    Returns {variant code: {pack name: sync_pack() result}}."""
+    rendered = render_packs(rows)
+    built = {}
+    for v in VARIANTS:
+        previous = load_build_manifest(v)
+        packs = {}
+        outputs = rendered[v.code]
+
+        for name, files in outputs.items():
+            outdir = variant_output_dir(v) / name
+            # Each folder carries its own langconfig.php.
+            files["langconfig.php"] = (langconfig_php(v), ["langconfig"])
+            result = sync_pack(outdir, files, previous.get(name, {}).get("files", {}))
+            packs[name] = result
+            metrics.add("build", files_written=len(result["written"]),
+                        files_unchanged=result["unchanged"], files_removed=len(result["removed"]),
+                        bytes_written=sum(len(files[f][0].encode("utf-8"))
+                                          for f in result["written"]))
+            print(f"Wrote {len(result['written'])} of {len(files)} files into {outdir} "
+                  f"({result['unchanged']} unchanged, {len(result['removed'])} removed)")
+
+        path = manifest_path(v)
+        atomic_write_text(path, json.dumps(
+            {"version": 1, "variant": v.code, "built": time.time(), "packs": packs}, indent=1))
+        affected = sorted({c for p in packs.values() for c in p["components"]})
+        print(f"Changed components: {', '.join(affected) if affected else 'none'}")
+        print(f"Build manifest: {path}")
+        built[v.code] = packs
     print("Next: copy one pack to moodledata/lang/en_skyrim and purge caches.")
+    return built
+
+
+def main():
+    ensure_dirs()
+    store = open_store()
+    rows = store.all_rows()
+    store.close()
+    build(rows)
+
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+One entry point for every step of the pipeline.
+
+    py -m src extract                 # 1) mine Moodle strings into the store
+    py -m src translate [--dry-run]   # 2) translate pending rows (or estimate tokens/cost)
+    py -m src build                   # 3) write the language packs
+    py -m src apply [file.jsonl ...]  # re-apply saved batch output
+    py -m src validate [--requeue]    # re-check placeholders and tags
+    py -m src status                  # store, batches and last run at a glance
+    py -m src delta scan OLD NEW      # queue only strings changed between two git refs
+    py -m src run [--profile ...]     # extract, translate and build in one go
+
+A subcommand's module is imported only when that subcommand runs, and the
+OpenAI client only when translate has something to send, so the offline
+commands start quickly and work without the SDK or OPENAI_API_KEY (see
+benchmarks/bench_startup.py). The scripts in src/ still run on their own.
+"""
+
+import argparse
+import importlib
+import sys
+
+# name -> (module, whether main() takes arguments, help)
+COMMANDS = {
+    "extract": ("src.extract_to_csv", False, "extract English strings into the string store"),
+    "translate": ("src.translate_csv", True, "translate pending rows through the API, or estimate (--dry-run)"),
+    "build": ("src.build_pack", False, "build the Moodle language packs"),
+    "apply": ("src.apply_batch_output", True, "apply saved Batch API output files"),
+    "validate": ("src.validate", True, "re-check placeholders and tags of translations"),
+    "status": ("src.status", True, "show store counts, open batches and the last run"),
+    "delta": ("src.delta", True, "queue strings changed between two Moodle git refs; patch"),
+    "run": ("src.run_all", True, "run extract, translate and build in one process"),
+}
+
+# Subcommands that never talk to the API.
+OFFLINE_COMMANDS = ("extract", "build", "apply", "validate", "status", "delta")
+
+
+def load(command: str):
+    """Import and return the module behind a subcommand."""
+    return importlib.import_module(COMMANDS[command][0])
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(
+        prog="py -m src", description="Moodle Language Pack Maker",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="commands:\n" + "\n".join(f"  {name:<10} {spec[2]}"
+                                          for name, spec in COMMANDS.items()))
+    ap.add_argument("command", nargs="?", choices=list(COMMANDS), metavar="command",
+                    help="one of the commands below")
+    ap.add_argument("args", nargs=argparse.REMAINDER,
+                    help="arguments for the command (try: <command> --help)")
+    args = ap.parse_args(argv)
+    if args.command is None:
+        ap.print_help()
+        return 2
+
+    takes_args = COMMANDS[args.command][1]
+    if args.args and not takes_args:
+        ap.error(f"{args.command} takes no arguments")
+
+    from src.common import ensure_dirs
+    ensure_dirs()
+    module = load(args.command)
+    return module.main(args.args) if takes_args else module.main()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
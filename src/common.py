@@ -1,25 +1,177 @@
 # common module placeholder
 # -*- coding: utf-8 -*-
-import json, os, re, csv, hashlib, time
+import json, os, re, csv, hashlib, sys, time
 from pathlib import Path
-from typing import Iterable, List, Dict, Tuple
+from typing import Iterable, Iterator, List, Dict, Optional, Tuple
 from config import (MOODLE_CODE_ROOT, MOODLE_CORE_LANG_EN, INCLUDE_PLUGINS,
                     WORKDIR, DATA_DIR, OUTPUT_DIR, LOG_DIR, VARIANT_CODE,
                     VARIANT_NAME, PARENT_LANGUAGE, BATCH_SIZE, OPENAI_MODEL,
                     TARGET_STYLE, INCLUDE_ONLY_REL_PATHS, SKIP_BASENAMES)
+from src.row import Row, FIELDS
+from src.variants import STATUS_PREFIX
 
-# Ensure folders exist
-for p in (DATA_DIR, OUTPUT_DIR, LOG_DIR):
-    p.mkdir(parents=True, exist_ok=True)
+def ensure_dirs() -> None:
+    """Create the work folders. Called by the entry points rather than on
+    import, so importing a module has no side effects."""
+    for p in (DATA_DIR, OUTPUT_DIR, LOG_DIR):
+        p.mkdir(parents=True, exist_ok=True)
 
 CSV_PATH = DATA_DIR / "strings.csv"
+MANIFEST_PATH = DATA_DIR / "extract_manifest.json"
+
+# Column order of strings.csv (see src/row.py).
+CSV_FIELDS = list(FIELDS)
+
+# --- PHP language file scanner ---------------------------------------------
+#
+# One left-to-right pass over the file. _NEXT_TOKEN jumps to the next thing
+# that matters (a $string statement, a comment, or a literal that must be
+# skipped so its contents are not mistaken for code); statements are then
+# parsed with anchored matches, so there is no backtracking across the file.
+
+_SQ_BODY = r"'([^'\\]*(?:\\.[^'\\]*)*)'"
+_DQ_BODY = r'"([^"\\]*(?:\\.[^"\\]*)*)"'
+# The first alternative parses the everyday one-literal statement in the same
+# search that finds it; anything else falls back to the general parser below.
+_NEXT_TOKEN = re.compile(
+    r"\$string\[(?:" + _SQ_BODY + "|" + _DQ_BODY + r")\]\s*=\s*"
+    r"(?:" + _SQ_BODY + "|" + _DQ_BODY + r");"
+    r"|\$string\b|//|#|/\*|'|\"|<<<", re.S)
+_GAP = re.compile(r"(?:\s+|//[^\n]*|#[^\n]*|/\*.*?\*/)*", re.S)
+_SQ_LIT = re.compile(_SQ_BODY, re.S)
+_DQ_LIT = re.compile(_DQ_BODY, re.S)
+_HEREDOC_HEAD = re.compile(r"<<<[ \t]*(?:'([A-Za-z_]\w*)'|\"?([A-Za-z_]\w*)\"?)\r?\n")
+
+_SQ_ESC = re.compile(r"\\([\\'])")
+_DQ_ESC = re.compile(r'\\(?:([ntrvef\\$"])|([0-7]{1,3})|x([0-9A-Fa-f]{1,2})|u\{([0-9A-Fa-f]+)\})')
+_DQ_SIMPLE = {"n": "\n", "t": "\t", "r": "\r", "v": "\v", "e": "\x1b", "f": "\f",
+              "\\": "\\", "$": "$", '"': '"'}
+
+
+def _dq_escape(m: "re.Match") -> str:
+    simple, octal, hexa, uni = m.groups()
+    if simple:
+        return _DQ_SIMPLE[simple]
+    if octal:
+        return chr(int(octal, 8) & 0xFF)
+    if hexa:
+        return chr(int(hexa, 16))
+    return chr(int(uni, 16))
 
-# Regexes to extract $string['key'] = 'value';
-RE_SQ = re.compile(r"\$string\[['\"](?P<k>[^'\"]+)['\"]\]\s*=\s*'(?P<t>(?:\\'|[^'])*?)';", re.S)
-RE_DQ = re.compile(r'\$string\[\s*["\'](?P<k>[^"\']+)["\']\s*\]\s*=\s*"(?P<t>(?:\\"|[^"])*?)";', re.S)
 
 def unescape_php(s: str, quote: str) -> str:
-    return s.replace("\\'", "'") if quote == "'" else s.replace('\\"', '"')
+    """Decode a PHP literal body. quote is "'" (also nowdoc), '"' or "<<<"
+    for heredoc, which decodes like a double-quoted string except that \\"
+    is left alone."""
+    if "\\" not in s:
+        return s
+    if quote == "'":
+        return _SQ_ESC.sub(r"\1", s)
+    if quote == "<<<":
+        return _DQ_ESC.sub(lambda m: m.group() if m.group(1) == '"' else _dq_escape(m), s)
+    return _DQ_ESC.sub(_dq_escape, s)
+
+
+def _read_literal(data: str, pos: int):
+    """Parse the PHP string literal starting at pos. Returns (text, end) or
+    None when there is no complete literal there."""
+    c = data[pos:pos + 1]
+    if c == "'":
+        m = _SQ_LIT.match(data, pos)
+        return (unescape_php(m.group(1), "'"), m.end()) if m else None
+    if c == '"':
+        m = _DQ_LIT.match(data, pos)
+        return (unescape_php(m.group(1), '"'), m.end()) if m else None
+    m = _HEREDOC_HEAD.match(data, pos)
+    if not m:
+        return None
+    nowdoc, label = m.group(1), m.group(1) or m.group(2)
+    close = re.compile(r"^([ \t]*)" + label + r"\b", re.M).search(data, m.end())
+    if not close:
+        return None
+    body = data[m.end():close.start()]
+    if body.endswith("\n"):
+        body = body[:-1].rstrip("\r")
+    indent = close.group(1)
+    if indent:
+        # PHP 7.3+ flexible heredoc: the closing marker's indentation is
+        # removed from every line of the body.
+        body = "\n".join(line[len(indent):] if line.startswith(indent) else line.lstrip(" \t")
+                         for line in body.split("\n"))
+    return (body if nowdoc else unescape_php(body, "<<<")), close.end()
+
+
+def _read_expr(data: str, pos: int):
+    """Parse literal ( . literal )* ; and return (text, end) or None."""
+    parts = []
+    while True:
+        pos = _GAP.match(data, pos).end()
+        lit = _read_literal(data, pos)
+        if lit is None:
+            return None
+        parts.append(lit[0])
+        pos = _GAP.match(data, lit[1]).end()
+        c = data[pos:pos + 1]
+        if c == ";":
+            return "".join(parts), pos + 1
+        if c != ".":
+            return None
+        pos += 1
+
+
+def scan_php_strings(data: str) -> Iterator[Tuple[str, str]]:
+    """Yield (key, text) for every $string['key'] = ...; statement in data.
+
+    Handles single/double quotes with their escape rules, heredoc and nowdoc,
+    and values built by concatenating literals with '.'. Statements inside
+    comments or string literals are ignored, as are assignments whose value
+    is not made of literals only (function calls, variables).
+    """
+    pos = 0
+    n = len(data)
+    while pos < n:
+        m = _NEXT_TOKEN.search(data, pos)
+        if not m:
+            return
+        ksq, kdq, vsq, vdq = m.groups()
+        if vsq is not None or vdq is not None:
+            yield (unescape_php(ksq, "'") if ksq is not None else unescape_php(kdq, '"'),
+                   unescape_php(vsq, "'") if vsq is not None else unescape_php(vdq, '"'))
+            pos = m.end()
+            continue
+        tok = m.group()
+        if tok in ("//", "#"):
+            nl = data.find("\n", m.end())
+            pos = n if nl < 0 else nl + 1
+            continue
+        if tok == "/*":
+            end = data.find("*/", m.end())
+            pos = n if end < 0 else end + 2
+            continue
+        if tok != "$string":
+            lit = _read_literal(data, m.start())
+            pos = lit[1] if lit else m.end()
+            continue
+
+        pos = m.end()
+        p = _GAP.match(data, pos).end()
+        if data[p:p + 1] != "[":
+            continue
+        key = _read_literal(data, _GAP.match(data, p + 1).end())
+        if key is None:
+            continue
+        p = _GAP.match(data, key[1]).end()
+        if data[p:p + 1] != "]":
+            continue
+        p = _GAP.match(data, p + 1).end()
+        if data[p:p + 1] != "=" or data[p + 1:p + 2] == "=":
+            continue
+        value = _read_expr(data, p + 1)
+        if value is None:
+            continue
+        yield key[0], value[0]
+        pos = value[1]
+
 
 def php_quote(s: str) -> str:
     # Minimal escaping for single-quoted PHP strings
@@ -32,23 +184,171 @@ def sha_row(component: str, relfile: str, key: str, text: str) -> str:
         h.update(v.encode("utf-8"))
     return h.hexdigest()
 
+def atomic_write_text(path: Path, text: str) -> None:
+    """Write text to a sibling temp file and rename it over path, so readers
+    never see a half-written file if the process dies mid-write."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with tmp.open("w", encoding="utf-8", newline="") as fh:
+        fh.write(text)
+    os.replace(tmp, path)
+
+def read_csv_rows(path: Path = CSV_PATH) -> List[Row]:
+    """Rows of a strings.csv, whatever its column order; missing columns
+    read as empty strings."""
+    with path.open(newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return []
+        width = len(header)
+        positions = [header.index(c) if c in header else width for c in CSV_FIELDS]
+        extras = [(i, name) for i, name in enumerate(header) if name not in CSV_FIELDS]
+        # Variant status columns repeat as much as status itself.
+        statuses = [(i, name) for i, name in extras if name.startswith(STATUS_PREFIX)]
+        # Short records (and missing columns, at position width) read as "".
+        need = max(positions) + 1 if width in positions else width
+        rows = []
+        for rec in reader:
+            if not rec:
+                continue
+            if len(rec) < need:
+                rec += [""] * (need - len(rec))
+            extra = None
+            if extras:
+                extra = {name: rec[i] for i, name in extras}
+                for i, name in statuses:
+                    extra[name] = sys.intern(rec[i])
+            rows.append(Row(*[rec[i] for i in positions], extra=extra))
+        return rows
+
+def write_csv_rows(rows: List[Row], path: Path = CSV_PATH) -> None:
+    """Write rows to path: CSV_FIELDS, then any extra columns in alphabetical
+    order. In-memory helpers (keys starting with "_") are never written.
+    Like atomic_write_text(), the table is written to a temp file that then
+    replaces path, so a run killed mid-write keeps the previous table."""
+    extras = set()
+    for r in rows:
+        extras.update(r.extra_columns())
+    extras = sorted(k for k in extras if not k.startswith("_"))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with tmp.open("w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(CSV_FIELDS + extras)
+        w.writerows(r.csv_values(extras) for r in rows)
+    os.replace(tmp, path)
+
+# --- Language file discovery -------------------------------------------------
+#
+# Moodle lists every plugin type and the directory holding its plugins in
+# lib/components.json (subplugin types live in each plugin's
+# db/subplugins.json). Discovery reads those and only looks at
+# <plugintype-dir>/<plugin>/lang/en, so its cost follows the number of plugins
+# rather than the size of the checkout.
+
+# Directories never worth descending into when components.json is missing and
+# we have to walk the tree.
+PRUNE_DIRS = {".git", ".github", "node_modules", "vendor", "tests", "fixtures",
+              "amd", "yui", "cache", "localcache", "moodledata"}
+
+_PLUGIN_NAME_RE = re.compile(r"^[a-z][a-z0-9_]*$")
+
+# Path of each lang/en directory -> frankenstyle component, built once by
+# discover_lang_files() and reused by component_from_path().
+_LANG_INDEX: Dict[Path, str] = {}
+
+
+def _read_json(path: str):
+    try:
+        with open(path, encoding="utf-8") as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+def _subplugin_dirs(root: str, plugindir: str) -> List[Tuple[str, str]]:
+    data = _read_json(os.path.join(plugindir, "db", "subplugins.json"))
+    if not isinstance(data, dict):
+        return []
+    found = []
+    # Moodle 4.3+ paths are relative to the plugin, older ones to the root.
+    for ptype, rel in (data.get("subplugintypes") or {}).items():
+        found.append((ptype, os.path.join(plugindir, rel)))
+    if not data.get("subplugintypes"):
+        for ptype, rel in (data.get("plugintypes") or {}).items():
+            found.append((ptype, os.path.join(root, rel)))
+    return found
+
+
+def build_lang_index(root: Path = MOODLE_CODE_ROOT) -> Optional[Dict[Path, str]]:
+    """Map every plugin lang/en directory under root to its component name.
+
+    Returns None when root has no lib/components.json (not a Moodle tree, or
+    a very old one), so callers can fall back to walking the tree.
+    """
+    data = _read_json(os.path.join(root, "lib", "components.json"))
+    if not isinstance(data, dict):
+        return None
+    index: Dict[Path, str] = {}
+    todo = [(ptype, os.path.join(root, rel))
+            for ptype, rel in (data.get("plugintypes") or {}).items()]
+    while todo:
+        ptype, typedir = todo.pop()
+        try:
+            entries = list(os.scandir(typedir))
+        except OSError:
+            continue
+        for e in entries:
+            if not _PLUGIN_NAME_RE.match(e.name) or not e.is_dir():
+                continue
+            langen = os.path.join(e.path, "lang", "en")
+            if os.path.isdir(langen):
+                index[Path(langen)] = f"{ptype}_{e.name}"
+            todo += _subplugin_dirs(str(root), e.path)
+    return index
+
+
+def _walk_lang_dirs(root: Path) -> List[Path]:
+    """Fallback discovery: find lang/en directories with a pruned os.walk."""
+    found = []
+    for dirpath, dirnames, _ in os.walk(root):
+        dirnames[:] = [d for d in dirnames if d not in PRUNE_DIRS]
+        if os.path.basename(dirpath) == "lang" and "en" in dirnames:
+            found.append(Path(dirpath, "en"))
+            dirnames.remove("en")
+    return found
+
+
+def _php_files(d: Path) -> List[Path]:
+    try:
+        return [Path(e.path) for e in os.scandir(d)
+                if e.name.endswith(".php") and e.is_file()]
+    except OSError:
+        return []
+
+
 def discover_lang_files() -> List[Path]:
     files: List[Path] = []
     # Core
     if MOODLE_CORE_LANG_EN.is_dir():
-        files += list(MOODLE_CORE_LANG_EN.glob("*.php"))
+        files += _php_files(MOODLE_CORE_LANG_EN)
     # Plugins
     if INCLUDE_PLUGINS:
-        for p in MOODLE_CODE_ROOT.rglob("lang/en/*.php"):
-            # exclude core we already added
-            if "lang\\en\\" in str(p).lower() or "lang/en/" in str(p).lower():
-                if p.parent == MOODLE_CORE_LANG_EN:
-                    continue
-                files.append(p)
+        index = build_lang_index()
+        if index is None:
+            print(f"No lib/components.json under {MOODLE_CODE_ROOT}; walking the tree instead")
+            dirs = [d for d in _walk_lang_dirs(MOODLE_CODE_ROOT) if d != MOODLE_CORE_LANG_EN]
+        else:
+            _LANG_INDEX.clear()
+            _LANG_INDEX.update(index)
+            dirs = list(index)
+        for d in dirs:
+            files += _php_files(d)
     # Optional include-only filter
     if INCLUDE_ONLY_REL_PATHS:
         keep = set(INCLUDE_ONLY_REL_PATHS)
-        files = [f for f in files if str(f.relative_to(MOODLE_CODE_ROOT)).replace("\\", "/") in keep]
+        files = [f for f in files if rel_from_root(f) in keep]
     return sorted(files)
 
 def rel_from_root(p: Path) -> str:
@@ -56,22 +356,27 @@ def rel_from_root(p: Path) -> str:
 
 def is_core_lang_file(p: Path) -> bool:
     # Core lang files are under moodle/lang/en/*.php
-    try:
-        return p.parent.resolve() == MOODLE_CORE_LANG_EN.resolve()
-    except Exception:
-        return False
+    return p.parent == MOODLE_CORE_LANG_EN
+
+# Plugin-type directory names that do not match their frankenstyle prefix,
+# used only when components.json is unavailable.
+_LEGACY_TYPE_PREFIX = {"blocks": "block", "question": "qtype"}
 
 def component_from_path(p: Path) -> str:
     """Compute frankenstyle component for plugins and sensible core component.
-       We keep this pragmatic rather than perfect. It is enough for pack output."""
-    parts = p.parts
-    # …/admin/tool/analytics/lang/en/tool_analytics.php or …/mod/forum/lang/en/forum.php
+
+    Plugins found through components.json come straight from the index built
+    by discover_lang_files(). Otherwise we fall back to a pragmatic guess from
+    the path, which is enough for pack output."""
     if is_core_lang_file(p):
         # Use file stem for core, eg admin.php -> admin, moodle.php -> moodle
-        stem = p.stem
-        return stem  # Moodle core components usually match filenames
-    # Plugins
-    # Find the index of "lang"
+        return p.stem  # Moodle core components usually match filenames
+    comp = _LANG_INDEX.get(p.parent)
+    if comp:
+        return comp
+
+    # …/admin/tool/analytics/lang/en/tool_analytics.php or …/mod/forum/lang/en/forum.php
+    parts = p.parts
     try:
         idx = parts.index("lang")
     except ValueError:
@@ -82,43 +387,10 @@ def component_from_path(p: Path) -> str:
     if idx is None or idx < 2:
         return p.stem
 
-    # Look back to determine plugin type and name
     # e.g. .../<plugintype>/<pluginname>/lang/en/<file>.php
     plugintype = parts[idx - 2]
     pluginname = parts[idx - 1]
-
-    # Map to frankenstyle
-    mapping = {
-        "mod": f"mod_{pluginname}",
-        "block": f"block_{pluginname}",
-        "blocks": f"block_{pluginname}",
-        "auth": f"auth_{pluginname}",
-        "enrol": f"enrol_{pluginname}",
-        "filter": f"filter_{pluginname}",
-        "format": f"format_{pluginname}",
-        "report": f"report_{pluginname}",
-        "grade": f"grade_{pluginname}",
-        "editor": f"editor_{pluginname}",
-        "qtype": f"qtype_{pluginname}",
-        "question": f"qtype_{pluginname}" if pluginname != "behaviour" else f"qbehaviour_{pluginname}",
-        "qbehaviour": f"qbehaviour_{pluginname}",
-        "tool": f"tool_{pluginname}",
-        "availability": f"availability_{pluginname}",
-        "message": f"message_{pluginname}",
-        "portfolio": f"portfolio_{pluginname}",
-        "repository": f"repository_{pluginname}",
-        "theme": f"theme_{pluginname}",
-        "local": f"local_{pluginname}",
-        "profilefield": f"profilefield_{pluginname}",
-        "assignsubmission": f"assignsubmission_{pluginname}",
-        "assignfeedback": f"assignfeedback_{pluginname}",
-        "booktool": f"booktool_{pluginname}",
-        "scormreport": f"scormreport_{pluginname}",
-        "admin": f"admin_{pluginname}",
-        # add others as needed
-    }
-    comp = mapping.get(plugintype, f"{plugintype}_{pluginname}")
-    return comp
+    return f"{_LEGACY_TYPE_PREFIX.get(plugintype, plugintype)}_{pluginname}"
 
 # Placeholder and tag validator
 PLACEHOLDER_PATTERNS = [
@@ -129,12 +401,102 @@ PLACEHOLDER_PATTERNS = [
 ]
 TAG_RE = re.compile(r"</?[A-Za-z][^>]*>")
 
+# All placeholder patterns and tags in one alternation, so a string is
+# scanned once. Tokens cannot overlap; a placeholder inside a tag is part of
+# the tag token, which still has to match exactly.
+_TOKEN_RE = re.compile("|".join(PLACEHOLDER_PATTERNS + [TAG_RE.pattern]))
+_TOKEN_SPLIT_RE = re.compile(f"({_TOKEN_RE.pattern})")
+_TOKEN_CHARS = ("{", "%", "<")
+
+Signature = Tuple[str, ...]
+
+
+def token_signature(s: str) -> Signature:
+    """Sorted tuple of the placeholders and tags in s (a multiset that can be
+    compared with == and used as a dict key)."""
+    if not any(c in s for c in _TOKEN_CHARS):
+        # Most UI strings have no tokens at all.
+        return ()
+    toks = _TOKEN_RE.findall(s)
+    toks.sort()
+    return tuple(toks)
+
+
+def split_tokens(s: str) -> List[str]:
+    """Split s into text and token pieces; odd indexes are the tokens."""
+    return _TOKEN_SPLIT_RE.split(s)
+
+
 def tokens_for(s: str) -> List[str]:
-    toks: List[str] = []
-    for p in PLACEHOLDER_PATTERNS:
-        toks += re.findall(p, s)
-    toks += TAG_RE.findall(s)
-    return sorted(toks)
+    return list(token_signature(s))
+
+
+# Source signatures by row hash. The hash covers the source text, so an
+# entry never goes stale; a run computes each source's signature once.
+_SOURCE_SIGNATURES: Dict[str, Signature] = {}
+
+
+def source_signature(row: Dict[str, str]) -> Signature:
+    digest = row.get("hash")
+    if not digest:
+        return token_signature(row["source_text"])
+    sig = _SOURCE_SIGNATURES.get(digest)
+    if sig is None:
+        sig = _SOURCE_SIGNATURES[digest] = token_signature(row["source_text"])
+    return sig
+
+
+def tokens_match(row: Dict[str, str], tgt: str) -> bool:
+    """True if tgt has exactly the placeholders and tags of row's source."""
+    return token_signature(tgt) == source_signature(row)
+
+# --- Batch output helpers ------------------------------------------------------
+
+def parse_translation(raw_text: str) -> str:
+    """Decode a single-string reply; we asked for {"translated_text": "..."}."""
+    try:
+        decoded = json.loads(raw_text)
+        if isinstance(decoded, dict) and "translated_text" in decoded:
+            translated = decoded["translated_text"]
+        else:
+            translated = decoded if isinstance(decoded, str) else raw_text
+    except json.JSONDecodeError:
+        translated = raw_text
+    return (translated if isinstance(translated, str) else "").strip()
+
+def parse_packed_translations(raw_text: str) -> Dict[str, str]:
+    """Decode a packed reply into {string key: translation}.
+
+    We ask for {"translations": [{"key": ..., "translated_text": ...}]} but
+    also accept a bare list or a plain {key: text} object. Anything that
+    cannot be decoded yields an empty dict, so every item counts as missing.
+    """
+    try:
+        decoded = json.loads(raw_text)
+    except json.JSONDecodeError:
+        return {}
+    if isinstance(decoded, dict) and "translations" in decoded:
+        decoded = decoded["translations"]
+    found = {}
+    if isinstance(decoded, list):
+        for item in decoded:
+            if isinstance(item, dict) and isinstance(item.get("translated_text"), str):
+                found[str(item.get("key"))] = item["translated_text"].strip()
+    elif isinstance(decoded, dict):
+        for k, v in decoded.items():
+            if isinstance(v, str):
+                found[str(k)] = v.strip()
+    return {k: v for k, v in found.items() if v}
+
+def accept_translation(row: Dict[str, str], tgt: str) -> bool:
+    """Store tgt on row if its placeholders and tags match the source,
+    otherwise fall back to the source text. Returns True if the row changed."""
+    src = row["source_text"]
+    safe_tgt = tgt if tokens_match(row, tgt) else src
+    changed = safe_tgt != row.get("translated_text")
+    row["translated_text"] = safe_tgt
+    row["status"] = "ok" if safe_tgt != src else "fallback"
+    return changed
 
 def chunk(it: Iterable, n: int):
     buf = []
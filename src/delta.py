@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+"""
+Upgrade delta mode: queue only the strings that changed between two Moodle
+releases, straight from git.
+
+    py -m src.delta scan MOODLE_404_STABLE MOODLE_405_STABLE [--dry-run]
+    py -m src translate
+    py -m src.delta patch
+
+scan diffs the two refs of the MOODLE_CODE_ROOT checkout, limited to the
+language files extraction reads: core lang/en and the plugin directories
+listed by lib/components.json, after the usual SKIP_BASENAMES,
+INCLUDE_PLUGINS and INCLUDE_ONLY_REL_PATHS filters. Only the touched files
+are parsed, from git at both refs, and their keys are classified as added,
+changed or deleted. In the store, the rows of touched files are replaced by
+the new ref's strings: unchanged strings keep their translation (rows are
+matched on hash), added and changed ones become pending, deleted ones go.
+Nothing else in the table is read from the checkout, so the next translate
+run sends just the delta. logs/delta_report.json records every touched key
+with its old and new text.
+
+patch, run after translate, writes the pack files of the components the
+delta touched, for every variant, into output/patches/<from>..<to>/ with a
+patch.json listing the files to copy and the ones to delete, so a site
+already running the old pack can be brought up to date without a full
+deploy.
+
+The checkout does not need to be at either ref; only the plugin
+directories (and so the components of files the store has never seen) are
+looked up in the working tree.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import time
+from pathlib import Path, PurePosixPath
+from typing import Dict, List, Optional, Tuple
+
+from config import (MOODLE_CODE_ROOT, MOODLE_CORE_LANG_EN, LOG_DIR, OUTPUT_DIR,
+                    INCLUDE_PLUGINS, INCLUDE_ONLY_REL_PATHS, SKIP_BASENAMES)
+from src.common import (PRUNE_DIRS, atomic_write_text, build_lang_index, component_from_path,
+                        ensure_dirs, rel_from_root)
+from src.extract_to_csv import (decode_php, parse_lang_file, new_row, load_manifest,
+                                save_manifest)
+from src.build_pack import render_packs, variant_output_dir
+from src.row import Row
+from src.store import open_store
+from src.variants import VARIANTS, status_of
+
+DELTA_REPORT_PATH = LOG_DIR / "delta_report.json"
+PATCH_DIR = OUTPUT_DIR / "patches"
+
+# git pathspecs for core and plugin language files; "glob" keeps * from
+# matching "/".
+LANG_PATHSPECS = [":(glob)lang/en/*.php", ":(glob)**/lang/en/*.php"]
+
+_STATUS = {"A": "added", "M": "modified", "D": "deleted"}
+
+
+def git(*args: str, stdin: Optional[bytes] = None) -> bytes:
+    """Run git in MOODLE_CODE_ROOT and return its output."""
+    try:
+        proc = subprocess.run(["git", "-C", str(MOODLE_CODE_ROOT), *args], input=stdin,
+                              capture_output=True)
+    except FileNotFoundError:
+        raise SystemExit("git is not installed or not on PATH")
+    if proc.returncode:
+        raise SystemExit(f"git {' '.join(args[:2])} failed: "
+                         f"{proc.stderr.decode('utf-8', 'replace').strip()}")
+    return proc.stdout
+
+
+def plugin_lang_dirs() -> Optional[Dict[str, str]]:
+    """Relative path of every plugin lang/en directory extraction reads ->
+    its component (build_lang_index() of the working tree), or None when
+    the checkout has no lib/components.json."""
+    index = build_lang_index()
+    if index is None:
+        return None
+    return {rel_from_root(d): component for d, component in index.items()}
+
+
+def wanted(relpath: str, plugins: Optional[Dict[str, str]], known=()) -> bool:
+    """
+    Whether extraction would read this language file: one in core lang/en,
+    in a directory of plugins (without components.json, any lang/en outside
+    PRUNE_DIRS, as the walk would find it), or one the store already holds
+    (known), after the SKIP_BASENAMES, INCLUDE_PLUGINS and
+    INCLUDE_ONLY_REL_PATHS filters.
+    """
+    p = PurePosixPath(relpath)
+    if p.suffix != ".php" or p.name in SKIP_BASENAMES:
+        return False
+    if INCLUDE_ONLY_REL_PATHS and relpath not in INCLUDE_ONLY_REL_PATHS:
+        return False
+    directory = str(p.parent)
+    if directory == rel_from_root(MOODLE_CORE_LANG_EN):
+        return True
+    if not INCLUDE_PLUGINS:
+        return False
+    if relpath in known:
+        return True
+    if plugins is not None:
+        return directory in plugins
+    return (p.parent.name == "en" and p.parent.parent.name == "lang"
+            and not PRUNE_DIRS.intersection(p.parts[:-1]))
+
+
+def changed_lang_files(old: str, new: str, plugins: Optional[Dict[str, str]],
+                       known=()) -> List[Tuple[str, str]]:
+    """(status letter, relpath) of the language files that differ between
+    the refs and that extraction reads (see wanted()); renames show up as a
+    deletion plus an addition."""
+    out = git("diff", "--name-status", "--no-renames", "--relative", "-z", old, new,
+              "--", *LANG_PATHSPECS)
+    fields = out.decode("utf-8").split("\0")
+    changes = []
+    for status, relpath in zip(fields[0::2], fields[1::2]):
+        status = status[:1]
+        if status == "T":
+            status = "M"
+        if status in _STATUS and wanted(relpath, plugins, known):
+            changes.append((status, relpath))
+    return sorted(changes, key=lambda c: c[1])
+
+
+def read_blobs(ref: str, relpaths: List[str]) -> Dict[str, bytes]:
+    """Contents of relpaths at ref, in one `git cat-file --batch` call.
+    Paths missing at ref are left out."""
+    if not relpaths:
+        return {}
+    out = git("cat-file", "--batch",
+              stdin="".join(f"{ref}:./{p}\n" for p in relpaths).encode("utf-8"))
+    blobs = {}
+    pos = 0
+    for relpath in relpaths:
+        eol = out.index(b"\n", pos)
+        header = out[pos:eol].split()
+        pos = eol + 1
+        if header[-1] == b"missing" or len(header) != 3:
+            continue
+        size = int(header[2])
+        blobs[relpath] = out[pos:pos + size]
+        pos += size + 1
+    return blobs
+
+
+def resolve(ref: str) -> str:
+    """Commit id of ref."""
+    try:
+        return git("rev-parse", "--verify", "--quiet", f"{ref}^{{commit}}").decode("ascii").strip()
+    except SystemExit:
+        raise SystemExit(f"Unknown git ref {ref!r} in {MOODLE_CODE_ROOT}")
+
+
+def diff_refs(old: str, new: str, components: Dict[str, str]) -> List[dict]:
+    """
+    Parse the language files touched between old and new at both refs.
+
+    components maps relpath to component for files the store already knows.
+    Returns one entry per file with its key-level delta and its parsed
+    strings at new ((key, text, hash) tuples, under "_strings").
+    """
+    plugins = plugin_lang_dirs() if INCLUDE_PLUGINS else {}
+    changes = changed_lang_files(old, new, plugins, components)
+    old_blobs = read_blobs(old, [p for s, p in changes if s != "A"])
+    new_blobs = read_blobs(new, [p for s, p in changes if s != "D"])
+
+    files = []
+    for status, relpath in changes:
+        directory = str(PurePosixPath(relpath).parent)
+        component = (components.get(relpath) or (plugins or {}).get(directory)
+                     or component_from_path(MOODLE_CODE_ROOT / relpath))
+        before = parse_lang_file(decode_php(old_blobs[relpath]), component, relpath) \
+            if relpath in old_blobs else []
+        after = parse_lang_file(decode_php(new_blobs[relpath]), component, relpath) \
+            if relpath in new_blobs else []
+        old_text = {key: text for key, text, _ in before}
+        new_text = {key: text for key, text, _ in after}
+        files.append({
+            "relpath": relpath,
+            "component": component,
+            "status": _STATUS[status],
+            "added": [{"key": k, "text": t} for k, t in new_text.items() if k not in old_text],
+            "changed": [{"key": k, "old": old_text[k], "new": t}
+                        for k, t in new_text.items() if k in old_text and old_text[k] != t],
+            "deleted": [{"key": k, "text": t} for k, t in old_text.items() if k not in new_text],
+            "_strings": after,
+        })
+    return files
+
+
+def apply_delta(rows: List[Row], files: List[dict]) -> Tuple[List[Row], int]:
+    """
+    The table with the rows of touched files replaced by their strings at
+    the new ref, in place (new files go at the end). Strings whose hash is
+    already in the table keep their row, translation included.
+    Returns (rows, number of new pending rows).
+    """
+    touched = {f["relpath"]: f for f in files}
+    known = {r["hash"]: r for r in rows if r["relpath"] in touched}
+    queued = 0
+
+    def file_rows(f: dict) -> List[Row]:
+        nonlocal queued
+        sourcefile = os.path.basename(f["relpath"])
+        result = []
+        for key, text, h in f["_strings"]:
+            row = known.get(h)
+            if row is None:
+                row = new_row(f["component"], f["relpath"], sourcefile, key, text, h)
+                queued += 1
+            result.append(row)
+        return result
+
+    table, done = [], set()
+    for r in rows:
+        relpath = r["relpath"]
+        if relpath not in touched:
+            table.append(r)
+        elif relpath not in done:
+            done.add(relpath)
+            table += file_rows(touched[relpath])
+    for relpath, f in touched.items():
+        if relpath not in done:
+            table += file_rows(f)
+    return table, queued
+
+
+def print_report(report: dict) -> None:
+    totals = report["totals"]
+    print(f"Delta {report['from']} -> {report['to']}: {totals['files']} language files touched, "
+          f"{totals['added']} keys added, {totals['changed']} changed, "
+          f"{totals['deleted']} deleted")
+    for f in report["files"][:20]:
+        print(f"  {f['status']:<8} {f['relpath']}: +{len(f['added'])} "
+              f"~{len(f['changed'])} -{len(f['deleted'])}")
+    if len(report["files"]) > 20:
+        print(f"  ... and {len(report['files']) - 20} more files")
+
+
+def scan(old: str, new: str, dry_run: bool = False) -> dict:
+    """Diff old..new, update the store (unless dry_run) and write the report."""
+    old_commit, new_commit = resolve(old), resolve(new)
+    store = open_store()
+    try:
+        rows = store.all_rows() if store.exists() else []
+        components = {r["relpath"]: r["component"] for r in rows}
+        files = diff_refs(old_commit, new_commit, components)
+
+        report = {
+            "version": 1, "from": old, "to": new,
+            "from_commit": old_commit, "to_commit": new_commit, "created": time.time(),
+            "files": [{k: v for k, v in f.items() if not k.startswith("_")} for f in files],
+            "components": sorted({f["component"] for f in files}),
+            "totals": {"files": len(files),
+                       **{kind: sum(len(f[kind]) for f in files)
+                          for kind in ("added", "changed", "deleted")}},
+        }
+        print_report(report)
+        if files and not dry_run:
+            table, queued = apply_delta(rows, files)
+            store.replace_all(table)
+            report["totals"]["queued"] = queued
+            print(f"Queued {queued} strings for translation in {store.path} "
+                  f"({len(table)} rows, was {len(rows)}).")
+    finally:
+        store.close()
+
+    atomic_write_text(DELTA_REPORT_PATH, json.dumps(report, ensure_ascii=False, indent=1))
+    print(f"Delta report: {DELTA_REPORT_PATH}")
+    if files and not dry_run:
+        # The next full extract re-parses the touched files instead of
+        # trusting the size/mtime it recorded for them.
+        manifest = load_manifest()
+        if manifest:
+            for f in files:
+                manifest.pop(f["relpath"], None)
+            save_manifest(manifest)
+        print("Next: py -m src translate, then py -m src.delta patch")
+    return report
+
+
+def write_patch(report_path: Path = DELTA_REPORT_PATH) -> Path:
+    """Write the pack files the delta in report_path touched, per variant."""
+    try:
+        report = json.loads(report_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        raise SystemExit(f"No readable delta report at {report_path}; run scan first")
+    components = set(report["components"])
+    sourcefiles = {os.path.basename(f["relpath"]) for f in report["files"]}
+
+    store = open_store()
+    try:
+        # Every row of the touched components and source files, so their
+        # files are rendered in full.
+        rows = [r for r in store.all_rows()
+                if r["component"] in components or r["sourcefile"] in sourcefiles]
+    finally:
+        store.close()
+    pending = {v.code: sum(1 for r in rows if status_of(r, v) == "pending") for v in VARIANTS}
+
+    wanted_files = {"en_variant_by_component": {f"{c}.php" for c in components},
+                    "en_variant_by_sourcefile": sourcefiles}
+    out = PATCH_DIR / f"{report['from_commit'][:10]}..{report['to_commit'][:10]}"
+    if out.exists():
+        shutil.rmtree(out)
+    rendered = render_packs(rows)
+    manifest = {"version": 1, "from": report["from"], "to": report["to"],
+                "from_commit": report["from_commit"], "to_commit": report["to_commit"],
+                "created": time.time(), "components": sorted(components), "variants": {}}
+    written = removed = 0
+    for v in VARIANTS:
+        base = Path(os.path.relpath(variant_output_dir(v), OUTPUT_DIR))
+        packs = {}
+        for name, files in rendered[v.code].items():
+            write = sorted(wanted_files[name] & set(files))
+            for filename in write:
+                atomic_write_text(out / base / name / filename, files[filename][0])
+            packs[name] = {"write": write, "remove": sorted(wanted_files[name] - set(files))}
+            written += len(write)
+            removed += len(packs[name]["remove"])
+        manifest["variants"][v.code] = {"dir": base.as_posix(), "packs": packs,
+                                        "pending": pending[v.code]}
+        if pending[v.code]:
+            print(f"Warning: {pending[v.code]} strings of the delta are still pending for "
+                  f"{v.code}; they stay in English until translated and patched again.")
+    atomic_write_text(out / "patch.json", json.dumps(manifest, indent=1))
+    print(f"Pack patch for {report['from']} -> {report['to']}: {written} files to copy, "
+          f"{removed} to delete, in {out}")
+    return out
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(
+        description="Queue only the strings that changed between two Moodle git refs.")
+    sub = ap.add_subparsers(dest="action", required=True)
+    sp = sub.add_parser("scan", help="diff two refs, queue the delta and write the report")
+    sp.add_argument("old", help="git ref the current pack was built from, e.g. MOODLE_404_STABLE")
+    sp.add_argument("new", help="git ref to upgrade to, e.g. MOODLE_405_STABLE")
+    sp.add_argument("--dry-run", action="store_true", help="report only, leave the store alone")
+    pp = sub.add_parser("patch", help="write the pack files touched by the last scan")
+    pp.add_argument("--report", type=Path, default=DELTA_REPORT_PATH,
+                    help=f"delta report to use (default {DELTA_REPORT_PATH})")
+    args = ap.parse_args(argv)
+
+    ensure_dirs()
+    if args.action == "scan":
+        scan(args.old, args.new, args.dry_run)
+    else:
+        write_patch(args.report)
+
+
+if __name__ == "__main__":
+    main()
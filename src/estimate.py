@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Local token and cost estimates for translation requests.
+
+Nothing here talks to the API. Tokens are counted with tiktoken when it is
+installed (the encoding of OPENAI_MODEL, or o200k_base for models it does
+not know) and estimated at four characters per token otherwise. A request's
+input is its messages plus a few tokens of chat framing each. Its expected
+output is the JSON reply with every translation as long as its source,
+capped at the request's max_output_tokens. Costs come from TOKEN_PRICES,
+times BATCH_PRICE_FACTOR for batch jobs.
+
+translate_csv estimates every request before it uploads anything, checks the
+totals against TOKEN_BUDGET and sizes and paces its shards with TokenGate so
+the batches in flight stay within BATCH_ENQUEUED_TOKEN_LIMIT.
+`py src\\translate_csv.py --dry-run` prints the full report and stops there.
+"""
+
+import json
+import math
+import threading
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config import OPENAI_MODEL, TOKEN_PRICES, BATCH_PRICE_FACTOR
+
+# Framing tokens of every message, and of the reply, in the chat format.
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+_tokenizer: Optional[Tuple[Callable[[str], int], str]] = None
+
+
+def tokenizer() -> Tuple[Callable[[str], int], str]:
+    """(count function, description) of the tokenizer in use."""
+    global _tokenizer
+    if _tokenizer is None:
+        try:
+            import tiktoken
+            try:
+                enc = tiktoken.encoding_for_model(OPENAI_MODEL)
+            except KeyError:
+                enc = tiktoken.get_encoding("o200k_base")
+            _tokenizer = (lambda text: len(enc.encode(text, disallowed_special=())),
+                          f"tiktoken {enc.name}")
+        except Exception:
+            # Not installed, or its encoding files are neither cached nor
+            # downloadable.
+            _tokenizer = (lambda text: math.ceil(len(text) / 4), "about 4 characters per token")
+    return _tokenizer
+
+
+def count_tokens(text: str) -> int:
+    return tokenizer()[0](text)
+
+
+def request_tokens(unit, body: dict) -> Tuple[int, int]:
+    """(input tokens, expected output tokens) of one request: body as built
+    for unit (its list of rows) by translate_csv.request_body."""
+    count = tokenizer()[0]
+    input_tokens = TOKENS_PER_REPLY + sum(TOKENS_PER_MESSAGE + count(m["content"])
+                                          for m in body["input"])
+    if len(unit) == 1:
+        reply = {"translated_text": unit[0]["source_text"]}
+    else:
+        reply = {"translations": [{"key": r["key"], "translated_text": r["source_text"]}
+                                  for r in unit]}
+    output_tokens = count(json.dumps(reply, ensure_ascii=False))
+    return input_tokens, min(output_tokens, body.get("max_output_tokens", output_tokens))
+
+
+def cost(input_tokens: int, output_tokens: int, batch: bool = True) -> Optional[float]:
+    """Estimated USD for OPENAI_MODEL, or None if TOKEN_PRICES lacks it."""
+    prices = TOKEN_PRICES.get(OPENAI_MODEL)
+    if prices is None:
+        return None
+    usd = (input_tokens * prices[0] + output_tokens * prices[1]) / 1_000_000
+    return usd * BATCH_PRICE_FACTOR if batch else usd
+
+
+def format_cost(usd: Optional[float]) -> str:
+    return "no price for " + OPENAI_MODEL if usd is None else f"${usd:,.4f}"
+
+
+class Estimate:
+    """Token counts of a set of requests, in total and by component."""
+
+    def __init__(self):
+        # component -> [requests, strings, input tokens, output tokens]
+        self.by_component: Dict[str, List[int]] = defaultdict(lambda: [0, 0, 0, 0])
+        self.requests = self.strings = self.input_tokens = self.output_tokens = 0
+
+    def add(self, unit, body: dict) -> int:
+        """Count one request; returns its input plus expected output tokens."""
+        inp, out = request_tokens(unit, body)
+        entry = self.by_component[unit[0]["component"]]
+        entry[0] += 1
+        entry[1] += len(unit)
+        entry[2] += inp
+        entry[3] += out
+        self.requests += 1
+        self.strings += len(unit)
+        self.input_tokens += inp
+        self.output_tokens += out
+        return inp + out
+
+    @property
+    def tokens(self) -> int:
+        return self.input_tokens + self.output_tokens
+
+    def cost(self, batch: bool = True) -> Optional[float]:
+        return cost(self.input_tokens, self.output_tokens, batch)
+
+    def summary(self, batch: bool = True) -> str:
+        return (f"{self.input_tokens:,} input + {self.output_tokens:,} output tokens for "
+                f"{self.requests:,} requests ({tokenizer()[1]}), "
+                f"about {format_cost(self.cost(batch))} at {'batch' if batch else 'standard'} "
+                f"prices")
+
+    def report(self, batch: bool = True, top: Optional[int] = None) -> None:
+        """Print the totals by component, largest first (top of them only if
+        given), then the overall total."""
+        rows = sorted(self.by_component.items(), key=lambda kv: -kv[1][2])
+        print(f"{'component':<40} {'requests':>9} {'strings':>9} {'input':>12} {'output':>12} "
+              f"{'cost':>11}")
+        for component, (reqs, strings, inp, out) in rows[:top]:
+            usd = cost(inp, out, batch)
+            print(f"{component:<40} {reqs:>9,} {strings:>9,} {inp:>12,} {out:>12,} "
+                  f"{'-' if usd is None else f'${usd:,.4f}':>11}")
+        if top is not None and len(rows) > top:
+            print(f"  ... and {len(rows) - top} more components")
+        print(f"{'total':<40} {self.requests:>9,} {self.strings:>9,} {self.input_tokens:>12,} "
+              f"{self.output_tokens:>12,} {format_cost(self.cost(batch)):>11}")
+
+    def to_json(self, batch: bool = True) -> dict:
+        return {
+            "model": OPENAI_MODEL,
+            "tokenizer": tokenizer()[1],
+            "batch_prices": batch,
+            "requests": self.requests,
+            "strings": self.strings,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "cost_usd": self.cost(batch),
+            "components": {c: dict(zip(("requests", "strings", "input_tokens", "output_tokens"),
+                                       v)) for c, v in sorted(self.by_component.items())},
+        }
+
+
+class TokenGate:
+    """
+    Admit batches while the input tokens they hold in the queue stay within
+    a limit. acquire() blocks until enough in-flight batches have released
+    theirs; a batch is always admitted when nothing else is in flight, so an
+    oversized one cannot wait forever.
+    """
+
+    def __init__(self, limit: Optional[int]):
+        self.limit = limit
+        self.used = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, tokens: int, wait: bool = True) -> None:
+        with self._cond:
+            while (wait and self.limit is not None and self.used
+                   and self.used + tokens > self.limit):
+                self._cond.wait()
+            self.used += tokens
+
+    def release(self, tokens: int) -> None:
+        with self._cond:
+            self.used -= tokens
+            self._cond.notify_all()
@@ -1,50 +1,186 @@
 # -*- coding: utf-8 -*-
-import csv
-from config import SKIP_BASENAMES
+import os
+import json
+import hashlib
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+from config import (SKIP_BASENAMES, INCREMENTAL_EXTRACT, EXTRACT_WORKERS,
+                    EXTRACT_CHUNK_SIZE)
 from src.common import (
     discover_lang_files, rel_from_root, component_from_path,
-    RE_SQ, RE_DQ, unescape_php, sha_row, CSV_PATH
+    scan_php_strings, sha_row, MANIFEST_PATH, atomic_write_text, ensure_dirs
 )
+from src.store import open_store
+from src.row import Row
+from src.metrics import metrics
 
 
-def main():
-    """Extract English Moodle strings into a CSV workbook.
+def decode_php(raw: bytes) -> str:
+    # Same result as Path.read_text(errors="ignore"), including the universal
+    # newline translation, so hashes do not depend on the checkout's EOLs.
+    text = raw.decode("utf-8", errors="ignore")
+    return text.replace("\r\n", "\n").replace("\r", "\n")
+
+
+def parse_lang_file(data: str, component: str, relfile: str) -> List[Tuple[str, str, str]]:
+    """Return (key, text, hash) for every $string definition found in data."""
+    # Single- and double-quoted definitions, heredocs and concatenations are
+    # all picked up in one pass, in the order they appear in the file.
+    return [(key, text, sha_row(component, relfile, key, text))
+            for key, text in scan_php_strings(data)]
+
+
+def scan_file(task: Tuple[str, str, str]) -> Tuple[str, List[Tuple[str, str, str]]]:
+    """Read, hash and parse one language file.
+
+    task is (path, relfile, component). Everything is passed in explicitly
+    and only plain tuples come back, so this runs unchanged in a worker
+    process.
+    """
+    path, relfile, component = task
+    raw = Path(path).read_bytes()
+    digest = hashlib.sha256(raw).hexdigest()
+    return digest, parse_lang_file(decode_php(raw), component, relfile)
+
+
+def scan_files(tasks: List[Tuple[str, str, str]], workers: int = EXTRACT_WORKERS,
+               chunksize: int = EXTRACT_CHUNK_SIZE) -> Iterator[Tuple[str, list]]:
+    """Yield scan_file() results in the same order as tasks."""
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(tasks) < 2:
+        yield from map(scan_file, tasks)
+        return
+    if chunksize <= 0:
+        # A few chunks per worker balances load without drowning in IPC.
+        chunksize = max(1, len(tasks) // (workers * 4))
+    from concurrent.futures import ProcessPoolExecutor  # only needed with workers
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Executor.map returns results in submission order, so the output is
+        # the same as the serial path regardless of which worker finishes first.
+        yield from pool.map(scan_file, tasks, chunksize=chunksize)
+
+
+def new_row(component, relfile, sourcefile, key, text, digest) -> Row:
+    return Row(component, relfile, sourcefile, key, text, "", "pending", digest)
+
+
+def load_manifest() -> Dict[str, dict]:
+    if not MANIFEST_PATH.exists():
+        return {}
+    try:
+        return json.loads(MANIFEST_PATH.read_text(encoding="utf-8"))["files"]
+    except (json.JSONDecodeError, KeyError):
+        print(f"Ignoring unreadable manifest {MANIFEST_PATH}")
+        return {}
+
+
+def save_manifest(files: Dict[str, dict]) -> None:
+    atomic_write_text(MANIFEST_PATH,
+                      json.dumps({"version": 1, "files": files}, indent=1))
+
+
+def extract(store) -> Dict[str, dict]:
+    """Extract English Moodle strings into store (strings.csv by default).
 
     The heavy lifting—file discovery, PHP string parsing, and CSV writing—is
     intentionally straightforward so it is easy to tweak when adapting the
     workflow to new components or custom plugins.
+
+    With INCREMENTAL_EXTRACT enabled, files whose size/mtime (or, failing
+    that, content hash) match the manifest from the previous run are not
+    parsed again, and every row whose hash already exists in the store keeps
+    its translation and status. Only new or modified strings become pending.
+
+    Returns the new file manifest. Save it with save_manifest() only once
+    the rows are on disk: a manifest newer than the store would make the
+    next run skip files whose rows were never written.
     """
-    files = discover_lang_files()
-    rows = []
+    with metrics.timed("extract", "discover_seconds"):
+        files = [f for f in discover_lang_files() if f.name not in SKIP_BASENAMES]
+
+    old_rows = []
+    manifest = {}
+    if INCREMENTAL_EXTRACT and store.exists():
+        old_rows = store.all_rows()
+        manifest = load_manifest()
+
+    old_by_file = defaultdict(list)
+    old_by_hash = {}
+    for r in old_rows:
+        old_by_file[r["relpath"]].append(r)
+        old_by_hash.setdefault(r["hash"], r)
+
+    # Decide per file whether the previous run's rows can be reused as-is.
+    # Slots hold either a list of reused rows or None for "parse this file".
+    slots = []
+    tasks = []
+    new_manifest = {}
     for php in files:
-        if php.name in SKIP_BASENAMES:
-            continue
-        data = php.read_text(encoding="utf-8", errors="ignore")
         relfile = rel_from_root(php)
         component = component_from_path(php)
+        st = php.stat()
+        entry = manifest.get(relfile)
+        if entry and entry.get("component") != component:
+            # Component naming changed (e.g. components.json appeared), which
+            # changes every row hash in the file.
+            entry = None
+        if entry and entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns:
+            slots.append(old_by_file[relfile])
+            new_manifest[relfile] = entry
+            continue
+        slots.append(None)
+        tasks.append((str(php), relfile, component))
+        new_manifest[relfile] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                                 "sha256": entry["sha256"] if entry else "",
+                                 "component": component}
 
-        # Capture single-quoted string definitions of the form $string['key'].
-        for m in RE_SQ.finditer(data):
-            key = m.group("k")
-            text = unescape_php(m.group("t"), "'")
-            rows.append([component, relfile, php.name, key, text, "", "pending",
-                         sha_row(component, relfile, key, text)])
-
-        # Capture double-quoted definitions ($string["key"]). Moodle does not
-        # mind either quoting style, so we support both to avoid missing strings.
-        for m in RE_DQ.finditer(data):
-            key = m.group("k")
-            text = unescape_php(m.group("t"), '"')
-            rows.append([component, relfile, php.name, key, text, "", "pending",
-                         sha_row(component, relfile, key, text)])
-
-    CSV_PATH.parent.mkdir(parents=True, exist_ok=True)
-    with CSV_PATH.open("w", newline="", encoding="utf-8") as f:
-        w = csv.writer(f)
-        w.writerow(["component","relpath","sourcefile","key","source_text","translated_text","status","hash"])
-        w.writerows(rows)
-
-    print(f"Extracted {len(rows)} strings into {CSV_PATH}")
+    metrics.add("extract", files_scanned=len(files), files_parsed=len(tasks),
+                bytes_read=sum(new_manifest[relfile]["size"] for _, relfile, _ in tasks))
+    results = scan_files(tasks)
+    rows = []
+    parsed = 0
+    for reused in slots:
+        if reused is not None:
+            rows += reused
+            continue
+        path, relfile, component = tasks[parsed]
+        parsed += 1
+        digest, found = next(results)
+        entry = new_manifest[relfile]
+        if entry["sha256"] == digest:
+            # Touched but not modified (e.g. a fresh git checkout).
+            rows += old_by_file[relfile]
+            continue
+        entry["sha256"] = digest
+        sourcefile = os.path.basename(path)
+        for key, text, h in found:
+            old = old_by_hash.get(h)
+            rows.append(old if old else new_row(component, relfile, sourcefile, key, text, h))
+
+    with metrics.timed("extract", "store_write_seconds"):
+        store.replace_all(rows)
+    metrics.add("extract", strings_extracted=len(rows))
+
+    print(f"Extracted {len(rows)} strings into {store.path} "
+          f"({parsed} of {len(files)} files parsed)")
+    if old_rows:
+        old_keys = {(r["relpath"], r["key"]): r["hash"] for r in old_rows}
+        new_keys = {(r["relpath"], r["key"]): r["hash"] for r in rows}
+        added = sum(1 for k in new_keys if k not in old_keys)
+        changed = sum(1 for k, h in new_keys.items() if k in old_keys and old_keys[k] != h)
+        removed = sum(1 for k in old_keys if k not in new_keys)
+        print(f"Incremental extract: {added} added, {changed} changed, {removed} removed")
+    return new_manifest
+
+
+def main():
+    ensure_dirs()
+    store = open_store()
+    manifest = extract(store)
+    store.close()
+    save_manifest(manifest)
 
 if __name__ == "__main__":
     main()
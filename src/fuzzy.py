@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Fuzzy matches from the translation memory.
+
+Moodle has thousands of strings that differ from one already translated by a
+word, some punctuation or a placeholder name ("Delete {$a}" and "Delete
+{$a->name}", "Enable X" in many plugins). The exact memory cannot reuse
+those; FuzzyIndex finds them.
+
+Similarity is the Jaccard overlap of the byte 3-grams of two sources after
+whitespace is collapsed and every placeholder and tag is replaced by one
+marker symbol, so it runs from 0 to 1 and is 1 for strings that differ only in
+placeholder names or spacing. Every source is reduced to a MinHash signature
+by one-permutation hashing: each 3-gram's CRC32 picks one of BINS bins and the
+smallest value per bin is kept, and empty bins borrow from their neighbour.
+The signature is cut into BANDS bands of ROWS values. Sources that share any
+band are candidates (locality-sensitive hashing), so a lookup touches a
+handful of buckets instead of every entry. The candidates are ranked by their
+exact similarity, skipping those whose 3-gram count alone rules out
+min_similarity (Jaccard is at most the smaller count over the larger). With 10
+bands of 3 a pair at 0.8 similarity is found with 99.9% probability, at 0.6
+with 91% and at 0.4 with 48%.
+
+Equal similarity does not mean equal text ("No no no" and "No no no no"
+have the same 3-grams), so the index also keeps each masked source for
+same(), which finds entries that differ only in placeholder names or
+spacing.
+
+translate_csv builds one index per variant from its translation memory and
+uses the best match of each pending string as a few-shot example in the
+request, or, with FUZZY_APPLY, a same() match in place of the request (see
+adapt()).
+"""
+
+import zlib
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from src.common import split_tokens, tokens_match
+
+BANDS = 10
+ROWS = 3
+BINS = BANDS * ROWS
+# Candidates ranked exactly per lookup, most shared bands first.
+MAX_CANDIDATES = 30
+
+_MARKER = "\x00"
+_EMPTY = -1
+
+
+class Match(NamedTuple):
+    similarity: float
+    source_text: str
+    translated_text: str
+
+
+def masked(text: str) -> str:
+    """text with collapsed whitespace and each placeholder or tag as one marker."""
+    pieces = split_tokens(text)
+    if len(pieces) > 1:
+        text = "".join(_MARKER if i % 2 else p for i, p in enumerate(pieces))
+    return " ".join(text.split())
+
+
+def shingles(text: str, is_masked: bool = False) -> frozenset:
+    """CRC32s of the byte 3-grams of masked(text) (the whole text if shorter)."""
+    data = (text if is_masked else masked(text)).encode("utf-8")
+    if len(data) < 3:
+        return frozenset((zlib.crc32(data),))
+    crc = zlib.crc32
+    return frozenset([crc(data[i:i + 3]) for i in range(len(data) - 2)])
+
+
+def jaccard(a: frozenset, b: frozenset) -> float:
+    if not a or not b:
+        return 0.0
+    inter = len(a & b)
+    return inter / (len(a) + len(b) - inter)
+
+
+def signature(grams: Iterable[int]) -> List[int]:
+    """One-permutation MinHash signature of BINS values."""
+    sig = [_EMPTY] * BINS
+    for h in grams:
+        b, v = h % BINS, h // BINS
+        if sig[b] == _EMPTY or v < sig[b]:
+            sig[b] = v
+    # Densify: an empty bin takes the value of the next filled one, offset
+    # by the distance so it does not collide with a real value.
+    if _EMPTY in sig:
+        for b in range(BINS):
+            if sig[b] == _EMPTY:
+                for d in range(1, BINS):
+                    v = sig[(b + d) % BINS]
+                    if v != _EMPTY and v < (1 << 32):
+                        sig[b] = v + (d << 32)
+                        break
+    return sig
+
+
+def band_keys(sig: List[int]) -> List[int]:
+    """One bucket key per band (hashes of int tuples are stable across runs)."""
+    return [hash((band, *sig[band * ROWS:(band + 1) * ROWS])) for band in range(BANDS)]
+
+
+class FuzzyIndex:
+    """In-memory LSH index of (source, translation) pairs."""
+
+    def __init__(self, pairs: Iterable[Tuple[str, str]] = ()):
+        self.sources: List[str] = []
+        self.translations: List[str] = []
+        # 3-gram count per entry, for the size bound in best()
+        self.sizes = array("H")
+        # masked source -> first entry with it, for same()
+        self.by_text: Dict[str, int] = {}
+        # band key -> entry id, or list of ids once a bucket is shared
+        self.buckets: Dict[int, object] = {}
+        for source, translated in pairs:
+            self.add(source, translated)
+
+    def __len__(self) -> int:
+        return len(self.sources)
+
+    def add(self, source: str, translated: str) -> None:
+        entry = len(self.sources)
+        self.sources.append(source)
+        self.translations.append(translated)
+        text = masked(source)
+        self.by_text.setdefault(text, entry)
+        grams = shingles(text, is_masked=True)
+        self.sizes.append(min(len(grams), 0xFFFF))
+        buckets = self.buckets
+        for key in band_keys(signature(grams)):
+            found = buckets.get(key)
+            if found is None:
+                buckets[key] = entry
+            elif type(found) is list:
+                found.append(entry)
+            else:
+                buckets[key] = [found, entry]
+
+    def candidates(self, grams: frozenset) -> List[int]:
+        """Entry ids sharing at least one band with grams, most shared first."""
+        hits = Counter()
+        for key in band_keys(signature(grams)):
+            found = self.buckets.get(key)
+            if found is None:
+                continue
+            if type(found) is list:
+                hits.update(found)
+            else:
+                hits[found] += 1
+        return [entry for entry, _ in hits.most_common(MAX_CANDIDATES)]
+
+    def best(self, source: str, min_similarity: float) -> Optional[Match]:
+        """The most similar entry at or above min_similarity, or None."""
+        grams = shingles(source)
+        n = len(grams)
+        best = None
+        for entry in self.candidates(grams):
+            size = self.sizes[entry]
+            if min(n, size) < min_similarity * max(n, size):
+                continue
+            sim = jaccard(grams, shingles(self.sources[entry]))
+            if sim >= min_similarity and (best is None or sim > best.similarity):
+                best = Match(sim, self.sources[entry], self.translations[entry])
+        return best
+
+    def same(self, source: str) -> Optional[Match]:
+        """An entry whose source equals source apart from placeholder names
+        and spacing, or None."""
+        entry = self.by_text.get(masked(source))
+        if entry is None:
+            return None
+        return Match(1.0, self.sources[entry], self.translations[entry])
+
+
+def adapt(match: Match, row: dict) -> Optional[str]:
+    """
+    match's translation for row: the placeholders and tags of the matched
+    source renamed, in order, to row's own. None when the two sources do not
+    carry the same number of them, a token would need two different
+    renamings, or the result fails the placeholder/tag check.
+    """
+    old = split_tokens(match.source_text)[1::2]
+    new = split_tokens(row["source_text"])[1::2]
+    if len(old) != len(new):
+        return None
+    renames = {}
+    for a, b in zip(old, new):
+        if renames.setdefault(a, b) != b:
+            return None
+    pieces = split_tokens(match.translated_text)
+    text = "".join(renames.get(p, p) if i % 2 else p for i, p in enumerate(pieces))
+    return text if tokens_match(row, text) else None
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Durable record of submitted batch jobs.
+
+Every batch is written to LEDGER_PATH as soon as it is created, with its
+input file id, shard label, state, the row hashes behind each custom_id
+and, for retried strings, the attempt each request is.
+If translate_csv is interrupted, the next run re-attaches to batches that
+are still in flight, applies any that finished in the meantime, and does not
+submit their rows again.
+
+custom_ids are derived from row hashes only (see translate_csv.custom_id_for),
+so they stay valid when strings.csv is re-extracted or reordered.
+apply_batch_output uses the ledger to map packed custom_ids back to rows.
+"""
+
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from config import LEDGER_PATH
+from src.common import atomic_write_text
+
+# States after which a batch needs no more attention. "applied" is ours: the
+# batch completed and its output has been merged into the store.
+DONE_STATES = {"applied", "failed", "cancelled", "expired"}
+
+
+class BatchLedger:
+
+    def __init__(self, path: Path = LEDGER_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self.batches: Dict[str, dict] = {}
+        if path.exists():
+            try:
+                self.batches = json.loads(path.read_text(encoding="utf-8"))["batches"]
+            except (json.JSONDecodeError, KeyError):
+                raise SystemExit(f"Batch ledger {path} is unreadable; fix or move it aside")
+
+    def _save(self) -> None:
+        atomic_write_text(self.path, json.dumps({"version": 1, "batches": self.batches}))
+
+    def record(self, batch_id: str, input_file_id: str, shard: str,
+               requests: Dict[str, List[str]], attempts: Optional[Dict[str, int]] = None) -> None:
+        """Remember a freshly created batch, the hashes behind each custom_id
+        and the attempt of every request that is not a first one."""
+        with self._lock:
+            self.batches[batch_id] = {
+                "shard": shard,
+                "input_file_id": input_file_id,
+                "state": "submitted",
+                "created": time.time(),
+                "updated": time.time(),
+                "output_file_id": None,
+                "error_file_id": None,
+                "requests": requests,
+                "attempts": attempts or {},
+            }
+            self._save()
+
+    def update(self, batch_id: str, **fields) -> None:
+        with self._lock:
+            entry = self.batches[batch_id]
+            if all(entry.get(k) == v for k, v in fields.items()):
+                return
+            entry.update(fields, updated=time.time())
+            self._save()
+
+    def open_batches(self) -> Dict[str, dict]:
+        """Batches that are still running or whose output is not applied yet."""
+        with self._lock:
+            return {bid: e for bid, e in self.batches.items() if e["state"] not in DONE_STATES}
+
+    def request_map(self) -> Dict[str, List[str]]:
+        """custom_id -> row hashes across every recorded batch (newest wins)."""
+        with self._lock:
+            merged = {}
+            for e in sorted(self.batches.values(), key=lambda e: e["created"]):
+                merged.update(e["requests"])
+            return merged
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Exact-match translation memory.
+
+Moodle repeats many source strings across components ("Settings", "Name",
+"Delete", "{$a} items"). The memory maps normalised source text, together
+with TARGET_STYLE and the model, to an accepted translation so that:
+
+ * strings translated in earlier runs are filled without any API call, and
+ * identical pending strings in one run are sent once and the result is
+   fanned out to every matching row when the batch comes back.
+
+Entries live in a small SQLite database (TM_PATH) so they survive
+re-extraction and are shared by translate_csv and apply_batch_output. Each
+variant (src/variants.py) has its own memory, keyed by its TARGET_STYLE.
+A read-only memory (a dry run's) never writes to the database and keeps what
+it is asked to record in memory instead.
+"""
+
+import hashlib
+import sqlite3
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from config import TARGET_STYLE, OPENAI_MODEL, TM_PATH
+from src.common import tokens_match
+from src.variants import VARIANTS, variant_of
+
+
+def normalise(text: str) -> str:
+    """Collapse runs of whitespace; case and punctuation stay significant."""
+    return " ".join(text.split())
+
+
+class TranslationMemory:
+
+    def __init__(self, path: Path = TM_PATH, style: str = TARGET_STYLE,
+                 model: str = OPENAI_MODEL, read_only: bool = False):
+        self.style = style
+        self.model = model
+        self.read_only = read_only
+        # key -> (source, translation) recorded by a read-only memory
+        self.unsaved: Dict[str, Tuple[str, str]] = {}
+        if read_only:
+            if path.exists():
+                # Without a WAL file there is nothing unmerged to read, and
+                # immutable keeps SQLite from creating its -wal/-shm files.
+                wal = path.with_name(path.name + "-wal").exists()
+                self.db = sqlite3.connect(
+                    f"{path.resolve().as_uri()}?mode=ro" + ("" if wal else "&immutable=1"),
+                    uri=True, check_same_thread=False)
+            else:
+                self.db = sqlite3.connect(":memory:", check_same_thread=False)
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self.db = sqlite3.connect(str(path), check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS memory (
+                key TEXT PRIMARY KEY,
+                source_text TEXT NOT NULL,
+                translated_text TEXT NOT NULL,
+                style TEXT NOT NULL,
+                model TEXT NOT NULL,
+                updated REAL NOT NULL
+            )
+            """
+        )
+
+    def key(self, source: str) -> str:
+        h = hashlib.sha256()
+        for v in (normalise(source), self.style, self.model):
+            h.update(b"|")
+            h.update(v.encode("utf-8"))
+        return h.hexdigest()
+
+    def lookup(self, sources: Iterable[str]) -> Dict[str, str]:
+        """Return {memory key: translation} for the sources that have one."""
+        keys = list({self.key(s) for s in sources})
+        found = {}
+        for i in range(0, len(keys), 500):
+            part = keys[i:i + 500]
+            marks = ",".join("?" * len(part))
+            found.update(self.db.execute(
+                f"SELECT key, translated_text FROM memory WHERE key IN ({marks})", part))
+        if self.unsaved:
+            found.update((k, self.unsaved[k][1]) for k in keys if k in self.unsaved)
+        return found
+
+    def entries(self) -> Iterator[Tuple[str, str]]:
+        """(source, translation) of every entry for this style and model."""
+        rows = self.db.execute(
+            "SELECT source_text, translated_text FROM memory WHERE style = ? AND model = ?",
+            (self.style, self.model))
+        if not self.unsaved:
+            return rows
+        return iter([*(e for e in rows if self.key(e[0]) not in self.unsaved),
+                     *self.unsaved.values()])
+
+    def record(self, rows: Iterable[dict]) -> int:
+        """Remember the translation of every row with status "ok"."""
+        now = time.time()
+        entries = [(self.key(r["source_text"]), r["source_text"], r["translated_text"],
+                    self.style, self.model, now)
+                   for r in rows if r.get("status") == "ok" and r.get("translated_text")]
+        if self.read_only:
+            self.unsaved.update((e[0], (e[1], e[2])) for e in entries)
+            return len(entries)
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO memory VALUES (?, ?, ?, ?, ?, ?)", entries)
+        return len(entries)
+
+    def fill(self, rows: Iterable[dict]) -> List[dict]:
+        """Translate pending rows from memory; return the rows that were filled.
+
+        A remembered translation is only used when its placeholders and tags
+        still match the row's own source text.
+        """
+        pending = [r for r in rows if r.get("status") == "pending"]
+        hits = self.lookup(r["source_text"] for r in pending)
+        filled = []
+        for r in pending:
+            tgt = hits.get(self.key(r["source_text"]))
+            if not tgt or tgt == r["source_text"]:
+                continue
+            if not tokens_match(r, tgt):
+                continue
+            r["translated_text"] = tgt
+            r["status"] = "ok"
+            filled.append(r)
+        return filled
+
+    def dedupe(self, rows: Iterable[dict]) -> List[dict]:
+        """Return one representative row per distinct normalised source."""
+        seen = set()
+        unique = []
+        for r in rows:
+            k = self.key(r["source_text"])
+            if k not in seen:
+                seen.add(k)
+                unique.append(r)
+        return unique
+
+    def close(self) -> None:
+        self.db.close()
+
+
+def open_memories() -> Dict[str, TranslationMemory]:
+    """One memory per configured variant, by variant code."""
+    return {v.code: TranslationMemory(style=v.style) for v in VARIANTS}
+
+
+def fan_out(memories: Dict[str, TranslationMemory], rows: Iterable[dict],
+            pending: Iterable[dict]) -> List[dict]:
+    """Record accepted rows in their variant's memory and fill that variant's
+    pending rows from it; return the rows filled."""
+    rows, pending = list(rows), list(pending)
+    filled = []
+    for code, memory in memories.items():
+        memory.record(r for r in rows if variant_of(r).code == code)
+        filled += memory.fill(r for r in pending if variant_of(r).code == code)
+    return filled
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""
+Per-stage metrics and opt-in profiling for pipeline runs.
+
+The stages report what they did through the module-level `metrics`
+collector:
+
+    metrics.add("extract", files_scanned=120, bytes_read=5_300_000)
+    with metrics.timed("translate", "upload_seconds"):
+        ...
+
+Counters are plain numbers keyed by stage; add() is thread-safe, so the
+shard workers of translate_csv can call it directly. run_all wraps each
+stage in metrics.stage(name), which records its wall-clock time, the CPU
+time of this process and of finished worker processes, and whether it
+raised. At the end of the run it calls write(), which saves
+
+  METRICS_PATH          {"run_id", "started", "finished", "wall_seconds",
+                         "stages": {name: {"status", "wall_seconds",
+                         "cpu_seconds", "child_cpu_seconds", "counters"}}}
+  PROMETHEUS_TEXTFILE   the same numbers in the Prometheus text format, for
+                        node_exporter's textfile collector (if configured).
+
+Stage scripts run on their own still count, but nothing is written.
+
+profiled() wraps a stage in cProfile or tracemalloc and dumps the result to
+LOG_DIR (see `py src\\run_all.py --help`).
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Optional
+
+from config import LOG_DIR, METRICS_PATH, PROMETHEUS_TEXTFILE
+from src.common import atomic_write_text
+
+PROM_PREFIX = "moodle_lang"
+
+# Help text of the counters the stages report; others get a generic one.
+COUNTER_HELP = {
+    "files_scanned": "Language files found by discovery.",
+    "files_parsed": "Language files read and parsed (the rest were unchanged).",
+    "bytes_read": "Bytes of language files read.",
+    "strings_extracted": "Strings in the store after extraction.",
+    "rows_rules": "Rows resolved by local rules.",
+    "rows_memory": "Rows filled from the translation memory.",
+    "rows_fuzzy": "Rows translated from a close translation-memory match.",
+    "rows_fuzzy_hinted": "Rows sent with a close translation-memory match as an example.",
+    "strings_submitted": "Distinct strings sent to the API.",
+    "requests_submitted": "API requests sent (batch lines or realtime calls).",
+    "batches_submitted": "Batch jobs created.",
+    "rows_applied": "Rows that received a translation from API results.",
+    "rows_fallback": "Rows whose translation failed the placeholder check and kept the source.",
+    "item_errors": "Result lines reporting an error.",
+    "rows_retried": "Strings sent again with the corrective prompt.",
+    "rows_given_up": "Strings given up on after MAX_ATTEMPTS attempts.",
+    "estimated_input_tokens": "Input tokens estimated locally before sending.",
+    "estimated_output_tokens": "Output tokens expected by the local estimate.",
+    "input_tokens": "Input tokens reported by the API.",
+    "output_tokens": "Output tokens reported by the API.",
+    "files_written": "Pack files written.",
+    "files_unchanged": "Pack files left untouched because their content did not change.",
+    "files_removed": "Stale pack files removed.",
+    "bytes_written": "Bytes of pack files written.",
+    "discover_seconds": "Seconds spent finding language files.",
+    "store_write_seconds": "Seconds spent writing the extracted rows to the store.",
+    "upload_seconds": "Seconds spent uploading batch input files, summed over shards.",
+    "batch_wait_seconds": "Seconds spent waiting for batches, summed over shards.",
+    "results_seconds": "Seconds spent downloading and applying results, summed over shards.",
+    "realtime_seconds": "Seconds spent on realtime requests.",
+    "fuzzy_seconds": "Seconds spent building fuzzy-match indexes and looking up pending strings.",
+}
+
+_NAME_RE = re.compile(r"[^a-zA-Z0-9_]")
+
+
+def _cpu_times():
+    """(CPU seconds of this process, of its reaped child processes)."""
+    t = os.times()
+    return t.user + t.system, t.children_user + t.children_system
+
+
+class Metrics:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.run_id = time.strftime("%Y%m%d-%H%M%S")
+        self.stages: Dict[str, Dict] = {}
+
+    def _stage(self, name: str) -> Dict:
+        return self.stages.setdefault(name, {"status": "ok", "counters": {}})
+
+    def add(self, stage: str, **counters) -> None:
+        """Add to the named counters of a stage."""
+        with self._lock:
+            totals = self._stage(stage)["counters"]
+            for name, n in counters.items():
+                totals[name] = totals.get(name, 0) + n
+
+    @contextmanager
+    def timed(self, stage: str, counter: str):
+        """Add the wall-clock time of the block to a stage counter. Blocks
+        in parallel threads add up, so this can exceed the stage time."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, **{counter: round(time.perf_counter() - t0, 4)})
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time a pipeline stage and record whether it succeeded."""
+        cpu0, child0 = _cpu_times()
+        t0 = time.perf_counter()
+        status = "failed"
+        try:
+            yield
+            status = "ok"
+        finally:
+            cpu1, child1 = _cpu_times()
+            with self._lock:
+                entry = self._stage(name)
+                entry.update(status=status,
+                             wall_seconds=round(time.perf_counter() - t0, 4),
+                             cpu_seconds=round(cpu1 - cpu0, 4),
+                             child_cpu_seconds=round(child1 - child0, 4))
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "run_id": self.run_id,
+                "started": self.started,
+                "finished": time.time(),
+                "wall_seconds": round(time.time() - self.started, 4),
+                "stages": json.loads(json.dumps(self.stages)),
+            }
+
+    def prometheus(self, snap: Optional[Dict] = None) -> str:
+        """The snapshot in the Prometheus text exposition format."""
+        snap = snap or self.snapshot()
+        series: Dict[str, list] = {}
+        for stage, entry in snap["stages"].items():
+            label = '{stage="%s"}' % stage
+            for key in ("wall_seconds", "cpu_seconds", "child_cpu_seconds"):
+                if key in entry:
+                    series.setdefault(f"stage_{key}", []).append((label, entry[key]))
+            series.setdefault("stage_success", []).append((label, int(entry["status"] == "ok")))
+            for name, value in entry["counters"].items():
+                series.setdefault(_NAME_RE.sub("_", name), []).append((label, value))
+
+        help_text = {
+            "stage_wall_seconds": "Wall-clock seconds spent in the stage.",
+            "stage_cpu_seconds": "CPU seconds of the main process during the stage.",
+            "stage_child_cpu_seconds": "CPU seconds of worker processes during the stage.",
+            "stage_success": "1 if the stage finished without an error.",
+        }
+        lines = []
+        for name, samples in series.items():
+            full = f"{PROM_PREFIX}_{name}"
+            lines.append(f"# HELP {full} "
+                         + help_text.get(name, COUNTER_HELP.get(name, f"Pipeline counter {name}.")))
+            lines.append(f"# TYPE {full} gauge")
+            lines += [f"{full}{label} {value}" for label, value in samples]
+        lines.append(f"# HELP {PROM_PREFIX}_last_run_timestamp_seconds End of the last pipeline run.")
+        lines.append(f"# TYPE {PROM_PREFIX}_last_run_timestamp_seconds gauge")
+        lines.append(f"{PROM_PREFIX}_last_run_timestamp_seconds {snap['finished']:.0f}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: Path = METRICS_PATH,
+              textfile: Optional[Path] = PROMETHEUS_TEXTFILE) -> Dict:
+        snap = self.snapshot()
+        atomic_write_text(path, json.dumps(snap, indent=1))
+        if textfile:
+            # The textfile collector may read at any moment; write atomically.
+            atomic_write_text(Path(textfile), self.prometheus(snap))
+        return snap
+
+
+metrics = Metrics()
+
+
+@contextmanager
+def profiled(kind: Optional[str], name: str, log_dir: Path = LOG_DIR):
+    """
+    Run the block under a profiler and dump what it saw to log_dir:
+
+      cprofile      profile_<name>_<run>.prof (open with pstats or snakeviz)
+                    and a .txt with the top functions by cumulative time
+      tracemalloc   tracemalloc_<name>_<run>.txt with peak memory and the
+                    top allocation sites, plus the raw .snapshot
+
+    kind None runs the block unprofiled.
+    """
+    if kind is None:
+        yield
+        return
+    log_dir.mkdir(parents=True, exist_ok=True)
+    stem = f"{name}_{metrics.run_id}"
+
+    if kind == "cprofile":
+        import cProfile
+        import io
+        import pstats
+        prof = cProfile.Profile()
+        prof.enable()
+        try:
+            yield
+        finally:
+            prof.disable()
+            prof.dump_stats(str(log_dir / f"profile_{stem}.prof"))
+            out = io.StringIO()
+            pstats.Stats(prof, stream=out).sort_stats("cumulative").print_stats(40)
+            (log_dir / f"profile_{stem}.txt").write_text(out.getvalue(), encoding="utf-8")
+            print(f"cProfile output written to {log_dir / f'profile_{stem}.prof'}")
+        return
+
+    if kind == "tracemalloc":
+        import tracemalloc
+        tracemalloc.start(25)
+        try:
+            yield
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            snapshot.dump(str(log_dir / f"tracemalloc_{stem}.snapshot"))
+            snapshot = snapshot.filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+            ])
+            lines = [f"Peak traced memory: {peak / 2**20:.1f} MB",
+                     f"Still allocated at the end: {current / 2**20:.1f} MB", "",
+                     "Top allocation sites (still allocated at the end):"]
+            lines += [str(s) for s in snapshot.statistics("lineno")[:30]]
+            (log_dir / f"tracemalloc_{stem}.txt").write_text("\n".join(lines) + "\n",
+                                                             encoding="utf-8")
+            print(f"tracemalloc output written to {log_dir / f'tracemalloc_{stem}.txt'}")
+        return
+
+    raise SystemExit(f"Unknown profiler {kind!r}")
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Progress, ETA and adaptive poll intervals for running batch jobs.
+
+translate_csv keeps one BatchTracker per batch. Each status check feeds
+batch.request_counts into the tracker, which works out the recent completion
+rate, an ETA and how long to wait before the next check:
+
+ * no ETA yet and no progress since the last check: back off (double the
+   wait, up to BATCH_POLL_SECONDS);
+ * an ETA is known: check again after about a third of it, so a batch that
+   is nearly done is picked up soon after it finishes;
+ * "finalizing": the output file is being written, check at the minimum;
+ * the check itself failed (stalled()): back off as for no progress.
+
+The latest numbers of every batch are also written to PROGRESS_PATH as JSON
+so a scheduler can tell when the run will finish:
+
+  {"updated": ..., "overall": {"completed", "failed", "total",
+   "items_per_minute", "eta_seconds", "eta_at"},
+   "batches": {batch_id: {"label", "status", "completed", ...}}}
+"""
+
+import json
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Dict, Optional
+
+from config import BATCH_POLL_SECONDS, BATCH_POLL_MIN_SECONDS, PROGRESS_PATH
+from src.common import atomic_write_text
+
+# How many recent status checks the completion rate is averaged over.
+RATE_WINDOW = 5
+
+
+def format_duration(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "unknown"
+    seconds = int(round(seconds))
+    h, rest = divmod(seconds, 3600)
+    m, s = divmod(rest, 60)
+    if h:
+        return f"{h}h {m:02d}m"
+    if m:
+        return f"{m}m {s:02d}s"
+    return f"{s}s"
+
+
+class BatchTracker:
+
+    def __init__(self, min_delay: float = BATCH_POLL_MIN_SECONDS,
+                 max_delay: float = BATCH_POLL_SECONDS):
+        self.max_delay = max_delay
+        self.min_delay = min(min_delay, max_delay)
+        self.delay = self.min_delay
+        self.samples = deque(maxlen=RATE_WINDOW)
+
+    def _clamp(self, seconds: float) -> float:
+        return min(max(seconds, self.min_delay), self.max_delay)
+
+    def stalled(self) -> None:
+        """A status check that failed: back off as for no progress."""
+        self.delay = self._clamp(self.delay * 2)
+
+    def observe(self, batch, now: Optional[float] = None) -> Dict:
+        """Record one status check; returns a progress snapshot."""
+        now = time.time() if now is None else now
+        counts = getattr(batch, "request_counts", None)
+        completed = getattr(counts, "completed", 0) or 0
+        failed = getattr(counts, "failed", 0) or 0
+        total = getattr(counts, "total", 0) or 0
+        done = completed + failed
+
+        progressed = not self.samples or done > self.samples[-1][1]
+        self.samples.append((now, done))
+
+        rate = None
+        first_t, first_done = self.samples[0]
+        if now > first_t and done > first_done:
+            rate = (done - first_done) / (now - first_t)
+
+        eta = None
+        if total and done >= total:
+            eta = 0.0
+        elif rate and total:
+            eta = (total - done) / rate
+
+        if batch.status == "finalizing" or eta == 0.0:
+            self.delay = self.min_delay
+        elif eta is not None:
+            self.delay = self._clamp(eta / 3)
+        elif not progressed:
+            self.delay = self._clamp(self.delay * 2)
+
+        return {
+            "status": batch.status,
+            "completed": completed,
+            "failed": failed,
+            "total": total,
+            "items_per_minute": round(rate * 60, 1) if rate else None,
+            "eta_seconds": round(eta) if eta is not None else None,
+            "eta_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(now + eta))
+            if eta is not None else None,
+            "next_check_seconds": round(self.delay),
+        }
+
+
+def describe(snap: Dict) -> str:
+    """One-line human summary of a snapshot."""
+    text = f"{snap['status']}"
+    if snap["total"]:
+        pct = 100 * (snap["completed"] + snap["failed"]) / snap["total"]
+        text += (f": {snap['completed']}/{snap['total']} done, {snap['failed']} failed"
+                 f" ({pct:.0f}%)")
+    if snap["items_per_minute"] is not None:
+        text += f", {snap['items_per_minute']:.0f} items/min"
+    if snap["eta_seconds"] is not None:
+        text += f", ETA {format_duration(snap['eta_seconds'])}"
+    return text
+
+
+class ProgressFile:
+    """Thread-safe writer of the machine-readable progress file."""
+
+    def __init__(self, path: Path = PROGRESS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self.batches: Dict[str, Dict] = {}
+
+    def update(self, batch_id: str, label: str, snap: Dict) -> None:
+        with self._lock:
+            self.batches[batch_id] = dict(snap, label=label.strip(" []"),
+                                          updated=time.time())
+            self._save()
+
+    def _save(self) -> None:
+        entries = list(self.batches.values())
+        # Batches run side by side, so the run ends with the slowest one.
+        running = [e for e in entries if e["status"] not in ("completed", "failed",
+                                                              "cancelled", "expired")]
+        rates = [e["items_per_minute"] for e in running if e["items_per_minute"]]
+        eta = None
+        if entries and all(e["eta_seconds"] is not None for e in running):
+            eta = max((e["eta_seconds"] for e in running), default=0)
+        now = time.time()
+        overall = {
+            "batches": len(entries),
+            "running": len(running),
+            "completed": sum(e["completed"] for e in entries),
+            "failed": sum(e["failed"] for e in entries),
+            "total": sum(e["total"] for e in entries),
+            "items_per_minute": round(sum(rates), 1) if rates else None,
+            "eta_seconds": eta,
+            "eta_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(now + eta))
+            if eta is not None else None,
+        }
+        atomic_write_text(self.path, json.dumps(
+            {"updated": now, "overall": overall, "batches": self.batches}, indent=2))
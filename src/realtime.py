@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Realtime translation for small deltas.
+
+The Batch API is cheap but may take hours; for a handful of new strings
+translate_csv sends the same /v1/responses requests directly instead
+(see TRANSLATE_MODE). Requests go through AsyncOpenAI with:
+
+ * at most REALTIME_CONCURRENCY requests in flight,
+ * a token bucket allowing REALTIME_REQUESTS_PER_MINUTE (bursts up to
+   REALTIME_CONCURRENCY),
+ * up to REALTIME_MAX_RETRIES retries on 408/409/429, 5xx and connection
+   errors, with exponential backoff and full jitter (or the server's
+   Retry-After, when it sends one).
+
+Results come back as dicts in the Batch API output format, so they are
+applied by the same ResultApplier as batch output. The client honours
+OPENAI_BASE_URL, which is how the mock server in benchmarks/ is used.
+"""
+
+import asyncio
+import random
+import time
+from typing import Dict, List, Optional, Tuple
+
+from config import (REALTIME_CONCURRENCY, REALTIME_REQUESTS_PER_MINUTE,
+                    REALTIME_MAX_RETRIES)
+
+# Backoff before retry n (0-based) is uniform in [0, min(CAP, BASE * 2**n)].
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_CAP_SECONDS = 60.0
+
+
+class TokenBucket:
+    """Allow rate_per_second acquisitions on average, bursting to capacity."""
+
+    def __init__(self, rate_per_second: float, capacity: float):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def is_retryable(status: Optional[int]) -> bool:
+    """None stands for a connection error or timeout."""
+    return status is None or status in (408, 409, 429) or status >= 500
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    if retry_after is not None:
+        return retry_after + random.uniform(0, BACKOFF_BASE_SECONDS)
+    return random.uniform(0, min(BACKOFF_CAP_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+
+def _retry_after(exc: Exception) -> Optional[float]:
+    response = getattr(exc, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+async def send_one(client, bucket: TokenBucket, limit: asyncio.Semaphore,
+                   custom_id: str, body: dict, stats: Dict[str, int]) -> dict:
+    """Send one request, retrying transient failures; returns a result line."""
+    from openai import APIConnectionError, APIStatusError
+    for attempt in range(REALTIME_MAX_RETRIES + 1):
+        await bucket.acquire()
+        async with limit:
+            try:
+                response = await client.responses.create(**body)
+                return {"custom_id": custom_id, "error": None,
+                        "response": {"status_code": 200, "body": response.model_dump()}}
+            except APIStatusError as exc:
+                status, error = exc.status_code, exc
+            except APIConnectionError as exc:
+                status, error = None, exc
+
+        if not is_retryable(status) or attempt == REALTIME_MAX_RETRIES:
+            stats["failed"] += 1
+            return {"custom_id": custom_id,
+                    "error": {"code": status, "message": str(error)},
+                    "response": {"status_code": status or 0, "body": {}}}
+        stats["retries"] += 1
+        await asyncio.sleep(backoff_delay(attempt, _retry_after(error)))
+
+
+async def _translate_all(requests: List[Tuple[str, dict]], client) -> List[dict]:
+    if client is None:
+        from openai import AsyncOpenAI
+        # Retries are ours, so the client's own are switched off.
+        async with AsyncOpenAI(max_retries=0) as client:
+            return await _translate_all(requests, client)
+    bucket = TokenBucket(REALTIME_REQUESTS_PER_MINUTE / 60, max(1, REALTIME_CONCURRENCY))
+    limit = asyncio.Semaphore(max(1, REALTIME_CONCURRENCY))
+    stats = {"retries": 0, "failed": 0}
+
+    t0 = time.perf_counter()
+    results = await asyncio.gather(*(send_one(client, bucket, limit, cid, body, stats)
+                                     for cid, body in requests))
+    elapsed = time.perf_counter() - t0
+    print(f"[realtime] {len(requests)} requests in {elapsed:.1f}s "
+          f"({stats['retries']} retries, {stats['failed']} failed)")
+    return results
+
+
+def translate_all(requests: List[Tuple[str, dict]], client=None) -> List[dict]:
+    """Send (custom_id, body) requests concurrently; returns result lines in order."""
+    return asyncio.run(_translate_all(requests, client))
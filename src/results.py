@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming application of Batch API output and error files.
+
+Both translate_csv (straight from the download stream) and
+apply_batch_output (from files on disk) feed JSONL lines into a
+ResultApplier. Lines are decoded one at a time and handled in chunks of
+CHUNK_LINES, so memory use depends on the chunk size rather than on the size
+of the output. Several files can be fed into one applier in turn; for a row
+that appears more than once, the last result wins.
+
+Each line has the Batch API format:
+  {"id": "...", "custom_id": "...",
+   "response": {"status_code": 200, "body": {...}},
+   "error": ...}
+"""
+
+import json
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from src.common import parse_translation, parse_packed_translations, accept_translation
+
+CHUNK_LINES = 1000
+
+# Item errors printed one by one; the rest are only counted.
+ERRORS_SHOWN = 20
+
+
+def extract_output_text(body: dict) -> str:
+    """
+    Given a /v1/responses response body, pull out the assistant text.
+
+    We try:
+      - body["output_text"] if present
+      - else any output_text in body["output"] entries.
+    """
+    if isinstance(body.get("output_text"), str):
+        return body["output_text"]
+
+    for item in body.get("output", []):
+        if item.get("type") == "message":
+            for c in item.get("content", []):
+                if c.get("type") == "output_text":
+                    return c.get("text", "")
+    return ""
+
+
+def iter_file_lines(path: Path) -> Iterator[str]:
+    """Yield the lines of a JSONL file without reading it all at once."""
+    with path.open(encoding="utf-8") as fh:
+        yield from fh
+
+
+def iter_jsonl(lines: Iterable) -> Iterator[dict]:
+    """Decode JSONL lines (str or bytes), skipping blanks and bad lines.
+    Already decoded dicts (realtime results) are passed through."""
+    for line in lines:
+        if isinstance(line, dict):
+            yield line
+            continue
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            obj = json.loads(line)
+        except json.JSONDecodeError:
+            print("Skipping invalid JSON line in batch output")
+            continue
+        if isinstance(obj, dict):
+            yield obj
+
+
+def new_usage() -> Dict[str, int]:
+    return {"requests": 0, "input_tokens": 0, "output_tokens": 0}
+
+
+class ResultApplier:
+    """
+    Apply batch result lines to rows.
+
+    resolve(custom_ids) returns {custom_id: [rows]} for the ids it knows;
+    a packed request ("pack__" prefix) maps to all of its rows. After each
+    chunk, on_chunk(touched_rows) is called if given (e.g. to save them);
+    otherwise touched rows are collected in self.touched.
+
+    Rows that got no usable translation (item errors, empty replies,
+    strings a packed reply left out) are collected in self.missing, rows
+    whose reply failed the placeholder/tag check in self.rejected together
+    with that reply, so the caller can retry them.
+    """
+
+    def __init__(self, resolve: Callable[[List[str]], Dict[str, List[dict]]],
+                 usage: Optional[Dict[str, Dict[str, int]]] = None,
+                 on_chunk: Optional[Callable[[List[dict]], None]] = None):
+        self.resolve = resolve
+        self.usage = usage
+        self.on_chunk = on_chunk
+        self.items = 0
+        self.matched = 0
+        self.changed = 0
+        self.fallback = 0
+        self.errors = 0
+        self.seen = set()
+        self.touched: List[dict] = []
+        self.missing: List[dict] = []
+        self.rejected: List[Tuple[dict, str]] = []
+
+    def feed(self, lines: Iterable) -> None:
+        chunk = []
+        for obj in iter_jsonl(lines):
+            chunk.append(obj)
+            if len(chunk) >= CHUNK_LINES:
+                self._apply_chunk(chunk)
+                chunk = []
+        if chunk:
+            self._apply_chunk(chunk)
+
+    def feed_file(self, path: Path) -> None:
+        self.feed(iter_file_lines(path))
+
+    def _apply_chunk(self, objs: List[dict]) -> None:
+        units = self.resolve([o.get("custom_id") or "" for o in objs])
+        touched = []
+        for obj in objs:
+            self.items += 1
+            cid = obj.get("custom_id") or ""
+            unit = units.get(cid)
+            if not unit:
+                # custom_id that does not exist in this store: maybe Moodle changed
+                continue
+            self.seen.add(cid)
+            touched += self._apply_one(cid, unit, obj)
+        if self.on_chunk is not None:
+            if touched:
+                self.on_chunk(touched)
+        else:
+            self.touched += touched
+
+    def _apply_one(self, cid: str, unit: List[dict], obj: dict) -> List[dict]:
+        packed = cid.startswith("pack__")
+        response = obj.get("response") or {}
+        if obj.get("error") or response.get("status_code", 200) >= 400:
+            self.errors += 1
+            if self.errors <= ERRORS_SHOWN:
+                err = obj.get("error") or (response.get("body") or {}).get("error")
+                print(f"Batch item error for {cid}: {err}")
+            self.missing += unit
+            return []
+
+        body = response.get("body") or {}
+        if self.usage is not None:
+            mode = self.usage["packed" if packed else "single"]
+            usage = body.get("usage") or {}
+            mode["input_tokens"] += usage.get("input_tokens", 0)
+            mode["output_tokens"] += usage.get("output_tokens", 0)
+
+        raw_text = extract_output_text(body).strip()
+        if packed:
+            items = parse_packed_translations(raw_text) if raw_text else {}
+            pairs = [(row, items.get(row["key"], "")) for row in unit]
+        else:
+            pairs = [(unit[0], parse_translation(raw_text) if raw_text else "")]
+
+        touched = []
+        for row, tgt in pairs:
+            if not tgt:
+                self.missing.append(row)
+                continue
+            self.matched += 1
+            # Placeholder and tag safety
+            self.changed += accept_translation(row, tgt)
+            if row["status"] == "fallback":
+                self.fallback += 1
+                if tgt != row["source_text"]:
+                    self.rejected.append((row, tgt))
+            touched.append(row)
+        return touched
+
+    def report(self, label: str = "") -> None:
+        print(f"{label}Processed {self.items} batch items ({self.errors} errors"
+              + (f", {self.errors - ERRORS_SHOWN} not shown)." if self.errors > ERRORS_SHOWN
+                 else ")."))
+        print(f"{label}Matched {self.matched} rows, changed {self.changed} rows"
+              + (f", {self.fallback} kept the source text." if self.fallback else "."))
+        if self.missing:
+            print(f"{label}{len(self.missing)} strings got no usable reply.")
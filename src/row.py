@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Compact in-memory rows of the string table.
+
+Held as csv.DictReader dicts, every row costs a dict of nine or more keys
+plus its own copy of component, relpath, sourcefile and status, although a
+language file's rows all share the first three and there are only a handful
+of statuses. Row keeps the columns in __slots__ and interns the repeating
+ones, so the rows of one file point at a single string object for each.
+
+Row is a mutable mapping: the stages keep using row["key"], row.get(...),
+row.items() and row.update(...) as with dicts. _row_index and _variant
+(in-memory helpers, never persisted) are slots too and only count as keys
+once set. Any other column (hand-added columns, the variant columns of
+EXTRA_VARIANTS) goes into a small dict created only for rows that have one.
+"""
+
+import sys
+from collections.abc import MutableMapping
+from operator import attrgetter
+
+# Column order of strings.csv. Extra columns added by hand are kept after these.
+FIELDS = ("component", "relpath", "sourcefile", "key", "source_text",
+          "translated_text", "status", "hash")
+
+# Columns whose values repeat across many rows.
+_INTERNED = frozenset(("component", "relpath", "sourcefile", "status"))
+_SLOTS = FIELDS + ("_row_index", "_variant")
+_SLOT_SET = frozenset(_SLOTS)
+
+_intern = sys.intern
+_slot_values = attrgetter(*_SLOTS)
+
+
+class Row(MutableMapping):
+    __slots__ = _SLOTS + ("_extra",)
+
+    def __init__(self, component, relpath, sourcefile, key, source_text,
+                 translated_text, status, hash, _row_index=None, _variant=None, extra=None):
+        self.component = _intern(component)
+        self.relpath = _intern(relpath)
+        self.sourcefile = _intern(sourcefile)
+        self.key = key
+        self.source_text = source_text
+        self.translated_text = translated_text
+        self.status = _intern(status)
+        self.hash = hash
+        self._row_index = _row_index
+        self._variant = _variant
+        # Columns beyond FIELDS, or None while there are none.
+        self._extra = extra or None
+
+    def __getitem__(self, name):
+        if name in _SLOT_SET:
+            value = getattr(self, name)
+            if value is None:
+                raise KeyError(name)
+            return value
+        if self._extra is not None:
+            return self._extra[name]
+        raise KeyError(name)
+
+    def get(self, name, default=None):
+        if name in _SLOT_SET:
+            value = getattr(self, name)
+            return default if value is None else value
+        if self._extra is not None:
+            return self._extra.get(name, default)
+        return default
+
+    def __setitem__(self, name, value):
+        if name in _SLOT_SET:
+            if name in _INTERNED and type(value) is str:
+                value = _intern(value)
+            setattr(self, name, value)
+        elif self._extra is None:
+            self._extra = {name: value}
+        else:
+            self._extra[name] = value
+
+    def __delitem__(self, name):
+        if name in _SLOT_SET:
+            if getattr(self, name) is None:
+                raise KeyError(name)
+            setattr(self, name, None)
+        elif self._extra is not None:
+            del self._extra[name]
+        else:
+            raise KeyError(name)
+
+    def __contains__(self, name):
+        if name in _SLOT_SET:
+            return getattr(self, name) is not None
+        return self._extra is not None and name in self._extra
+
+    def __iter__(self):
+        return iter([name for name, _ in self.items()])
+
+    def __len__(self):
+        return len(self.items())
+
+    def items(self):
+        pairs = [(name, value) for name, value in zip(_SLOTS, _slot_values(self))
+                 if value is not None]
+        if self._extra is not None:
+            pairs += self._extra.items()
+        return pairs
+
+    def __repr__(self):
+        return f"Row({dict(self.items())!r})"
+
+    def extra_columns(self):
+        """Names of the columns beyond FIELDS this row carries."""
+        return self._extra.keys() if self._extra is not None else ()
+
+    def csv_values(self, extras=()):
+        """The row as a strings.csv record: FIELDS, then the extras columns."""
+        values = [self.component, self.relpath, self.sourcefile, self.key, self.source_text,
+                  self.translated_text, self.status, self.hash]
+        if extras:
+            extra = self._extra or {}
+            values += [extra.get(name, "") for name in extras]
+        return values
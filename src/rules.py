@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+Local, deterministic translation rules applied before any API call.
+
+Many target styles are partly mechanical. translate_csv runs pending rows
+through a RuleEngine first (see RULES_MODE in config.py):
+
+ * FIXED_PHRASES: whole source strings (whitespace-normalised) with a fixed
+   translation;
+ * GLOSSARY: word and phrase swaps, indexed by their words so each string
+   is scanned once, word by word, in time that does not grow with the size
+   of the glossary (a regex alternation of thousands of terms does); the
+   longest phrase wins, matches are whole words, case-insensitive, and take
+   on the capitalisation of the matched text (course/Course/COURSE);
+ * REGEX_RULES: (pattern, replacement) pairs applied in order afterwards.
+
+Placeholders and HTML tags are split off first and never rewritten. In the
+default "covered" mode a row is resolved by a fixed phrase, or when the
+glossary and regex rules fully cover it: some rule fired and every word of
+the result was written or matched by one (a glossary entry that maps a term
+to itself protects it). Everything else goes to the model, with the glossary
+entries its text contains (terms()) so the model makes the same swaps. Only
+"full" mode, for purely mechanical variants, takes the rewritten text of
+every row as final. A resolved row still has to pass the placeholder/tag
+check before it is marked "ok"; rows that fail stay pending and go to the
+model.
+"""
+
+import re
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from config import RULES_MODE, FIXED_PHRASES, GLOSSARY, REGEX_RULES
+from src.common import split_tokens, tokens_match
+from src.memory import normalise
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def match_case(matched: str, replacement: str) -> str:
+    """Give replacement the capitalisation pattern of matched."""
+    if len(matched) > 1 and matched.isupper():
+        return replacement.upper()
+    if matched[:1].isupper():
+        return replacement[:1].upper() + replacement[1:]
+    return replacement
+
+
+def _replace(text: str, covered: List[bool], spans) -> Tuple[str, List[bool]]:
+    """text with (start, end, replacement) spans replaced, and its per-character
+    coverage, in which the replacements count as covered."""
+    out, cov, pos = [], [], 0
+    for start, end, new in spans:
+        out += [text[pos:start], new]
+        cov += covered[pos:start]
+        cov += [True] * len(new)
+        pos = end
+    out.append(text[pos:])
+    cov += covered[pos:]
+    return "".join(out), cov
+
+
+class RuleEngine:
+
+    def __init__(self, glossary: Dict[str, str] = GLOSSARY,
+                 regex_rules: Sequence[Tuple[str, str]] = REGEX_RULES,
+                 fixed_phrases: Dict[str, str] = FIXED_PHRASES,
+                 mode: str = RULES_MODE):
+        if mode not in ("off", "covered", "full"):
+            raise SystemExit(f"Unknown RULES_MODE {mode!r}")
+        self.mode = mode
+        self.fixed = {normalise(k): v for k, v in fixed_phrases.items()}
+        # (word, word, ...) -> (normalised lower-case term, replacement, term)
+        self.phrases: Dict[Tuple[str, ...], Tuple[str, str, str]] = {}
+        for term, replacement in glossary.items():
+            words = tuple(w.lower() for w in _WORD_RE.findall(term))
+            if words:
+                self.phrases[words] = (normalise(term).lower(), replacement, term)
+        self.first_words = {words[0] for words in self.phrases}
+        self.max_words = max((len(words) for words in self.phrases), default=0)
+        self.regex_rules = [(re.compile(p), r) for p, r in regex_rules]
+
+    def _glossary_hits(self, text: str):
+        """(start, end, entry) of each glossary match in text, left to right."""
+        words = list(_WORD_RE.finditer(text))
+        lower = [m.group(0).lower() for m in words]
+        i, n = 0, len(words)
+        while i < n:
+            if lower[i] in self.first_words:
+                for k in range(min(self.max_words, n - i), 0, -1):
+                    hit = self.phrases.get(tuple(lower[i:i + k]))
+                    if hit is None:
+                        continue
+                    start, end = words[i].start(), words[i + k - 1].end()
+                    # The words match; so must what lies between them.
+                    if normalise(text[start:end]).lower() != hit[0]:
+                        continue
+                    yield start, end, hit
+                    i += k
+                    break
+                else:
+                    i += 1
+            else:
+                i += 1
+
+    def _rewrite(self, text: str) -> Tuple[str, bool, bool]:
+        """(text under the glossary and regex rules, whether any rule fired,
+        whether every word of the result was written or matched by one)."""
+        covered = [False] * len(text)
+        fired = False
+        if self.phrases:
+            spans = [(start, end, match_case(text[start:end], hit[1]))
+                     for start, end, hit in self._glossary_hits(text)]
+            fired = bool(spans)
+            text, covered = _replace(text, covered, spans)
+        for pattern, replacement in self.regex_rules:
+            spans = [(m.start(), m.end(), m.expand(replacement))
+                     for m in pattern.finditer(text)]
+            fired = fired or bool(spans)
+            text, covered = _replace(text, covered, spans)
+        return text, fired, all(all(covered[m.start():m.end()])
+                                for m in _WORD_RE.finditer(text))
+
+    def apply(self, source: str) -> Optional[str]:
+        """Translation of source under the rules, or None if they do not
+        cover it (see the module docstring; in "full" mode they cover
+        everything)."""
+        if self.mode == "off":
+            return None
+        fixed = self.fixed.get(normalise(source))
+        if fixed is not None:
+            return fixed
+        if not self.phrases and not self.regex_rules:
+            return None
+        parts = split_tokens(source)
+        fired, covered = False, True
+        # Even indexes are text between placeholders and tags.
+        for i in range(0, len(parts), 2):
+            if parts[i]:
+                parts[i], f, c = self._rewrite(parts[i])
+                fired, covered = fired or f, covered and c
+        if self.mode == "full" or (fired and covered):
+            return "".join(parts)
+        return None
+
+    def terms(self, sources: Iterable[str]) -> Dict[str, str]:
+        """The glossary entries (term -> replacement) found in sources, outside
+        placeholders and tags; empty when the rules are off."""
+        found = {}
+        if self.mode == "off" or not self.phrases:
+            return found
+        for source in sources:
+            for part in split_tokens(source)[::2]:
+                for _, _, hit in self._glossary_hits(part):
+                    found[hit[2]] = hit[1]
+        return found
+
+    def resolve(self, rows: List[dict]) -> List[dict]:
+        """Translate the pending rows the rules cover; return the rows changed."""
+        resolved = []
+        for r in rows:
+            if r.get("status") != "pending":
+                continue
+            tgt = self.apply(r["source_text"])
+            if tgt is None or not tokens_match(r, tgt):
+                continue
+            r["translated_text"] = tgt
+            r["status"] = "ok"
+            resolved.append(r)
+        return resolved
@@ -4,9 +4,28 @@ Run the full pipeline in process:
  1) extract_to_csv
  2) translate_csv
  3) build_pack
+
+The string table is loaded once into a MemoryStore and the stages pass the
+same rows to each other instead of each re-reading strings.csv. It is
+written back after API results are applied and once more after translation,
+before the packs are built (see src/store.py).
+
+Each stage's wall/CPU time and counters (files scanned, bytes read, strings
+extracted, requests submitted, rows applied/fallback, files written) are
+written to METRICS_PATH, and to PROMETHEUS_TEXTFILE if set (see
+src/metrics.py). The metrics are written even when a stage fails.
+
+    py src\\run_all.py
+    py src\\run_all.py --profile extract,build
+    py src\\run_all.py --profile all --profiler tracemalloc
+
+--profile runs the named stages under cProfile (default) or tracemalloc and
+dumps the result next to the logs in LOG_DIR.
 """
 
+import argparse
 import sys
+from contextlib import contextmanager
 from pathlib import Path
 
 # Ensure project root (the folder that contains config.py and src/) is on sys.path
@@ -15,22 +34,64 @@ if str(ROOT) not in sys.path:
     sys.path.insert(0, str(ROOT))
 
 from src import extract_to_csv, translate_csv, build_pack
+from src.metrics import metrics, profiled
+from src.common import ensure_dirs
+from src.store import MemoryStore, open_store
+from config import METRICS_PATH, PROMETHEUS_TEXTFILE
+
+STAGES = ("extract", "translate", "build")
 
 
-def main():
-    print("=== extract_to_csv ===")
-    extract_to_csv.main()
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="Run extract, translate and build in one go.")
+    ap.add_argument("--profile", default="",
+                    help="comma-separated stages to profile "
+                         f"({', '.join(STAGES)}), or 'all'")
+    ap.add_argument("--profiler", choices=["cprofile", "tracemalloc"], default="cprofile")
+    args = ap.parse_args(argv)
+    profile = set(STAGES) if args.profile == "all" else {s for s in args.profile.split(",") if s}
+    for s in profile - set(STAGES):
+        ap.error(f"unknown stage {s!r}")
+    args.profile = profile
+    return args
 
-    print("=== translate_csv ===")
-    translate_csv.main()
 
-    print("=== build_pack ===")
-    build_pack.main()
+@contextmanager
+def stage(name: str, banner: str, args):
+    print(f"=== {banner} ===")
+    kind = args.profiler if name in args.profile else None
+    with metrics.stage(name), profiled(kind, name):
+        yield
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    ensure_dirs()
+    store = MemoryStore(open_store())
+    try:
+        with stage("extract", "extract_to_csv", args):
+            manifest = extract_to_csv.extract(store)
+        with stage("translate", "translate_csv", args):
+            translate_csv.translate(store)
+        with metrics.stage("checkpoint"):
+            store.checkpoint()
+            # Only now that the rows are on disk may the manifest say so.
+            extract_to_csv.save_manifest(manifest)
+        with stage("build", "build_pack", args):
+            build_pack.build(store.all_rows())
+    finally:
+        store.close()
+        snap = metrics.write()
+        print(f"Metrics written to {METRICS_PATH}"
+              + (f" and {PROMETHEUS_TEXTFILE}" if PROMETHEUS_TEXTFILE else ""))
+        for name, entry in snap["stages"].items():
+            if "wall_seconds" in entry:
+                print(f"  {name:<10} {entry['wall_seconds']:>9.2f}s wall "
+                      f"{entry['cpu_seconds'] + entry['child_cpu_seconds']:>9.2f}s CPU  "
+                      f"{entry['status']}")
 
     print("All done.")
 
 
 if __name__ == "__main__":
     main()
-
-
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Summarise the state of the working directory without touching the API.
+
+    py -m src status
+
+Prints the row counts of the string store by status (per variant), the
+batches the ledger still lists as open, the last known progress of running
+batches, the last run_all metrics and when the packs were last built. Only
+local files are read, so this works offline and without OPENAI_API_KEY.
+"""
+
+import json
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Optional
+
+from config import STORE_BACKEND, PROGRESS_PATH, METRICS_PATH
+from src.build_pack import manifest_path
+from src.ledger import BatchLedger
+from src.progress import format_duration
+from src.store import open_store
+from src.variants import VARIANTS, status_of
+
+
+def _load(path: Path) -> Optional[dict]:
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def _when(ts: float) -> str:
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ts))
+
+
+def main(argv=None):
+    store = open_store()
+    try:
+        rows = store.all_rows() if store.exists() else []
+    finally:
+        store.close()
+    if rows:
+        print(f"Store ({STORE_BACKEND}) {store.path}: {len(rows)} strings")
+        for variant in VARIANTS:
+            counts = Counter(status_of(r, variant) or "(empty)" for r in rows)
+            if len(VARIANTS) > 1:
+                print(f"  {variant.code}:")
+            for status, n in counts.most_common():
+                print(f"  {status:<10} {n:>9}")
+    else:
+        print(f"Store ({STORE_BACKEND}) {store.path}: empty, run extract first")
+
+    open_batches = BatchLedger().open_batches()
+    if open_batches:
+        print(f"{len(open_batches)} open batch(es):")
+        for batch_id, e in sorted(open_batches.items(), key=lambda kv: kv[1]["created"]):
+            strings = sum(len(h) for h in e["requests"].values())
+            print(f"  {batch_id} shard {e['shard']} {e['state']}: {len(e['requests'])} requests, "
+                  f"{strings} strings, submitted {_when(e['created'])}")
+        overall = (_load(PROGRESS_PATH) or {}).get("overall")
+        if overall:
+            print(f"  last check: {overall['completed']}/{overall['total']} done, "
+                  f"{overall['failed']} failed, ETA {format_duration(overall['eta_seconds'])}")
+    else:
+        print("No open batches.")
+
+    metrics = _load(METRICS_PATH)
+    if metrics:
+        stages = ", ".join(f"{name} {e['wall_seconds']:.1f}s {e['status']}"
+                           for name, e in metrics["stages"].items() if "wall_seconds" in e)
+        print(f"Last run_all {_when(metrics['finished'])}: {stages}")
+
+    for variant in VARIANTS:
+        path = manifest_path(variant)
+        manifest = _load(path)
+        if manifest:
+            print(f"Packs of {variant.code} last built {_when(manifest['built'])} "
+                  f"into {path.parent}")
+
+
+if __name__ == "__main__":
+    main()
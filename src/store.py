@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+"""
+Storage backends for the string table.
+
+Every stage talks to the table through open_store(), which returns one of:
+
+ * CsvStore    - strings.csv, loaded into memory and rewritten on save. This is
+                 the original format and remains the default.
+ * SqliteStore - strings.sqlite in WAL mode, indexed on hash, status and
+                 component. Selecting pending rows, applying results and
+                 grouping rows for the pack are indexed queries and in-place
+                 UPDATEs instead of full-file round trips.
+
+run_all wraps the configured store in a MemoryStore, which loads the table
+once, hands the same rows from stage to stage and writes back to disk
+only on checkpoint(): after API results are applied (so paid-for
+translations survive a crash) and at the end of the run. The disk stores
+write on every save, so their checkpoint() does nothing.
+
+Rows are src.row.Row records, mappings with the CSV_FIELDS keys plus any
+extra columns. Keys starting with "_" (such as _row_index) are in-memory
+helpers and are never persisted. _row_index is the row's position in the table and is filled in by
+both backends when rows are read.
+
+pending(), translated() and get() take an optional variant (src/variants.py)
+and then return that variant's views of the rows; save() accepts rows and
+views alike and writes a view into its variant's columns only. The SQLite
+store keeps extra-variant translations in a `translations` table; all_rows()
+attaches them as translated_text__<code>/status__<code> like the CSV columns.
+
+The CSV stays available as an import/export format for the SQLite store:
+
+    py -m src.store export [path]   # SQLite -> CSV (default strings.csv)
+    py -m src.store import [path]   # CSV -> SQLite
+"""
+
+import argparse
+import json
+import sqlite3
+import sys
+from pathlib import Path
+from typing import Dict, Iterable, List
+
+from config import STORE_BACKEND, SQLITE_PATH
+from src.common import CSV_PATH, CSV_FIELDS, read_csv_rows, write_csv_rows
+from src.row import Row
+from src.variants import (PRIMARY, Variant, view, status_of, is_variant_column,
+                          variant_columns, variant_of)
+
+
+def _persisted(row: Row) -> dict:
+    return {k: v for k, v in row.items() if not k.startswith("_")}
+
+
+def _is_translated(row: Row) -> bool:
+    return bool(row["translated_text"]) and row["translated_text"] != row["source_text"]
+
+
+def _merge(row: Row, new: Row) -> None:
+    """Copy what new (a row or a variant's view of it) carries into row."""
+    if new.get("_variant"):
+        variant = variant_of(new)
+        row[variant.text_col] = new["translated_text"]
+        row[variant.status_col] = new["status"]
+    elif new is not row:
+        row.update(_persisted(new))
+
+
+def _save_in_memory(current: List[Row], rows: Iterable[Row]) -> Dict[tuple, Row]:
+    """Merge rows and views into the in-memory table current; returns them
+    keyed by (hash, variant)."""
+    saved = {(r["hash"], r.get("_variant")): r for r in rows}
+    by_hash = {}
+    for key, r in saved.items():
+        by_hash.setdefault(key[0], []).append(r)
+    for r in current:
+        for new in by_hash.get(r["hash"], ()):
+            _merge(r, new)
+    return saved
+
+
+class InMemoryRows:
+    """pending(), translated() and get() for stores that hold the whole
+    table as a list from all_rows()."""
+
+    def all_rows(self) -> List[Row]:
+        raise NotImplementedError
+
+    def pending(self, variant: Variant = PRIMARY) -> List[Row]:
+        return [view(r, variant) for r in self.all_rows()
+                if status_of(r, variant) == "pending"]
+
+    def translated(self, variant: Variant = PRIMARY) -> List[Row]:
+        return [v for v in (view(r, variant) for r in self.all_rows()) if _is_translated(v)]
+
+    def get(self, hashes: Iterable[str], variant: Variant = PRIMARY) -> Dict[str, Row]:
+        wanted = set(hashes)
+        found = {}
+        for r in self.all_rows():
+            if r["hash"] in wanted and r["hash"] not in found:
+                found[r["hash"]] = view(r, variant)
+        return found
+
+
+class CsvStore(InMemoryRows):
+    """strings.csv, held in memory and rewritten whenever rows are saved."""
+
+    # Every save() rewrites the whole file, so callers should save once.
+    rewrites_on_save = True
+
+    def __init__(self, path: Path = CSV_PATH):
+        self.path = path
+        self._rows = None
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def all_rows(self) -> List[Row]:
+        if self._rows is None:
+            self._rows = read_csv_rows(self.path) if self.exists() else []
+            for idx, row in enumerate(self._rows):
+                row["_row_index"] = idx
+        return self._rows
+
+    def save(self, rows: Iterable[Row]) -> None:
+        """Persist translated_text/status (and extra columns) of rows."""
+        current = self.all_rows()
+        _save_in_memory(current, rows)
+        write_csv_rows(current, self.path)
+
+    def replace_all(self, rows: List[Row]) -> None:
+        write_csv_rows(rows, self.path)
+        self._rows = None
+
+    def checkpoint(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class SqliteStore:
+    """strings.sqlite with indexed lookups and in-place updates."""
+
+    rewrites_on_save = False
+
+    _COLUMNS = ", ".join(CSV_FIELDS)
+
+    def __init__(self, path: Path = SQLITE_PATH):
+        self.path = path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # The batch poller saves from a worker thread; access is never
+        # concurrent, so sharing the connection is safe.
+        self.db = sqlite3.connect(str(path), check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS strings (
+                seq INTEGER PRIMARY KEY,
+                component TEXT NOT NULL,
+                relpath TEXT NOT NULL,
+                sourcefile TEXT NOT NULL,
+                key TEXT NOT NULL,
+                source_text TEXT NOT NULL,
+                translated_text TEXT NOT NULL DEFAULT '',
+                status TEXT NOT NULL DEFAULT 'pending',
+                hash TEXT NOT NULL UNIQUE,
+                extra TEXT
+            );
+            CREATE INDEX IF NOT EXISTS strings_status ON strings(status);
+            CREATE INDEX IF NOT EXISTS strings_component ON strings(component);
+            CREATE TABLE IF NOT EXISTS translations (
+                hash TEXT NOT NULL,
+                variant TEXT NOT NULL,
+                translated_text TEXT NOT NULL DEFAULT '',
+                status TEXT NOT NULL DEFAULT 'pending',
+                PRIMARY KEY (hash, variant)
+            );
+            CREATE INDEX IF NOT EXISTS translations_status ON translations(variant, status);
+            """
+        )
+
+    def _select(self, where: str = "", params=(), variant: Variant = PRIMARY) -> List[Row]:
+        """Rows matching where (columns of strings as s., of the variant's
+        translations as t.), as variant's views."""
+        cols = ", ".join(f"s.{c}" for c in CSV_FIELDS)
+        if variant.primary:
+            sql = f"SELECT s.seq, {cols}, s.extra FROM strings s {where} ORDER BY s.seq"
+        else:
+            sql = (f"SELECT s.seq, {cols}, s.extra, t.translated_text, t.status FROM strings s "
+                   f"LEFT JOIN translations t ON t.hash = s.hash AND t.variant = ? "
+                   f"{where} ORDER BY s.seq")
+            params = (variant.code, *params)
+        rows = []
+        n = len(CSV_FIELDS)
+        for rec in self.db.execute(sql, params):
+            row = Row(*rec[1:n + 1], _row_index=rec[0])
+            if rec[n + 1]:
+                row.update(json.loads(rec[n + 1]))
+            if not variant.primary:
+                row[variant.text_col], row[variant.status_col] = rec[n + 2], rec[n + 3]
+                row = view(row, variant)
+            rows.append(row)
+        return rows
+
+    @staticmethod
+    def _extra(row: Row):
+        extra = {k: row[k] for k in row.extra_columns()
+                 if not k.startswith("_") and not is_variant_column(k)}
+        return json.dumps(extra, ensure_ascii=False) if extra else None
+
+    def exists(self) -> bool:
+        return self.db.execute("SELECT 1 FROM strings LIMIT 1").fetchone() is not None
+
+    def all_rows(self) -> List[Row]:
+        rows = self._select()
+        by_hash = {r["hash"]: r for r in rows}
+        for h, code, text, status in self.db.execute(
+                "SELECT hash, variant, translated_text, status FROM translations"):
+            row = by_hash.get(h)
+            if row is not None:
+                row[f"translated_text__{code}"], row[f"status__{code}"] = text, status
+        return rows
+
+    def pending(self, variant: Variant = PRIMARY) -> List[Row]:
+        if variant.primary:
+            return self._select("WHERE s.status = 'pending'")
+        return self._select("WHERE coalesce(t.status, 'pending') = 'pending'", (), variant)
+
+    def translated(self, variant: Variant = PRIMARY) -> List[Row]:
+        t = "s" if variant.primary else "t"
+        return self._select(f"WHERE {t}.translated_text != '' "
+                            f"AND {t}.translated_text != s.source_text", (), variant)
+
+    def get(self, hashes: Iterable[str], variant: Variant = PRIMARY) -> Dict[str, Row]:
+        found = {}
+        hashes = list(hashes)
+        # Stay well below SQLite's bound-parameter limit.
+        for i in range(0, len(hashes), 500):
+            part = hashes[i:i + 500]
+            marks = ",".join("?" * len(part))
+            for row in self._select(f"WHERE s.hash IN ({marks})", part, variant):
+                found[row["hash"]] = row
+        return found
+
+    def save(self, rows: Iterable[Row]) -> None:
+        rows = list(rows)
+        with self.db:
+            self.db.executemany(
+                "UPDATE strings SET translated_text = ?, status = ?, extra = ? WHERE hash = ?",
+                ((r["translated_text"], r["status"], self._extra(r), r["hash"])
+                 for r in rows if not r.get("_variant")),
+            )
+            self.db.executemany(
+                "INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?)",
+                ((r["hash"], r["_variant"], r["translated_text"], r["status"])
+                 for r in rows if r.get("_variant")),
+            )
+
+    def replace_all(self, rows: List[Row]) -> None:
+        # Duplicate hashes (the same key defined twice with the same text in
+        # one file) collapse to the first definition.
+        with self.db:
+            self.db.execute("DELETE FROM strings")
+            self.db.executemany(
+                f"INSERT OR IGNORE INTO strings (seq, {self._COLUMNS}, extra) "
+                f"VALUES (?, {', '.join('?' * len(CSV_FIELDS))}, ?)",
+                ((i, *(r.get(c, "") for c in CSV_FIELDS), self._extra(r))
+                 for i, r in enumerate(rows)),
+            )
+            self.db.execute("DELETE FROM translations")
+            self.db.executemany(
+                "INSERT OR IGNORE INTO translations VALUES (?, ?, ?, ?)",
+                ((r["hash"], code, text, status)
+                 for r in rows for code, (text, status) in variant_columns(r).items()),
+            )
+
+    def checkpoint(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.db.close()
+
+
+class MemoryStore(InMemoryRows):
+    """
+    The rows of another store, held in memory for an in-process run.
+
+    Reads and saves only touch memory; checkpoint() writes what changed to
+    the backing store (the whole table for strings.csv, just the changed
+    rows for SQLite, everything after replace_all()). close() checkpoints
+    and closes the backing store.
+    """
+
+    rewrites_on_save = False
+
+    def __init__(self, backing):
+        self.backing = backing
+        self.path = backing.path
+        self._rows = None
+        # (hash, variant code or None) -> row or view saved since the last checkpoint
+        self._dirty: Dict[tuple, Row] = {}
+        self._replaced = False
+
+    def exists(self) -> bool:
+        return bool(self._rows) or (self._rows is None and self.backing.exists())
+
+    def all_rows(self) -> List[Row]:
+        if self._rows is None:
+            self._rows = self.backing.all_rows() if self.backing.exists() else []
+        return self._rows
+
+    def save(self, rows: Iterable[Row]) -> None:
+        self._dirty.update(_save_in_memory(self.all_rows(), rows))
+
+    def replace_all(self, rows: List[Row]) -> None:
+        self._rows = list(rows)
+        for idx, row in enumerate(self._rows):
+            row["_row_index"] = idx
+        self._replaced = True
+        self._dirty = {}
+
+    def checkpoint(self) -> None:
+        """Write the changes since the last checkpoint to the backing store."""
+        if self._replaced or (self._dirty and self.backing.rewrites_on_save):
+            self.backing.replace_all(self.all_rows())
+        elif self._dirty:
+            self.backing.save(self._dirty.values())
+        self._replaced = False
+        self._dirty = {}
+
+    def close(self) -> None:
+        self.checkpoint()
+        self.backing.close()
+
+
+def open_store(backend: str = STORE_BACKEND):
+    if backend == "csv":
+        return CsvStore()
+    if backend == "sqlite":
+        return SqliteStore()
+    raise SystemExit(f"Unknown STORE_BACKEND {backend!r}; use 'csv' or 'sqlite'")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Move the string table between CSV and SQLite.")
+    ap.add_argument("action", choices=["export", "import"])
+    ap.add_argument("path", nargs="?", type=Path, default=CSV_PATH,
+                    help=f"CSV file to write or read (default {CSV_PATH})")
+    args = ap.parse_args(argv)
+
+    db = SqliteStore()
+    csv_store = CsvStore(args.path)
+    try:
+        if args.action == "export":
+            rows = db.all_rows()
+            csv_store.replace_all(rows)
+            print(f"Exported {len(rows)} rows from {db.path} to {args.path}")
+        else:
+            if not csv_store.exists():
+                raise SystemExit(f"CSV not found at {args.path}")
+            rows = csv_store.all_rows()
+            db.replace_all(rows)
+            print(f"Imported {len(rows)} rows from {args.path} into {db.path}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,331 +3,1045 @@
 Batch translation of Moodle strings using the OpenAI Batch API.
 
 Workflow:
- 1. Read strings.csv and collect rows with status == "pending".
- 2. Build a JSONL batch input file, one /v1/responses request per row.
-    Each line uses "{hash}__{row_index}" as custom_id.
- 3. Upload the JSONL as a batch input file and create a batch job.
- 4. A background thread polls the batch until it finishes, then:
-       - downloads the batch output
-       - merges translations back into strings.csv
-       - writes the updated CSV
-       - signals an Event so main() can exit cleanly.
+ 1. Read rows with status == "pending" from the string store.
+ 2. Split them into shards of at most BATCH_SIZE requests and
+    BATCH_MAX_BYTES of JSONL, one /v1/responses request per row (or per
+    PACK_STRINGS_PER_REQUEST rows of one component in packed mode).
+    A single request's custom_id is its row hash; a packed request uses
+    "pack__" plus a digest of its rows' hashes. Both survive re-extraction.
+ 3. Upload each shard as a batch input file and create a batch job.
+ 4. Up to BATCH_MAX_CONCURRENT shards are submitted and polled at once by a
+    thread pool. Each batch is written to the batch ledger when it is
+    created. As soon as a shard finishes its worker:
+       - streams the batch output and error files line by line
+       - merges translations back into the pending rows
+       - saves those rows to the store (strings.csv or strings.sqlite)
+    so early shards produce usable translations while later ones still run.
+ 5. Strings that got no usable reply (item errors, failed batches, strings
+    a packed reply left out) or whose reply failed the placeholder/tag
+    check go round again, one per request, with a corrective prompt, until
+    they succeed or reach MAX_ATTEMPTS. Then they are given up on: status
+    "failed", or "fallback" with the source text for rejected replies.
+    The run ends with the success rate of every attempt.
+
+Before anything is uploaded, every request's tokens and cost are estimated
+locally (src/estimate.py) and held to TOKEN_BUDGET; --dry-run stops after
+writing the batch input and printing the estimate by component:
+
+    py src\translate_csv.py --dry-run
+
+If the script is interrupted, the next run re-attaches to the batches the
+ledger still lists as open, applies them when they finish and leaves their
+rows out of new submissions.
 """
 
-import csv
+import argparse
 import json
+import hashlib
 import time
 import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
-from openai import OpenAI
-
-from src.common import CSV_PATH, tokens_for
+from src.common import atomic_write_text, ensure_dirs, tokens_for
+from src.estimate import Estimate, TokenGate, request_tokens
+from src.results import ResultApplier, new_usage
+from src.ledger import BatchLedger
+from src.realtime import is_retryable, translate_all
+from src.progress import BatchTracker, ProgressFile, describe, format_duration
+from src.store import open_store
+from src.memory import TranslationMemory, fan_out
+from src.fuzzy import FuzzyIndex, adapt
+from src.rules import RuleEngine
+from src.metrics import metrics
+from src.variants import (VARIANTS, variant_of, tag_custom_id, split_custom_id, view,
+                          status_of)
 from config import (
-    TARGET_STYLE,
     OPENAI_MODEL,
     DATA_DIR,
+    LOG_DIR,
     BATCH_COMPLETION_WINDOW,
-    BATCH_POLL_SECONDS,
+    BATCH_SIZE,
+    BATCH_MAX_BYTES,
+    BATCH_MAX_CONCURRENT,
+    PACK_STRINGS_PER_REQUEST,
+    TRANSLATION_MEMORY,
+    FUZZY_MATCH,
+    FUZZY_HINT_SIMILARITY,
+    FUZZY_APPLY,
+    TRANSLATE_MODE,
+    REALTIME_MAX_PENDING,
+    MAX_ATTEMPTS,
+    TOKEN_BUDGET,
+    OVER_BUDGET,
+    BATCH_ENQUEUED_TOKEN_LIMIT,
 )
 
-# OpenAI client (no Azure)
-client = OpenAI()  # uses OPENAI_API_KEY from environment
+_client = None
+_client_lock = threading.Lock()
+progress = ProgressFile()
 MODEL = OPENAI_MODEL
+# RuleEngine of each variant, by code (see rule_engine()).
+_engines = {}
 
-SYSTEM = f"""You translate Moodle UI strings into {TARGET_STYLE}.
+# System prompts; {style} is the TARGET_STYLE of the request's variant.
+SYSTEM = """You translate Moodle UI strings into {style}.
 Rules:
 1 Preserve placeholders exactly, for example {{$a}}, {{$a->name}}, %s, %d, %1$s
 2 Preserve HTML tags and entities exactly
 3 One line per item, no commentary
 Return JSON only: {{"translated_text":"..."}}"""
 
-# Where to put the batch input JSONL
+SYSTEM_PACKED = """You translate Moodle UI strings into {style}.
+Rules:
+1 Preserve placeholders exactly, for example {{$a}}, {{$a->name}}, %s, %d, %1$s
+2 Preserve HTML tags and entities exactly
+3 Translate every item and keep its key unchanged, no commentary
+Return JSON only: {{"translations":[{{"key":"...","translated_text":"..."}}]}}"""
+
+# Prompt of a retried string; {problem} says what went wrong last time and
+# {tokens} lists the source's placeholders and tags.
+SYSTEM_RETRY = """You translate Moodle UI strings into {style}.
+An earlier attempt at this string failed: {problem}
+Rules, follow them exactly:
+1 Keep every placeholder and HTML tag of the source, unchanged and exactly as often: {tokens}
+2 Do not add placeholders or tags the source does not have
+3 Translate the whole text, no commentary, no code fences
+Return JSON only: {{"translated_text":"..."}}"""
+
+# Added to the user prompt when items carry a fuzzy-match example.
+EXAMPLE_NOTE = ("An example gives a similar string translated earlier; "
+                "word the translation consistently with it.")
+# Added when the request carries glossary terms its strings contain.
+GLOSSARY_NOTE = "Translate the terms listed under glossary as given there."
+
+PROBLEM_NO_REPLY = "no usable JSON reply came back."
+PROBLEM_REJECTED = ("the translation (previous_attempt below) did not keep the "
+                    "placeholders and HTML tags of the source.")
+
+# Where to put the batch input JSONL (shards get a numbered sibling)
 BATCH_INPUT_PATH = DATA_DIR / "batch_input.jsonl"
 
+# Token and cost estimate of the last --dry-run, by component.
+ESTIMATE_PATH = LOG_DIR / "estimate.json"
+
+# Hard per-file limit of the Batch API; BATCH_SIZE is clamped to it.
+BATCH_API_MAX_REQUESTS = 50_000
+
 
 # ---------------------------------------------------------------------------
 # Build batch input file
 # ---------------------------------------------------------------------------
 
-def build_batch_input_file(pending_rows):
+def custom_id_for(unit) -> str:
+    """custom_id of a request: the row hash, or "pack__" plus a digest of the
+    member hashes when the request carries several rows, tagged with the
+    variant unless it is the primary one. None of this depends on row order,
+    so ids stay stable across re-extraction."""
+    if len(unit) == 1:
+        cid = unit[0]["hash"]
+    else:
+        digest = hashlib.sha256("|".join(r["hash"] for r in unit).encode("ascii"))
+        cid = f"pack__{digest.hexdigest()[:40]}"
+    return tag_custom_id(cid, variant_of(unit[0]))
+
+
+def with_example(item: dict, row) -> dict:
+    """item plus row's fuzzy-match example, if it has one."""
+    hint = row.get("_hint")
+    if hint:
+        item["example"] = {"text": hint.source_text, "translated_text": hint.translated_text}
+    return item
+
+
+def rule_engine(variant) -> RuleEngine:
+    engine = _engines.get(variant.code)
+    if engine is None:
+        engine = _engines[variant.code] = RuleEngine(variant.glossary, variant.regex_rules,
+                                                     variant.fixed_phrases, variant.rules_mode)
+    return engine
+
+
+def with_terms(payload: dict, unit) -> dict:
+    """payload plus the glossary entries of unit's variant that its strings
+    contain, so the model makes the same swaps as the local rules."""
+    terms = rule_engine(variant_of(unit[0])).terms(r["source_text"] for r in unit)
+    if terms:
+        payload["glossary"] = terms
+    return payload
+
+
+def prompt_intro(text: str, unit, payload: dict) -> str:
+    if any(r.get("_hint") for r in unit):
+        text += " " + EXAMPLE_NOTE
+    if "glossary" in payload:
+        text += " " + GLOSSARY_NOTE
+    return text
+
+
+def request_body(unit) -> dict:
     """
-    Create a JSONL file where each line is a POST /v1/responses request.
+    Body of the POST /v1/responses request for a unit (list of rows).
 
-    custom_id is "{hash}__{row_index}" so it is unique per row.
+    A one-row unit is the classic single-string request; longer units are
+    packed: all rows share one prompt and the model replies with a list of
+    translations keyed by string key.
     """
-    BATCH_INPUT_PATH.parent.mkdir(parents=True, exist_ok=True)
-
-    with BATCH_INPUT_PATH.open("w", encoding="utf-8") as f:
-        for row in pending_rows:
-            custom_id = f"{row['hash']}__{row['_row_index']}"
-
-            payload = {
-                "key": row["key"],
-                "text": row["source_text"],
-                "component": row["component"],
-            }
-
-            user_prompt = (
-                "Translate this Moodle UI string. JSON only.\n"
-                + json.dumps(payload, ensure_ascii=False)
-            )
-
-            body = {
-                "model": MODEL,
-                "input": [
-                    {"role": "system", "content": SYSTEM},
-                    {"role": "user", "content": user_prompt},
-                ],
-                "max_output_tokens": 512,
-            }
-
-            line = {
-                "custom_id": custom_id,
-                "method": "POST",
-                "url": "/v1/responses",
-                "body": body,
-            }
+    if len(unit) == 1 and (unit[0].get("_attempt") or 1) > 1:
+        return retry_body(unit[0])
+    if len(unit) == 1:
+        row = unit[0]
+        payload = with_terms(with_example({
+            "key": row["key"],
+            "text": row["source_text"],
+            "component": row["component"],
+        }, row), unit)
+        system = SYSTEM.format(style=variant_of(row).style)
+        user_prompt = (
+            prompt_intro("Translate this Moodle UI string. JSON only.", unit, payload) + "\n"
+            + json.dumps(payload, ensure_ascii=False)
+        )
+        max_tokens = 512
+    else:
+        payload = with_terms({
+            "component": unit[0]["component"],
+            "items": [with_example({"key": r["key"], "text": r["source_text"]}, r)
+                      for r in unit],
+        }, unit)
+        system = SYSTEM_PACKED.format(style=variant_of(unit[0]).style)
+        user_prompt = (
+            prompt_intro("Translate these Moodle UI strings. JSON only.", unit, payload) + "\n"
+            + json.dumps(payload, ensure_ascii=False)
+        )
+        max_tokens = min(512 * len(unit), 16384)
+
+    return {
+        "model": MODEL,
+        "input": [
+            {"role": "system", "content": system},
+            {"role": "user", "content": user_prompt},
+        ],
+        "max_output_tokens": max_tokens,
+    }
+
+
+def retry_body(row) -> dict:
+    """Request body of a retried string: the corrective prompt, and the
+    rejected translation if there was one."""
+    payload = with_terms(with_example({
+        "key": row["key"],
+        "text": row["source_text"],
+        "component": row["component"],
+    }, row), [row])
+    rejected = row.get("_rejected")
+    if rejected:
+        payload["previous_attempt"] = rejected
+    tokens = tokens_for(row["source_text"])
+    system = SYSTEM_RETRY.format(
+        style=variant_of(row).style,
+        problem=PROBLEM_REJECTED if rejected else PROBLEM_NO_REPLY,
+        tokens=" ".join(tokens) if tokens else "none (so add none)",
+    )
+    return {
+        "model": MODEL,
+        "input": [
+            {"role": "system", "content": system},
+            {"role": "user",
+             "content": prompt_intro("Translate this Moodle UI string again. JSON only.", [row],
+                                     payload)
+             + "\n" + json.dumps(payload, ensure_ascii=False)},
+        ],
+        "max_output_tokens": 512,
+    }
+
+
+def request_line(unit, body=None) -> str:
+    """Serialise one batch request line for a unit."""
+    line = {
+        "custom_id": custom_id_for(unit),
+        "method": "POST",
+        "url": "/v1/responses",
+        "body": body or request_body(unit),
+    }
+
+    return json.dumps(line, ensure_ascii=False) + "\n"
+
+
+def pack_rows(rows, size: int = PACK_STRINGS_PER_REQUEST):
+    """
+    Group rows into request units of up to size rows from one component
+    (and variant). Keys are unique within a unit so the reply can be matched
+    by key.
+    """
+    if size <= 1:
+        return [[r] for r in rows]
+    by_component = defaultdict(list)
+    for r in rows:
+        by_component[(r.get("_variant"), r["component"])].append(r)
+    units = []
+    for comp_rows in by_component.values():
+        unit, keys = [], set()
+        for r in comp_rows:
+            if len(unit) >= size or r["key"] in keys:
+                units.append(unit)
+                unit, keys = [], set()
+            unit.append(r)
+            keys.add(r["key"])
+        if unit:
+            units.append(unit)
+    return units
+
+
+def plan_shards(units):
+    """
+    Split request units into shards that respect BATCH_SIZE requests,
+    BATCH_MAX_BYTES of JSONL and BATCH_ENQUEUED_TOKEN_LIMIT input tokens.
+    Returns a list of (units, lines, input tokens) triples; the token count
+    is 0 unless the limit is set.
+    """
+    max_requests = max(1, min(BATCH_SIZE, BATCH_API_MAX_REQUESTS))
+    limit = BATCH_ENQUEUED_TOKEN_LIMIT
+    shards = []
+    batch, lines, size, tokens = [], [], 0, 0
+    for unit in units:
+        body = request_body(unit)
+        line = request_line(unit, body)
+        n = len(line.encode("utf-8"))
+        t = request_tokens(unit, body)[0] if limit is not None else 0
+        if batch and (len(batch) >= max_requests or size + n > BATCH_MAX_BYTES
+                      or (limit is not None and tokens + t > limit)):
+            shards.append((batch, lines, tokens))
+            batch, lines, size, tokens = [], [], 0, 0
+        batch.append(unit)
+        lines.append(line)
+        size += n
+        tokens += t
+    if batch:
+        shards.append((batch, lines, tokens))
+    return shards
+
+
+def shard_input_path(index: int, total: int) -> Path:
+    if total == 1:
+        return BATCH_INPUT_PATH
+    return BATCH_INPUT_PATH.with_name(f"{BATCH_INPUT_PATH.stem}_{index:03d}.jsonl")
+
+
+def build_batch_input_file(units, path: Path = BATCH_INPUT_PATH, lines=None):
+    """
+    Create a JSONL file where each line is a POST /v1/responses request.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
 
-            f.write(json.dumps(line, ensure_ascii=False))
-            f.write("\n")
+    with path.open("w", encoding="utf-8") as f:
+        for line in lines if lines is not None else map(request_line, units):
+            f.write(line)
 
-    return BATCH_INPUT_PATH
+    return path
 
 
 # ---------------------------------------------------------------------------
 # Submit batch
 # ---------------------------------------------------------------------------
 
-def submit_batch(input_path: Path) -> str:
-    """Upload JSONL and create a batch job, returns batch id."""
+def get_client():
+    """The OpenAI client (no Azure), created on first use so that runs with
+    nothing to send never import the SDK or need OPENAI_API_KEY."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            from openai import OpenAI
+            _client = OpenAI()  # uses OPENAI_API_KEY from environment
+        return _client
+
+
+def submit_batch(input_path: Path):
+    """Upload JSONL and create a batch job, returns (batch id, input file id)."""
     # Using an explicit file handle is safest across client versions
-    with input_path.open("rb") as fh:
-        batch_input_file = client.files.create(
+    with metrics.timed("translate", "upload_seconds"), input_path.open("rb") as fh:
+        batch_input_file = get_client().files.create(
             file=fh,
             purpose="batch",
         )
 
-    batch = client.batches.create(
+    batch = get_client().batches.create(
         input_file_id=batch_input_file.id,
         endpoint="/v1/responses",
         completion_window=BATCH_COMPLETION_WINDOW,
         metadata={"job": "moodle_lang_translation"},
     )
+    metrics.add("translate", batches_submitted=1)
 
     print(f"Submitted batch {batch.id}")
-    return batch.id
+    return batch.id, batch_input_file.id
 
 
 # ---------------------------------------------------------------------------
-# Extract text from /v1/responses body
+# Stream batch output
 # ---------------------------------------------------------------------------
 
-def extract_output_text(body: dict) -> str:
-    """
-    Given a /v1/responses response body, pull out the assistant text.
-
-    We try:
-      - body["output_text"] if present
-      - else any output_text in body["output"] entries.
-    """
-    if isinstance(body.get("output_text"), str):
-        return body["output_text"]
-
-    for item in body.get("output", []):
-        if item.get("type") == "message":
-            for c in item.get("content", []):
-                if c.get("type") == "output_text":
-                    return c.get("text", "")
-    return ""
+def stream_file_lines(file_id: str):
+    """Yield the lines of an uploaded file as they are downloaded."""
+    with get_client().files.with_streaming_response.content(file_id) as resp:
+        yield from resp.iter_lines()
 
 
 # ---------------------------------------------------------------------------
-# Apply batch results to CSV rows
+# Shard workers
 # ---------------------------------------------------------------------------
 
-def apply_batch_results(rows, output_jsonl_text: str):
-    """
-    Parse batch output JSONL and update rows in place.
+TERMINAL_STATES = {"completed", "failed", "cancelled", "expired"}
 
-    Each line format:
-      {"id": "...", "custom_id": "...",
-       "response": {"body": {...}},
-       "error": ...}
 
-    custom_id format is "{hash}__{row_index}".
+def wait_for_batch(batch_id: str, label: str = "", ledger=None):
     """
-    rows_by_custom_id = {}
-    for r in rows:
-        if "_row_index" in r:
-            cid = f"{r['hash']}__{r['_row_index']}"
-            rows_by_custom_id[cid] = r
-
-    total_items = 0
-    matched = 0
-    changed = 0
-
-    for line in output_jsonl_text.splitlines():
-        line = line.strip()
-        if not line:
-            continue
-
-        try:
-            obj = json.loads(line)
-        except json.JSONDecodeError:
-            print("Skipping invalid JSON line in batch output")
-            continue
-
-        total_items += 1
-        custom_id = obj.get("custom_id")
-        if not custom_id or custom_id not in rows_by_custom_id:
-            continue
-
-        if obj.get("error"):
-            print(f"Batch item error for {custom_id}: {obj['error']}")
-            continue
-
-        body = obj.get("response", {}).get("body", {})
-        raw_text = extract_output_text(body).strip()
-        if not raw_text:
-            continue
-
-        # We asked for JSON only: {"translated_text":"..."}
+    Poll the batch until it reaches a terminal state. The wait between checks
+    adapts to its progress (see src/progress.py); counts, throughput and ETA
+    are printed and written to the progress file on every check. A check
+    that fails with a connection error or a retryable HTTP status counts as
+    no progress, so the wait backs off instead of giving up on the batch.
+    """
+    from openai import APIConnectionError, APIStatusError
+    tracker = BatchTracker()
+    while True:
         try:
-            decoded = json.loads(raw_text)
-            if isinstance(decoded, dict) and "translated_text" in decoded:
-                translated = decoded["translated_text"]
-            else:
-                translated = decoded if isinstance(decoded, str) else raw_text
-        except json.JSONDecodeError:
-            translated = raw_text
-
-        row = rows_by_custom_id[custom_id]
-        src = row["source_text"]
-        tgt = (translated or "").strip()
-        if not tgt:
+            batch = get_client().batches.retrieve(batch_id)
+        except (APIConnectionError, APIStatusError) as exc:
+            if not is_retryable(getattr(exc, "status_code", None)):
+                raise
+            tracker.stalled()
+            ts = time.strftime("%Y-%m-%d %H:%M:%S")
+            print(f"[{ts}] {label}Batch {batch_id} status check failed: {exc!r} "
+                  f"(next check in {format_duration(tracker.delay)})")
+            time.sleep(tracker.delay)
             continue
+        snap = tracker.observe(batch)
+        progress.update(batch_id, label, snap)
+        ts = time.strftime("%Y-%m-%d %H:%M:%S")
+        line = f"[{ts}] {label}Batch {batch_id} {describe(snap)}"
+        if ledger is not None:
+            ledger.update(batch_id, state=batch.status)
 
-        matched += 1
-
-        # Placeholder and tag safety
-        safe_tgt = tgt if tokens_for(src) == tokens_for(tgt) else src
-
-        if safe_tgt != row.get("translated_text"):
-            changed += 1
+        if batch.status in TERMINAL_STATES:
+            print(line)
+            return batch
 
-        row["translated_text"] = safe_tgt
-        row["status"] = "ok" if safe_tgt != src else "fallback"
+        print(f"{line} (next check in {format_duration(tracker.delay)})")
+        time.sleep(tracker.delay)
 
-    print(f"Processed {total_items} batch items inside apply_batch_results.")
-    print(f"Matched {matched} rows in CSV, changed {changed} rows.")
 
+def submit_shard(shard: str, units, lines, path: Path, ledger) -> str:
+    """Write, upload and create one shard's batch and record it in the ledger."""
+    input_path = build_batch_input_file(units, path, lines)
+    batch_id, input_file_id = submit_batch(input_path)
+    ledger.record(batch_id, input_file_id, shard,
+                  {custom_id_for(u): [r["hash"] for r in u] for u in units},
+                  {custom_id_for(u): u[0]["_attempt"] for u in units if u[0].get("_attempt")})
+    return batch_id
 
-# ---------------------------------------------------------------------------
-# Background polling thread
-# ---------------------------------------------------------------------------
 
-def poll_batch_and_update(batch_id: str, rows, done_event: threading.Event):
+def finish_batch(batch_id: str, units_by_custom_id, label: str, store, pending,
+                 lock: threading.Lock, ledger, tm=None, summary=None) -> bool:
     """
-    Background worker.
+    Wait for one batch and apply its output to the store.
 
-    Polls the batch every BATCH_POLL_SECONDS until it ends.
-    When completed, downloads output, merges into rows, writes CSV,
-    then signals done_event.
+    Runs in a worker thread. Everything that touches the store or the
+    translation memory happens under lock. Returns True when the batch's
+    output was applied.
     """
-    terminal_states = {"completed", "failed", "cancelled", "expired"}
-
-    try:
-        while True:
-            batch = client.batches.retrieve(batch_id)
-            ts = time.strftime("%Y-%m-%d %H:%M:%S")
-            print(f"[{ts}] Batch {batch_id} status: {batch.status}")
-
-            if batch.status in terminal_states:
-                break
-
-            time.sleep(BATCH_POLL_SECONDS)
-
-        if batch.status != "completed":
-            print(f"Batch finished in non success state: {batch.status}")
-            if getattr(batch, "error_file_id", None):
-                print(f"Batch error file id: {batch.error_file_id}")
-            done_event.set()
-            return
-
-        if not batch.output_file_id:
-            print("Batch completed but has no output_file_id")
-            done_event.set()
-            return
-
-        # Download output JSONL
-        file_resp = client.files.content(batch.output_file_id)
-        output_text = file_resp.text
-
-        # Merge results into rows
-        apply_batch_results(rows, output_text)
-
-        # Work out fieldnames from the actual data so extra columns like _row_index are kept
-        fieldnames = sorted({k for r in rows for k in r.keys()})
-
-        with CSV_PATH.open("w", newline="", encoding="utf-8") as f:
-            w = csv.DictWriter(f, fieldnames=fieldnames)
-            w.writeheader()
-            w.writerows(rows)
+    with metrics.timed("translate", "batch_wait_seconds"):
+        batch = wait_for_batch(batch_id, label, ledger)
+
+    if batch.status != "completed":
+        print(f"{label}Batch finished in non success state: {batch.status}")
+        if getattr(batch, "error_file_id", None):
+            print(f"{label}Batch error file id: {batch.error_file_id}")
+        return False
+
+    ledger.update(batch_id, output_file_id=batch.output_file_id,
+                  error_file_id=getattr(batch, "error_file_id", None))
+    if not batch.output_file_id:
+        print(f"{label}Batch completed but has no output_file_id")
+        ledger.update(batch_id, state="failed")
+        return False
+
+    # Stream output (and per-request errors) straight into this batch's rows.
+    sources = [stream_file_lines(batch.output_file_id)]
+    if getattr(batch, "error_file_id", None):
+        sources.append(stream_file_lines(batch.error_file_id))
+    apply_results(sources, units_by_custom_id, label, store, pending, lock, tm, summary)
+    ledger.update(batch_id, state="applied")
+    return True
+
+
+def apply_results(sources, units_by_custom_id, label: str, store, pending,
+                  lock: threading.Lock, tm=None, summary=None) -> None:
+    """
+    Feed result lines (Batch API output format) into the units they belong
+    to, note rejected replies for the retry round, fan results out through
+    the translation memory and save the touched rows.
 
-        print("Translation complete. CSV updated from batch output.")
+    pending holds the pending rows of every variant, tm their translation
+    memories by variant code (or None).
+    """
+    rows = [r for unit in units_by_custom_id.values() for r in unit]
+    applier = ResultApplier(
+        lambda cids: {c: units_by_custom_id[c] for c in cids if c in units_by_custom_id},
+        summary["usage"] if summary is not None else None,
+    )
+    with metrics.timed("translate", "results_seconds"):
+        for lines in sources:
+            applier.feed(lines)
+    applier.report(label)
+    metrics.add("translate", rows_applied=applier.matched, rows_fallback=applier.fallback,
+                item_errors=applier.errors)
+
+    with lock:
+        touched = applier.touched
+        if summary is not None:
+            # Strings with no usable reply are simply still pending; a
+            # rejected reply is kept so the retry can show it to the model.
+            for row, reply in applier.rejected:
+                summary["rejected"][attempt_key(row)] = reply
+
+        if tm is not None:
+            # Only one row per distinct source was sent; copy the accepted
+            # translations to duplicates that are still pending, whichever
+            # shard they were deduplicated from.
+            fanned = fan_out(tm, rows, pending)
+            touched += fanned
+            print(f"{label}Translation memory: copied results to {len(fanned)} duplicate rows.")
+            metrics.add("translate", rows_memory=len(fanned))
+            if summary is not None:
+                summary["memory_rows"] += len(fanned)
+
+        store.save(touched)
+        # Paid-for results go to disk now, even from an in-memory run.
+        store.checkpoint()
+        print(f"{label}{store.path} updated from API results.")
+
+
+def count_requests(units, summary) -> None:
+    metrics.add("translate", requests_submitted=len(units),
+                strings_submitted=sum(len(u) for u in units))
+    for unit in units:
+        summary["usage"]["packed" if len(unit) > 1 else "single"]["requests"] += 1
+
+
+def choose_mode(strings: int) -> str:
+    """"batch" or "realtime" for a run sending this many strings."""
+    if TRANSLATE_MODE == "auto":
+        return "realtime" if strings <= REALTIME_MAX_PENDING else "batch"
+    if TRANSLATE_MODE not in ("batch", "realtime"):
+        raise SystemExit(f"Unknown TRANSLATE_MODE {TRANSLATE_MODE!r}")
+    return TRANSLATE_MODE
+
+
+def run_realtime(units, store, pending, tm, summary) -> None:
+    """Send units as direct requests and apply the results like batch output."""
+    count_requests(units, summary)
+    units_by_custom_id = {custom_id_for(u): u for u in units}
+    with metrics.timed("translate", "realtime_seconds"):
+        lines = translate_all([(cid, request_body(u)) for cid, u in units_by_custom_id.items()])
+    apply_results([lines], units_by_custom_id, "[realtime] ", store, pending,
+                  threading.Lock(), tm, summary)
+
+
+def run_shards(units, store, pending, tm, summary, ledger, reattach=()):
+    """
+    Submit units as shards and wait for them, together with any re-attached
+    (batch_id, {custom_id: rows}) pairs, through a thread pool.
+    Returns (applied, total).
+    """
+    count_requests(units, summary)
+
+    shards = plan_shards(units)
+    total = len(shards) + len(reattach)
+    run_id = time.strftime("%Y%m%d-%H%M%S")
+    if shards:
+        print(f"Submitting {len(shards)} batch shard(s), up to {BATCH_MAX_CONCURRENT} at a time"
+              + (f", at most {BATCH_ENQUEUED_TOKEN_LIMIT:,} input tokens enqueued."
+                 if BATCH_ENQUEUED_TOKEN_LIMIT is not None else "."))
+
+    # Shards wait here while the batches in flight hold the enqueued-token limit.
+    gate = TokenGate(BATCH_ENQUEUED_TOKEN_LIMIT)
+
+    def hold(units) -> None:
+        """Leave units' rows out of this run's attempts (see settle_round)."""
+        with lock:
+            summary["held"].update(attempt_key(r) for u in units for r in u)
+
+    def new_shard(i, shard_units, lines, tokens):
+        label = f"[shard {i}/{len(shards)}] " if len(shards) > 1 else ""
+        gate.acquire(tokens)
+        try:
+            try:
+                batch_id = submit_shard(f"{run_id}/{i:03d}", shard_units, lines,
+                                        shard_input_path(i, len(shards)), ledger)
+            except Exception as exc:
+                # No batch exists, so nothing was sent: not an attempt.
+                hold(shard_units)
+                print(f"{label}Could not submit the shard: {exc!r}; its "
+                      f"{sum(len(u) for u in shard_units)} strings stay pending for the next run.")
+                return False
+            return wait_and_apply(batch_id, {custom_id_for(u): u for u in shard_units}, label)
+        finally:
+            gate.release(tokens)
+
+    def old_batch(batch_id, units_by_cid, tokens):
+        try:
+            return wait_and_apply(batch_id, units_by_cid, f"[{batch_id}] ")
+        finally:
+            gate.release(tokens)
 
-    finally:
-        # Always signal main thread to avoid deadlock
-        done_event.set()
+    def wait_and_apply(batch_id, units_by_cid, label):
+        try:
+            return finish_batch(batch_id, units_by_cid, label, store, pending, lock,
+                                ledger, tm, summary)
+        except Exception as exc:
+            # The batch may still finish: it stays open in the ledger and the
+            # next run re-attaches to it rather than paying for it again.
+            hold(units_by_cid.values())
+            print(f"{label}Lost track of batch {batch_id}: {exc!r}; it stays open and the "
+                  f"next run re-attaches to it.")
+            return False
+
+    lock = threading.Lock()
+    applied = 0
+    with ThreadPoolExecutor(max_workers=max(1, BATCH_MAX_CONCURRENT)) as pool:
+        futures = []
+        for batch_id, units_by_cid in reattach:
+            # Already in the queue: counted at once, never held back.
+            tokens = (sum(request_tokens(u, request_body(u))[0] for u in units_by_cid.values())
+                      if BATCH_ENQUEUED_TOKEN_LIMIT is not None else 0)
+            gate.acquire(tokens, wait=False)
+            futures.append(pool.submit(old_batch, batch_id, units_by_cid, tokens))
+        futures += [
+            pool.submit(new_shard, i, shard_units, lines, tokens)
+            for i, (shard_units, lines, tokens) in enumerate(shards, start=1)
+        ]
+        for fut in as_completed(futures):
+            try:
+                applied += bool(fut.result())
+            except Exception as exc:
+                # One broken shard must not lose the others' results.
+                print(f"Shard failed: {exc!r}")
+    return applied, total
+
+
+def estimate_units(units, mode: str):
+    """(Estimate, input plus expected output tokens of each unit)."""
+    estimate = Estimate()
+    sizes = [estimate.add(u, request_body(u)) for u in units]
+    metrics.add("translate", estimated_input_tokens=estimate.input_tokens,
+                estimated_output_tokens=estimate.output_tokens)
+    print(f"Estimated {estimate.summary(mode == 'batch')}.")
+    return estimate, sizes
+
+
+def fit_budget(units, sizes, left: int):
+    """The leading units whose tokens fit in left, and their tokens."""
+    used = 0
+    for i, n in enumerate(sizes):
+        if used + n > left:
+            return units[:i], used
+        used += n
+    return units, used
+
+
+def within_budget(units, mode: str, summary, first_round: bool = True):
+    """
+    Estimate units and hold them to what is left of TOKEN_BUDGET this run.
+    Over budget, the first round stops the run when OVER_BUDGET is "refuse";
+    otherwise the units that fit, in order, are kept and the rest stay
+    pending for the next run. Returns the units to send.
+    """
+    estimate, sizes = estimate_units(units, mode)
+    left = summary["budget_left"]
+    if left is None or estimate.tokens <= left:
+        if left is not None:
+            summary["budget_left"] = left - estimate.tokens
+        return units
+    if first_round and OVER_BUDGET == "refuse":
+        estimate.report(mode == "batch", top=10)
+        raise SystemExit(f"Estimated {estimate.tokens:,} tokens exceed what is left of "
+                         f"TOKEN_BUDGET ({left:,}); nothing was submitted. Raise TOKEN_BUDGET, "
+                         f'set OVER_BUDGET = "split" or translate fewer strings.')
+    kept, used = fit_budget(units, sizes, left)
+    summary["budget_left"] = left - used
+    held = sum(len(u) for u in units[len(kept):])
+    print(f"TOKEN_BUDGET: sending {len(kept)} of {len(units)} requests ({used:,} of "
+          f"{estimate.tokens:,} estimated tokens); {held} strings stay pending for the next run.")
+    return kept
+
+
+def report_dry_run(units, mode: str, summary, reattach) -> None:
+    """Write the batch input and report the estimate instead of sending."""
+    estimate, sizes = estimate_units(units, mode)
+    batch = mode == "batch"
+    print()
+    estimate.report(batch)
+    left = summary["budget_left"]
+    if left is not None:
+        if estimate.tokens <= left:
+            print(f"Within TOKEN_BUDGET ({TOKEN_BUDGET:,} tokens).")
+        elif OVER_BUDGET == "refuse":
+            print(f"Over TOKEN_BUDGET ({TOKEN_BUDGET:,} tokens): a real run would refuse.")
+        else:
+            kept, used = fit_budget(units, sizes, left)
+            print(f"Over TOKEN_BUDGET ({TOKEN_BUDGET:,} tokens): a real run would send "
+                  f"{len(kept)} of {len(units)} requests ({used:,} tokens).")
+    if batch and units:
+        shards = plan_shards(units)
+        for i, (shard_units, lines, _) in enumerate(shards, start=1):
+            build_batch_input_file(shard_units, shard_input_path(i, len(shards)), lines)
+        print(f"Wrote {len(shards)} batch input file(s) to {BATCH_INPUT_PATH.parent} "
+              f"(nothing uploaded).")
+    if reattach:
+        print(f"{len(reattach)} batch(es) from an earlier run are still open; "
+              f"a real run would wait for them.")
+    atomic_write_text(ESTIMATE_PATH, json.dumps(estimate.to_json(batch), indent=1))
+    print(f"Estimate written to {ESTIMATE_PATH}")
+
+
+def apply_fuzzy(memory, rows, label: str, store, dry_run: bool = False):
+    """
+    Look up pending rows in a fuzzy index of memory. With FUZZY_APPLY, an
+    entry that is the same text apart from placeholder names and spacing,
+    and whose placeholders can be renamed to the row's, translates the row;
+    the best match at or above FUZZY_HINT_SIMILARITY of any other row
+    becomes its request example (_hint). Returns the rows still pending.
+    """
+    if not FUZZY_APPLY and FUZZY_HINT_SIMILARITY is None:
+        return rows
+    with metrics.timed("translate", "fuzzy_seconds"):
+        index = FuzzyIndex(memory.entries())
+        if not len(index):
+            return rows
+        matches = {}
+        applied, hinted = [], 0
+        for r in rows:
+            source = r["source_text"]
+            if FUZZY_APPLY:
+                same = index.same(source)
+                text = adapt(same, r) if same is not None else None
+                if text is not None and text != source:
+                    r["translated_text"] = text
+                    r["status"] = "ok"
+                    applied.append(r)
+                    continue
+            if FUZZY_HINT_SIMILARITY is None:
+                continue
+            if source not in matches:
+                matches[source] = index.best(source, FUZZY_HINT_SIMILARITY)
+            if matches[source] is not None:
+                r["_hint"] = matches[source]
+                hinted += 1
+    if applied and not dry_run:
+        store.save(applied)
+    metrics.add("translate", rows_fuzzy=len(applied), rows_fuzzy_hinted=hinted)
+    if applied or hinted:
+        print(f"{label}Fuzzy memory ({len(index)} entries) translated {len(applied)} rows "
+              f"from close matches; {hinted} rows get an example in their request.")
+    return [r for r in rows if r["status"] == "pending"]
+
+
+def attempt_key(row) -> tuple:
+    """(variant code, hash): a string as sent for one variant."""
+    return variant_of(row).code, row["hash"]
+
+
+def settle_round(sent, store, pending, tm, summary):
+    """
+    Sort out the strings sent in a round once their results are in.
+
+    A string succeeded if it is no longer pending and its reply was not
+    rejected. The others are retried on their next attempt or, once they
+    reach MAX_ATTEMPTS, given up on ("failed", or "fallback" for a rejected
+    reply), together with their pending duplicates. Strings in
+    summary["held"] (a shard that was never submitted, or a batch still
+    open) were not attempted and are left as they are. Counts go to
+    summary["attempts"] ({attempt: [sent, succeeded]}) and
+    summary["given_up"]. Returns the rows to retry.
+    """
+    retry, changed, given_up = [], [], []
+    for r in sent:
+        if attempt_key(r) in summary["held"]:
+            continue
+        attempt = r.get("_attempt") or 1
+        reply = summary["rejected"].pop(attempt_key(r), None)
+        counts = summary["attempts"].setdefault(attempt, [0, 0])
+        counts[0] += 1
+        if r["status"] != "pending" and reply is None:
+            counts[1] += 1
+            continue
+        if attempt >= MAX_ATTEMPTS:
+            if r["status"] == "pending":
+                r["status"] = "failed"
+                changed.append(r)
+            given_up.append(r)
+            continue
+        r["_attempt"] = attempt + 1
+        r["_rejected"] = reply or ""
+        if reply is not None:
+            # Pending again until the retry lands, so an interrupted run
+            # re-attaches to it.
+            r["translated_text"] = ""
+            r["status"] = "pending"
+            changed.append(r)
+        retry.append(r)
+
+    if given_up and tm is not None:
+        # Duplicates were waiting for these strings' results.
+        outcome = {(variant_of(r).code, tm[variant_of(r).code].key(r["source_text"])): r
+                   for r in given_up}
+        for r in pending:
+            code = variant_of(r).code
+            done = r["status"] == "pending" and outcome.get((code, tm[code].key(r["source_text"])))
+            if done:
+                r["translated_text"] = r["source_text"] if done["status"] == "fallback" else ""
+                r["status"] = done["status"]
+                changed.append(r)
+    for r in given_up:
+        summary["given_up"][r["status"]] += 1
+    if changed:
+        store.save(changed)
+        store.checkpoint()
+    metrics.add("translate", rows_retried=len(retry), rows_given_up=len(given_up))
+    return retry
+
+
+def print_attempts(summary) -> None:
+    """Per-attempt success rates and the strings given up on."""
+    for attempt, (sent, ok) in sorted(summary["attempts"].items()):
+        print(f"Attempt {attempt}: {ok} of {sent} strings succeeded ({ok / sent:.1%}).")
+        metrics.add("translate", **{f"attempt{attempt}_strings": sent,
+                                    f"attempt{attempt}_succeeded": ok})
+    given_up = summary["given_up"]
+    if given_up:
+        print(f"Gave up on {sum(given_up.values())} strings after {MAX_ATTEMPTS} attempts ("
+              + ", ".join(f"{n} {status}" for status, n in sorted(given_up.items())) + ").")
+
+
+def print_usage(usage) -> None:
+    for mode in ("single", "packed"):
+        u = usage[mode]
+        if u["requests"]:
+            print(f"{mode:>6}: {u['requests']} requests, {u['input_tokens']} input tokens, "
+                  f"{u['output_tokens']} output tokens")
 
 
 # ---------------------------------------------------------------------------
 # Main
 # ---------------------------------------------------------------------------
 
-def main():
-    # Load CSV
-    with CSV_PATH.open(newline="", encoding="utf-8") as f:
-        rows = list(csv.DictReader(f))
-
-    # Add in memory row index so each custom_id is unique
-    for idx, row in enumerate(rows):
-        row["_row_index"] = idx
-
-    pending = [r for r in rows if r.get("status") == "pending"]
-
-    if not pending:
+def translate(store, dry_run: bool = False) -> None:
+    """Translate the pending rows of every variant in store (rules, memory,
+    then one combined round of API requests). With dry_run, only estimate
+    the requests (see report_dry_run()); the store and the translation
+    memory are left alone."""
+    if TOKEN_BUDGET is not None and OVER_BUDGET not in ("refuse", "split"):
+        raise SystemExit(f"Unknown OVER_BUDGET {OVER_BUDGET!r}; use 'refuse' or 'split'")
+    summary = {"memory_rows": 0, "rejected": {}, "attempts": {}, "held": set(),
+               "given_up": defaultdict(int), "budget_left": TOKEN_BUDGET,
+               "usage": {"single": new_usage(), "packed": new_usage()}}
+    tm = {} if TRANSLATION_MEMORY else None
+    pending = []
+    for variant in VARIANTS:
+        label = f"[{variant.code}] " if len(VARIANTS) > 1 else ""
+        rows = store.pending(variant)
+
+        if variant.rules_mode != "off" and rows:
+            # Fixed phrases and the rows the glossary and regex rules fully
+            # cover are resolved locally; only the rest needs the model.
+            resolved = rule_engine(variant).resolve(rows)
+            if resolved and not dry_run:
+                store.save(resolved)
+                metrics.add("translate", rows_rules=len(resolved))
+                print(f"{label}Local rules resolved {len(resolved)} rows without an API call.")
+            rows = [r for r in rows if r["status"] == "pending"]
+
+        if tm is not None:
+            memory = tm[variant.code] = TranslationMemory(style=variant.style,
+                                                          read_only=dry_run)
+            if rows:
+                # Seed the memory with accepted rows, including hand edits made
+                # since the last run, then fill whatever it already knows.
+                memory.record(store.translated(variant))
+                filled = memory.fill(rows)
+                if filled and not dry_run:
+                    store.save(filled)
+                    summary["memory_rows"] += len(filled)
+                    metrics.add("translate", rows_memory=len(filled))
+                    print(f"{label}Translation memory filled {len(filled)} rows "
+                          f"without an API call.")
+                rows = [r for r in rows if r["status"] == "pending"]
+                if FUZZY_MATCH and rows:
+                    rows = apply_fuzzy(memory, rows, label, store, dry_run)
+        pending += rows
+
+    # Re-attach to batches a previous run submitted but never applied.
+    # Rows are keyed by (variant, hash): the same string is a separate
+    # request for every variant.
+    ledger = BatchLedger()
+    pending_by_key = {}
+    for r in pending:
+        pending_by_key.setdefault((variant_of(r).code, r["hash"]), r)
+    open_batches = ledger.open_batches()
+    # A run that gave up on strings whose batch then finished anyway: the
+    # re-attached batch resolves them too.
+    wanted = defaultdict(set)
+    for entry in open_batches.values():
+        for cid, hashes in entry["requests"].items():
+            variant = split_custom_id(cid)[1]
+            if variant is not None:
+                wanted[variant.code].update(h for h in hashes
+                                            if (variant.code, h) not in pending_by_key)
+    recovered = []
+    for variant in VARIANTS:
+        if wanted[variant.code]:
+            for h, r in store.get(wanted[variant.code], variant).items():
+                if r["status"] == "failed":
+                    r["status"] = "pending"
+                    pending_by_key[(variant.code, h)] = r
+                    recovered.append(r)
+    if recovered and tm is not None:
+        # Their duplicates were given up on with them; the results fan out
+        # to them again.
+        sources = {(variant_of(r).code, tm[variant_of(r).code].key(r["source_text"]))
+                   for r in recovered}
+        for variant in VARIANTS:
+            for r in store.all_rows():
+                if (status_of(r, variant) == "failed" and r["hash"] not in wanted[variant.code]
+                        and (variant.code, tm[variant.code].key(r["source_text"])) in sources):
+                    r = view(r, variant)
+                    r["status"] = "pending"
+                    pending.append(r)
+    reattach = []
+    inflight = set()
+    for batch_id, entry in open_batches.items():
+        units_by_cid = {}
+        attempts = entry.get("attempts", {})
+        for cid, hashes in entry["requests"].items():
+            variant = split_custom_id(cid)[1]
+            if variant is None:
+                continue  # a variant that is no longer configured
+            keys = [(variant.code, h) for h in hashes]
+            inflight.update(keys)
+            unit = [pending_by_key[k] for k in keys if k in pending_by_key]
+            if unit:
+                units_by_cid[cid] = unit
+                if cid in attempts:
+                    unit[0]["_attempt"] = attempts[cid]
+        reattach.append((batch_id, units_by_cid))
+    if reattach:
+        print(f"Re-attaching to {len(reattach)} batch(es) from an earlier run.")
+
+    # Rows with the same hash are the same string; one request covers them all.
+    fresh = [r for k, r in pending_by_key.items() if k not in inflight]
+    if tm is not None and inflight:
+        # Duplicates of in-flight strings are filled when their batch returns.
+        waiting = {(k[0], tm[k[0]].key(r["source_text"]))
+                   for k, r in pending_by_key.items() if k in inflight}
+        fresh = [r for r in fresh
+                 if (variant_of(r).code, tm[variant_of(r).code].key(r["source_text"]))
+                 not in waiting]
+
+    if not fresh and not reattach:
         print("No pending strings to translate.")
+        for memory in (tm or {}).values():
+            memory.close()
         return
 
-    print(f"{len(pending)} strings pending translation")
-
-    # Build JSONL input
-    input_path = build_batch_input_file(pending)
-
-    # Submit batch
-    batch_id = submit_batch(input_path)
-
-    # Set up background polling thread
-    done_event = threading.Event()
-    t = threading.Thread(
-        target=poll_batch_and_update,
-        args=(batch_id, rows, done_event),
-        daemon=True,
-    )
-    t.start()
-
-    print(
-        "Batch submitted. Background thread will poll periodically "
-        "until processing completes."
-    )
-
-    # Wait until the background worker has finished updating the CSV
-    done_event.wait()
-    print("Batch processing finished. Exiting translate_csv.")
+    print(f"{len(fresh)} strings pending translation"
+          + (f" ({len(pending_by_key) - len(fresh)} more waiting on submitted batches)"
+             if inflight else ""))
+    if len(VARIANTS) > 1:
+        counts = defaultdict(int)
+        for r in fresh:
+            counts[variant_of(r).code] += 1
+        print("  " + ", ".join(f"{v.code}: {counts[v.code]}" for v in VARIANTS))
+
+    # Identical strings are sent once per variant; results fan out when they
+    # come back. The variants' requests then go out together.
+    to_send = []
+    for variant in VARIANTS:
+        rows = [r for r in fresh if variant_of(r) is variant]
+        to_send += tm[variant.code].dedupe(rows) if tm is not None else rows
+    if len(to_send) < len(fresh):
+        print(f"Collapsed {len(fresh) - len(to_send)} duplicate strings; "
+              f"sending {len(to_send)} distinct strings.")
+
+    units = pack_rows(to_send)
+    if PACK_STRINGS_PER_REQUEST > 1 and units:
+        print(f"Packed {len(to_send)} strings into {len(units)} requests.")
+    mode = choose_mode(len(to_send))
+    if dry_run:
+        report_dry_run(units, mode, summary, reattach)
+        for memory in (tm or {}).values():
+            memory.close()
+        return
+    if units:
+        units = within_budget(units, mode, summary)
+        to_send = [r for unit in units for r in unit]
+        print(f"Sending {len(units)} requests in {mode} mode.")
+    if mode == "realtime":
+        run_realtime(units, store, pending, tm, summary)
+        units = []
+    # Re-attached batches are always waited for, whatever the mode.
+    applied, total = run_shards(units, store, pending, tm, summary, ledger, reattach)
+
+    # Strings without a usable result go round again, one per request with
+    # the corrective prompt, until they succeed or run out of attempts.
+    sent = to_send + [r for _, units_by_cid in reattach
+                      for unit in units_by_cid.values() for r in unit]
+    retry = settle_round(sent, store, pending, tm, summary)
+    while retry:
+        mode = choose_mode(len(retry))
+        retry = [r for unit in within_budget(pack_rows(retry, 1), mode, summary, False)
+                 for r in unit]
+        if not retry:
+            break
+        attempts = sorted({r["_attempt"] for r in retry})
+        print(f"Retrying {len(retry)} strings (attempt {'/'.join(map(str, attempts))} "
+              f"of {MAX_ATTEMPTS}) in {mode} mode.")
+        if mode == "realtime":
+            run_realtime(pack_rows(retry, 1), store, pending, tm, summary)
+        else:
+            more_applied, more_total = run_shards(pack_rows(retry, 1), store, pending, tm,
+                                                  summary, ledger)
+            applied += more_applied
+            total += more_total
+        retry = settle_round(retry, store, pending, tm, summary)
+
+    print_attempts(summary)
+    print_usage(summary["usage"])
+    metrics.add("translate",
+                input_tokens=sum(u["input_tokens"] for u in summary["usage"].values()),
+                output_tokens=sum(u["output_tokens"] for u in summary["usage"].values()))
+    if tm is not None:
+        for memory in tm.values():
+            memory.close()
+        print(f"Translation memory saved {summary['memory_rows']} rows from the API this run.")
+    if total:
+        print(f"Batch processing finished ({applied}/{total} shards applied).")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Translate pending rows through the OpenAI API.")
+    ap.add_argument("--dry-run", action="store_true",
+                    help="write the batch input and estimate tokens and cost; send nothing")
+    args = ap.parse_args(argv)
+
+    ensure_dirs()
+    store = open_store()
+    try:
+        translate(store, dry_run=args.dry_run)
+    finally:
+        store.close()
+    print("Exiting translate_csv.")
 
 
 if __name__ == "__main__":
     main()
-
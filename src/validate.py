@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Re-check the placeholders and tags of every translated row in the store,
+for every variant.
+
+    py -m src.validate [--requeue] [--workers N] [--dry-run]
+
+Run this after changing PLACEHOLDER_PATTERNS (or after editing translations
+by hand). Every row whose translation differs from its source is checked
+with the same rule the translator applies to new results; rows that no longer pass fall back to the
+source text (status "fallback"), or with --requeue go back to "pending" so
+the next translate_csv run asks for them again. --requeue also puts strings
+the translator gave up on (status "failed") back to pending.
+
+The checks are spread over worker processes in chunks; only (hash, source,
+translation) tuples cross the process boundary.
+"""
+
+import argparse
+import os
+from typing import List, Tuple
+
+from src.common import token_signature, chunk
+from src.store import open_store
+from src.variants import VARIANTS, variant_of, tag_custom_id, view, status_of
+
+# Rows per task handed to a worker.
+CHUNK_ROWS = 5000
+
+
+def check_chunk(items: List[Tuple[str, str, str]]) -> List[str]:
+    """Return the ids of (id, source, translation) items that fail."""
+    return [h for h, src, tgt in items if token_signature(src) != token_signature(tgt)]
+
+
+def find_mismatches(items: List[Tuple[str, str, str]], workers: int = 0) -> List[str]:
+    workers = workers or os.cpu_count() or 1
+    chunks = list(chunk(items, CHUNK_ROWS))
+    if workers <= 1 or len(chunks) < 2:
+        return [h for part in map(check_chunk, chunks) for h in part]
+    from concurrent.futures import ProcessPoolExecutor  # only needed with workers
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return [h for part in pool.map(check_chunk, chunks) for h in part]
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Re-validate placeholders and tags of translated rows.")
+    ap.add_argument("--requeue", action="store_true",
+                    help="set failing rows back to pending instead of falling back to the source")
+    ap.add_argument("--workers", type=int, default=0,
+                    help="worker processes (default: one per CPU core; 1 = no workers)")
+    ap.add_argument("--dry-run", action="store_true", help="report only, do not save")
+    args = ap.parse_args(argv)
+
+    store = open_store()
+    rows = [r for v in VARIANTS for r in store.translated(v)]
+    # A row is identified by its hash tagged with its variant, as in custom_ids.
+    items = [(tag_custom_id(r["hash"], variant_of(r)), r["source_text"], r["translated_text"])
+             for r in rows]
+    print(f"Checking {len(items)} translated rows")
+
+    bad = set(find_mismatches(items, args.workers))
+    failed = [r for r, item in zip(rows, items) if item[0] in bad]
+    for r in failed[:20]:
+        label = f"[{variant_of(r).code}] " if len(VARIANTS) > 1 else ""
+        print(f"  {label}{r['component']}:{r['key']}: {r['translated_text']!r}")
+    if len(failed) > 20:
+        print(f"  ... and {len(failed) - 20} more")
+
+    given_up = []
+    if args.requeue:
+        given_up = [view(r, v) for r in store.all_rows() for v in VARIANTS
+                    if status_of(r, v) == "failed"]
+
+    if (failed or given_up) and not args.dry_run:
+        for r in failed:
+            if args.requeue:
+                r["translated_text"] = ""
+                r["status"] = "pending"
+            else:
+                r["translated_text"] = r["source_text"]
+                r["status"] = "fallback"
+        for r in given_up:
+            r["status"] = "pending"
+        store.save(failed + given_up)
+    store.close()
+
+    action = "would change" if args.dry_run else ("requeued" if args.requeue else "fell back")
+    print(f"{len(failed)} of {len(items)} rows failed validation ({action}).")
+    if given_up:
+        print(f"{len(given_up)} rows given up on by the translator "
+              f"{'would go' if args.dry_run else 'went'} back to pending.")
+
+
+if __name__ == "__main__":
+    main()
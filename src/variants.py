@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Several language variants built from one extraction.
+
+VARIANT_CODE, VARIANT_NAME, PARENT_LANGUAGE, TARGET_STYLE and the RULES_*
+settings describe the primary variant, whose translations live in the
+translated_text/status columns as they always have. Every entry of
+EXTRA_VARIANTS adds a variant that shares the same source rows but keeps its
+translations in its own pair of columns,
+
+    translated_text__<code>   status__<code>
+
+in strings.csv (the SQLite store keeps them in a `translations` table). A
+row with no status for a variant is pending for it, so strings that are new
+or changed after an extraction are picked up by every variant.
+
+The stages see a variant's rows through views (view()): copies of the
+source fields whose translated_text/status come from the variant's columns,
+marked with _variant. Rules, translation memory, result application and
+validation work on views as on any row, and the stores write a saved view
+back into its variant's columns. The primary variant's "views" are the rows
+themselves. Requests for an extra variant end their custom_id with
+"@<code>".
+"""
+
+import re
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from config import (VARIANT_CODE, VARIANT_NAME, PARENT_LANGUAGE, TARGET_STYLE,
+                    RULES_MODE, FIXED_PHRASES, GLOSSARY, REGEX_RULES, EXTRA_VARIANTS)
+from src.row import Row
+
+TEXT_PREFIX = "translated_text__"
+STATUS_PREFIX = "status__"
+
+_CODE_RE = re.compile(r"[A-Za-z0-9_]+")
+
+
+class Variant(NamedTuple):
+    code: str
+    name: str
+    parent: str
+    style: str
+    rules_mode: str
+    fixed_phrases: Dict[str, str]
+    glossary: Dict[str, str]
+    regex_rules: List[Tuple[str, str]]
+    primary: bool = False
+
+    @property
+    def text_col(self) -> str:
+        return "translated_text" if self.primary else TEXT_PREFIX + self.code
+
+    @property
+    def status_col(self) -> str:
+        return "status" if self.primary else STATUS_PREFIX + self.code
+
+
+def _load() -> List[Variant]:
+    variants = [Variant(VARIANT_CODE, VARIANT_NAME, PARENT_LANGUAGE, TARGET_STYLE,
+                        RULES_MODE, FIXED_PHRASES, GLOSSARY, REGEX_RULES, primary=True)]
+    for spec in EXTRA_VARIANTS:
+        code = spec.get("code", "")
+        if not _CODE_RE.fullmatch(code):
+            raise SystemExit(f"EXTRA_VARIANTS: code {code!r} must be letters, digits and _")
+        if code in (v.code for v in variants):
+            raise SystemExit(f"EXTRA_VARIANTS: variant {code!r} is declared twice")
+        if "style" not in spec:
+            raise SystemExit(f"EXTRA_VARIANTS: variant {code!r} needs a style")
+        variants.append(Variant(
+            code, spec.get("name", code), spec.get("parent", PARENT_LANGUAGE), spec["style"],
+            spec.get("rules_mode", "covered"), spec.get("fixed_phrases", {}),
+            spec.get("glossary", {}), spec.get("regex_rules", [])))
+    return variants
+
+
+# Every configured variant, the primary one first.
+VARIANTS = _load()
+PRIMARY = VARIANTS[0]
+_BY_CODE = {v.code: v for v in VARIANTS[1:]}
+
+
+def variant_of(row: Row) -> Variant:
+    """The variant a row (or view) belongs to."""
+    code = row.get("_variant")
+    return _BY_CODE[code] if code else PRIMARY
+
+
+def status_of(row: Row, variant: Variant) -> str:
+    if variant.primary:
+        return row.get("status") or ""
+    return row.get(variant.status_col) or "pending"
+
+
+def view(row: Row, variant: Variant) -> Row:
+    """row as seen by variant (the row itself for the primary variant)."""
+    if variant.primary:
+        return row
+    return Row(row["component"], row["relpath"], row["sourcefile"], row["key"],
+               row["source_text"], row.get(variant.text_col) or "", status_of(row, variant),
+               row["hash"], _row_index=row.get("_row_index"), _variant=variant.code)
+
+
+def is_variant_column(name: str) -> bool:
+    return name.startswith(TEXT_PREFIX) or name.startswith(STATUS_PREFIX)
+
+
+def variant_columns(row: Row) -> Dict[str, Tuple[str, str]]:
+    """{code: (translated_text, status)} of the extra-variant columns a row
+    carries, configured or not."""
+    found = {}
+    for name in row.extra_columns():
+        if name.startswith(STATUS_PREFIX) and row[name]:
+            code = name[len(STATUS_PREFIX):]
+            found[code] = (row.get(TEXT_PREFIX + code) or "", row[name])
+    return found
+
+
+def tag_custom_id(custom_id: str, variant: Variant) -> str:
+    return custom_id if variant.primary else f"{custom_id}@{variant.code}"
+
+
+def split_custom_id(custom_id: str) -> Tuple[str, Optional[Variant]]:
+    """(custom_id without the variant tag, variant). The variant is None when
+    the tag names a variant that is no longer configured."""
+    base, sep, code = custom_id.rpartition("@")
+    if not sep:
+        return custom_id, PRIMARY
+    return base, _BY_CODE.get(code)